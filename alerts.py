@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+هشدارهای قیمت
+
+انواع هشدار (kind):
+- above / below        عبور قیمت از یک سطح به سمت بالا/پایین
+- move_up / move_down  حرکت درصدی قیمت نسبت به کمینه/بیشینه‌ی window_seconds گذشته
+
+نمادها: btc_usd (قیمت بیت‌کوین به دلار) و usdt_toman (قیمت تتر به تومان)
+
+برای هر (نماد، نوع، پنجره) آستانه‌ها در یک آرایه مرتب نگه داشته می‌شوند؛ در هر tick قیمت فقط با
+دو bisect بازه‌ی هشدارهایی که بین قیمت قبلی و فعلی قرار دارند پیدا می‌شود (O(log n) به ازای هر
+آرایه، بدون پیمایش همه هشدارها). هشدارها یک‌بارمصرف هستند: بعد از فعال شدن غیرفعال می‌شوند و
+یک ردیف در alert_outbox برای ارسال ثبت می‌شود.
+
+ایندکس فقط در پروسه‌ای ساخته می‌شود که کار price_refresh را اجرا می‌کند؛ هشدارهایی که در
+workerهای دیگر ساخته/حذف می‌شوند از طریق change_log به ایندکس اعمال می‌شوند.
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import RESET_MARKER, get_db_connection
+
+SYMBOLS = ("btc_usd", "usdt_toman")
+LEVEL_KINDS = ("above", "below")
+MOVE_KINDS = ("move_up", "move_down")
+ALERT_KINDS = LEVEL_KINDS + MOVE_KINDS
+MAX_WINDOW_SECONDS = 7 * 24 * 3600
+OUTBOX_STATUSES = ("pending", "sent", "failed")
+
+logger = logging.getLogger(__name__)
+
+
+class SortedThresholds:
+    """Thresholds kept sorted in parallel arrays, with the alert id of each entry."""
+
+    def __init__(self):
+        self.keys: List[float] = []
+        self.ids: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, threshold: float, alert_id: int) -> None:
+        i = bisect_right(self.keys, threshold)
+        self.keys.insert(i, threshold)
+        self.ids.insert(i, alert_id)
+
+    def remove(self, threshold: float, alert_id: int) -> bool:
+        i = bisect_left(self.keys, threshold)
+        while i < len(self.keys) and self.keys[i] == threshold:
+            if self.ids[i] == alert_id:
+                del self.keys[i]
+                del self.ids[i]
+                return True
+            i += 1
+        return False
+
+    def ids_between(self, lo: int, hi: int) -> List[int]:
+        return self.ids[lo:hi]
+
+
+class RollingMinMax:
+    """Min and max of the prices seen in the last `window` seconds (monotonic deques, O(1) amortized)."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._min: deque = deque()
+        self._max: deque = deque()
+
+    def push(self, ts: float, price: float) -> None:
+        while self._min and self._min[-1][1] >= price:
+            self._min.pop()
+        self._min.append((ts, price))
+        while self._max and self._max[-1][1] <= price:
+            self._max.pop()
+        self._max.append((ts, price))
+        cutoff = ts - self.window
+        while self._min[0][0] < cutoff:
+            self._min.popleft()
+        while self._max[0][0] < cutoff:
+            self._max.popleft()
+
+    def low(self) -> float:
+        return self._min[0][1]
+
+    def high(self) -> float:
+        return self._max[0][1]
+
+
+class AlertIndex:
+    """In-memory index of the active alerts, matched against consecutive price ticks."""
+
+    def __init__(self):
+        # (symbol, kind, window_seconds) -> thresholds; window is 0 for level alerts
+        self.books: Dict[Tuple[str, str, int], SortedThresholds] = {}
+        self.windows: Dict[Tuple[str, int], RollingMinMax] = {}
+        self.alerts: Dict[int, Tuple[str, str, int, float]] = {}
+        self.last_price: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+    def add(self, alert_id: int, symbol: str, kind: str, threshold: float, window: int = 0) -> None:
+        self.discard(alert_id)
+        window = int(window or 0) if kind in MOVE_KINDS else 0
+        key = (symbol, kind, window)
+        self.books.setdefault(key, SortedThresholds()).add(threshold, alert_id)
+        if window and (symbol, window) not in self.windows:
+            self.windows[(symbol, window)] = RollingMinMax(window)
+        self.alerts[alert_id] = (symbol, kind, window, threshold)
+
+    def discard(self, alert_id: int) -> None:
+        entry = self.alerts.pop(alert_id, None)
+        if entry is None:
+            return
+        symbol, kind, window, threshold = entry
+        book = self.books.get((symbol, kind, window))
+        if book is not None:
+            book.remove(threshold, alert_id)
+            if not book:
+                del self.books[(symbol, kind, window)]
+        if window and not any(k[0] == symbol and k[2] == window for k in self.books):
+            self.windows.pop((symbol, window), None)
+
+    def match(self, symbol: str, price: float, ts: float) -> List[Tuple[int, Dict[str, Any]]]:
+        """Alerts crossed by moving from the previous price of `symbol` to `price`.
+
+        Returns [(alert_id, details)] without removing them; call discard() once persisted.
+        """
+        previous = self.last_price.get(symbol)
+        self.last_price[symbol] = price
+        fired: List[Tuple[int, Dict[str, Any]]] = []
+        if previous is not None and price != previous:
+            if price > previous:
+                book = self.books.get((symbol, "above", 0))
+                if book:
+                    # previous < threshold <= price
+                    lo, hi = bisect_right(book.keys, previous), bisect_right(book.keys, price)
+                    fired.extend((i, {"previous_price": previous}) for i in book.ids_between(lo, hi))
+            else:
+                book = self.books.get((symbol, "below", 0))
+                if book:
+                    # price <= threshold < previous
+                    lo, hi = bisect_left(book.keys, price), bisect_left(book.keys, previous)
+                    fired.extend((i, {"previous_price": previous}) for i in book.ids_between(lo, hi))
+
+        for (win_symbol, window), rolling in self.windows.items():
+            if win_symbol != symbol:
+                continue
+            rolling.push(ts, price)
+            low, high = rolling.low(), rolling.high()
+            moves = (
+                ("move_up", (price - low) / low * 100 if low > 0 else 0.0, low),
+                ("move_down", (high - price) / high * 100 if high > 0 else 0.0, high),
+            )
+            for kind, move, reference in moves:
+                book = self.books.get((symbol, kind, window))
+                if book and move > 0:
+                    # every threshold <= the move seen in the window
+                    hi = bisect_right(book.keys, move)
+                    fired.extend((i, {"move_pct": round(move, 4), "reference_price": reference}) for i in book.ids_between(0, hi))
+        return fired
+
+
+# ----------------------------------------------------------------------------
+# Engine: index + persistence
+# ----------------------------------------------------------------------------
+_index = AlertIndex()
+_index_lock = threading.Lock()
+_state = {"loaded": False, "change_version": 0}
+
+
+def _row_to_index(row) -> None:
+    if row is None or not row["is_active"]:
+        return
+    _index.add(int(row["id"]), row["symbol"], row["kind"], float(row["threshold"]), int(row["window_seconds"] or 0))
+
+
+def _load_index(cur) -> None:
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+    _state["change_version"] = int(cur.fetchone()[0])
+    cur.execute("SELECT id, symbol, kind, threshold, window_seconds, is_active FROM price_alerts WHERE is_active = 1")
+    for row in cur.fetchall():
+        _row_to_index(row)
+    _state["loaded"] = True
+    logger.info(f"[alerts] index loaded with {len(_index)} active alert(s)")
+
+
+def _sync_index(cur) -> None:
+    """Apply alerts created/edited/deleted (possibly by other processes) since the last sync."""
+    if not _state["loaded"]:
+        _load_index(cur)
+        return
+    cur.execute(
+        "SELECT table_name, row_id FROM change_log WHERE version > ? AND table_name IN ('price_alerts', ?) ORDER BY version",
+        (_state["change_version"], RESET_MARKER),
+    )
+    entries = cur.fetchall()
+    if any(e["table_name"] == RESET_MARKER for e in entries):
+        # Tables were dropped and recreated: rebuild from scratch
+        for alert_id in list(_index.alerts):
+            _index.discard(alert_id)
+        _load_index(cur)
+        return
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+    _state["change_version"] = int(cur.fetchone()[0])
+    touched = {int(e["row_id"]) for e in entries}
+    for alert_id in touched:
+        _index.discard(alert_id)
+        cur.execute("SELECT id, symbol, kind, threshold, window_seconds, is_active FROM price_alerts WHERE id = ?", (alert_id,))
+        _row_to_index(cur.fetchone())
+
+
+def _message(alert, price: float, details: Dict[str, Any]) -> str:
+    unit = "$" if alert["symbol"] == "btc_usd" else "تومان "
+    if alert["kind"] == "above":
+        return f"{alert['symbol']} از {unit}{alert['threshold']:,.2f} بالاتر رفت (قیمت: {unit}{price:,.2f})"
+    if alert["kind"] == "below":
+        return f"{alert['symbol']} از {unit}{alert['threshold']:,.2f} پایین‌تر رفت (قیمت: {unit}{price:,.2f})"
+    direction = "رشد" if alert["kind"] == "move_up" else "افت"
+    return f"{alert['symbol']} در {alert['window_seconds']} ثانیه {details.get('move_pct', 0):.2f}٪ {direction} داشت (قیمت: {unit}{price:,.2f})"
+
+
+def process_tick(prices: Dict[str, Optional[float]], ts: Optional[float] = None) -> int:
+    """Match one price tick against the index; persist fired alerts to the outbox. Returns how many fired."""
+    ts = ts or time.time()
+    with _index_lock:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            _sync_index(cur)
+            fired: List[Tuple[int, str, float, Dict[str, Any]]] = []
+            for symbol in SYMBOLS:
+                price = prices.get(symbol)
+                if price:
+                    fired.extend((alert_id, symbol, float(price), details) for alert_id, details in _index.match(symbol, float(price), ts))
+            if not fired:
+                return 0
+
+            now = datetime.utcnow().isoformat(timespec="seconds")
+            ids = [f[0] for f in fired]
+            cur.execute(f"SELECT * FROM price_alerts WHERE id IN ({','.join('?' * len(ids))})", ids)
+            alerts = {int(r["id"]): r for r in cur.fetchall()}
+            count = 0
+            for alert_id, symbol, price, details in fired:
+                alert = alerts.get(alert_id)
+                if alert is None:
+                    continue
+                cur.execute(
+                    "UPDATE price_alerts SET is_active = 0, triggered_at = ?, triggered_price = ? WHERE id = ? AND is_active = 1",
+                    (now, price, alert_id),
+                )
+                if cur.rowcount != 1:
+                    continue  # already fired (or deactivated) by another writer
+                count += 1
+                payload = {"alert_id": alert_id, "symbol": symbol, "kind": alert["kind"], "threshold": alert["threshold"], "price": price, **details}
+                cur.execute(
+                    "INSERT INTO alert_outbox(created_at, alert_id, message, payload, status, attempts) VALUES(?, ?, ?, ?, 'pending', 0)",
+                    (now, alert_id, _message(alert, price, details), json.dumps(payload, ensure_ascii=False)),
+                )
+            conn.commit()
+            # Only now that they are persisted do the alerts leave the index
+            for alert_id in ids:
+                _index.discard(alert_id)
+            if count:
+                logger.info(f"[alerts] {count} alert(s) fired")
+            return count
+        finally:
+            conn.close()
+
+
+def on_price_tick(prices: Dict[str, Optional[float]]) -> None:
+    """price_fetcher tick listener."""
+    try:
+        process_tick(prices)
+    except Exception as e:
+        logger.error(f"[alerts] tick processing failed: {e}")
+
+
+# ----------------------------------------------------------------------------
+# CRUD used by the API
+# ----------------------------------------------------------------------------
+def _alert_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "symbol": row["symbol"],
+        "kind": row["kind"],
+        "threshold": float(row["threshold"]),
+        "window_seconds": row["window_seconds"],
+        "note": row["note"],
+        "is_active": bool(row["is_active"]),
+        "triggered_at": row["triggered_at"],
+        "triggered_price": row["triggered_price"],
+    }
+
+
+def validate_alert(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalized alert fields from an API payload; raises ValueError with a message."""
+    symbol = str(payload.get("symbol", "btc_usd")).strip()
+    kind = str(payload.get("kind", "")).strip()
+    if symbol not in SYMBOLS:
+        raise ValueError(f"symbol must be one of {', '.join(SYMBOLS)}")
+    if kind not in ALERT_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(ALERT_KINDS)}")
+    try:
+        threshold = float(payload.get("threshold"))
+    except (TypeError, ValueError):
+        raise ValueError("threshold must be a number")
+    if threshold <= 0:
+        raise ValueError("threshold must be > 0")
+    window = None
+    if kind in MOVE_KINDS:
+        try:
+            window = int(payload.get("window_seconds"))
+        except (TypeError, ValueError):
+            raise ValueError("window_seconds is required for move alerts")
+        if not 60 <= window <= MAX_WINDOW_SECONDS:
+            raise ValueError(f"window_seconds must be between 60 and {MAX_WINDOW_SECONDS}")
+    note = str(payload.get("note") or "").strip()[:200] or None
+    return {"symbol": symbol, "kind": kind, "threshold": threshold, "window_seconds": window, "note": note}
+
+
+def create_alert(fields: Dict[str, Any], conn) -> Dict[str, Any]:
+    cur = conn.cursor()
+    created_at = datetime.utcnow().isoformat(timespec="seconds")
+    cur.execute(
+        "INSERT INTO price_alerts(created_at, symbol, kind, threshold, window_seconds, note, is_active) VALUES(?, ?, ?, ?, ?, ?, 1)",
+        (created_at, fields["symbol"], fields["kind"], fields["threshold"], fields["window_seconds"], fields["note"]),
+    )
+    conn.commit()
+    cur.execute("SELECT * FROM price_alerts WHERE id = ?", (cur.lastrowid,))
+    return _alert_dict(cur.fetchone())
+
+
+def list_alerts(conn, active_only: bool = False) -> List[Dict[str, Any]]:
+    cur = conn.cursor()
+    cur.execute(f"SELECT * FROM price_alerts {'WHERE is_active = 1' if active_only else ''} ORDER BY id DESC")
+    return [_alert_dict(r) for r in cur.fetchall()]
+
+
+def list_outbox(conn, status: Optional[str] = "pending", limit: int = 100) -> List[Dict[str, Any]]:
+    cur = conn.cursor()
+    if status:
+        cur.execute("SELECT * FROM alert_outbox WHERE status = ? ORDER BY id LIMIT ?", (status, limit))
+    else:
+        cur.execute("SELECT * FROM alert_outbox ORDER BY id DESC LIMIT ?", (limit,))
+    rows = []
+    for r in cur.fetchall():
+        row = dict(r)
+        row["payload"] = json.loads(row["payload"]) if row["payload"] else None
+        rows.append(row)
+    return rows
+
+
+def mark_outbox(conn, outbox_id: int, delivered: bool, error: Optional[str] = None) -> bool:
+    """Record a delivery attempt: 'sent' on success, otherwise 'failed' with the error."""
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE alert_outbox SET status = ?, attempts = attempts + 1, delivered_at = ?, last_error = ? WHERE id = ?",
+        ("sent" if delivered else "failed", datetime.utcnow().isoformat(timespec="seconds") if delivered else None, error, outbox_id),
+    )
+    conn.commit()
+    return cur.rowcount > 0
@@ -4,7 +4,12 @@ from flask import Flask, render_template, redirect, url_for, flash, request, jso
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 
 from db import get_db_connection, ensure_db
-from price_fetcher import start_price_fetcher
+from jobs import start_background_jobs
+from metrics import init_metrics
+from compression import init_compression
+from profiler import init_profiler
+from render_cache import init_render_cache
+from assets import init_assets
 from routes.panel import panel_bp
 from routes.auth import auth_bp
 from routes.api import api_bp
@@ -27,8 +32,29 @@ app.config["PERMANENT_SESSION_LIFETIME"] = 3600  # 1 hour
 # اطمینان از وجود دیتابیس و جداول
 ensure_db()
 
-# شروع price fetcher
-start_price_fetcher()
+# کارهای پس‌زمینه (قیمت‌ها، موجودی‌ها، پشتیبان، نگهداری دیتابیس) - فقط در یک پروسه اجرا می‌شوند
+start_background_jobs()
+
+
+# ----------------------------------------------------------------------------
+# Response compression - registered before every other after_request hook so it runs last
+# ----------------------------------------------------------------------------
+init_compression(app)
+
+
+# ----------------------------------------------------------------------------
+# Instrumentation (/metrics) - registered first so its hooks wrap every request
+# ----------------------------------------------------------------------------
+init_metrics(app)
+
+
+# ----------------------------------------------------------------------------
+# Template render cache + Jinja bytecode cache
+# ----------------------------------------------------------------------------
+init_render_cache(app)
+
+# Fingerprinted CSS/JS bundles served from /assets/ (see assets.py)
+init_assets(app)
 
 
 # ----------------------------------------------------------------------------
@@ -39,6 +65,11 @@ app.register_blueprint(api_bp)
 app.register_blueprint(auth_bp)
 app.register_blueprint(panel_bp)
 
+# ----------------------------------------------------------------------------
+# On-demand profiling (PPLUS_PROFILE=1) - wraps the whole WSGI app
+# ----------------------------------------------------------------------------
+init_profiler(app)
+
 # ----------------------------------------------------------------------------
 # CSRF protection - Disabled for development
 # ----------------------------------------------------------------------------
@@ -62,12 +93,12 @@ def inject_csrf_token():
 # ----------------------------------------------------------------------------
 @app.after_request
 def set_security_headers(response):  # type: ignore[override]
-    """Add basic security headers with CSP compatible with current inline assets."""
+    """Add basic security headers. Scripts are external bundles only; styles still allow inline style attributes."""
     csp = " ".join([
         "default-src 'self';",
         "img-src 'self' data: https:;",
         "style-src 'self' 'unsafe-inline' https:;",
-        "script-src 'self' 'unsafe-inline' https:;",
+        "script-src 'self' https:;",
         "connect-src 'self' https:;",
         "font-src 'self' https: data:;",
         "base-uri 'self';",
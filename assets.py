@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+خط لوله فایل‌های استاتیک (CSS/JS)
+
+- منبع‌ها: static/css/*.css و static/js/*.js
+- خروجی: static/dist/<name>.<hash>.<ext> به همراه نسخه فشرده .gz و manifest.json
+- سرو از مسیر /assets/<file> با Cache-Control یک‌ساله و immutable (نام فایل با محتوا عوض می‌شود)
+- قالب‌ها آدرس را با asset_url('base.css') می‌سازند
+
+ساخت هنگام بالا آمدن برنامه انجام می‌شود؛ برای ساخت دستی:
+    python assets.py
+
+متغیرهای محیطی:
+- PPLUS_ASSETS_MINIFY=0     خاموش کردن minify
+- PPLUS_ASSETS_DIR=...      مسیر خروجی (پیش‌فرض static/dist)
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from typing import Dict
+
+from flask import Flask, request, send_from_directory, url_for, abort
+
+try:  # optional, better minifiers
+    import rcssmin  # type: ignore
+except ImportError:  # pragma: no cover
+    rcssmin = None
+try:
+    import rjsmin  # type: ignore
+except ImportError:  # pragma: no cover
+    rjsmin = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+ASSET_SOURCES = {
+    ".css": os.path.join(STATIC_DIR, "css"),
+    ".js": os.path.join(STATIC_DIR, "js"),
+}
+ASSET_DIST_DIR = os.environ.get("PPLUS_ASSETS_DIR") or os.path.join(STATIC_DIR, "dist")
+ASSETS_MINIFY = os.environ.get("PPLUS_ASSETS_MINIFY", "1") != "0"
+ASSET_MAX_AGE = 365 * 24 * 3600
+# Superseded builds stay around this long so pages cached by browsers keep working
+ASSET_KEEP_SECONDS = 7 * 24 * 3600
+
+_HASHED_NAME = re.compile(r"^.+\.[0-9a-f]{12}\.(css|js)(\.gz)?$")
+
+# logical name ('base.css') -> fingerprinted file name ('base.1a2b3c4d5e6f.css')
+_manifest: Dict[str, str] = {}
+_SW_PATH = os.path.join(STATIC_DIR, "sw.js")
+_version = {"id": ""}
+
+
+def minify_css(text: str) -> str:
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+    # Conservative fallback: drop comments and collapse whitespace around braces/semicolons
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};])\s*", r"\1", text)
+    return text.strip() + "\n"
+
+
+def minify_js(text: str) -> str:
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    # Without rjsmin only blank lines and trailing spaces are dropped (safe for any JS)
+    lines = (line.rstrip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line) + "\n"
+
+
+_MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".asset.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def build_assets(dist_dir: str = ASSET_DIST_DIR, minify: bool = ASSETS_MINIFY) -> Dict[str, str]:
+    """Write fingerprinted (and gzipped) copies of every source asset; return the manifest."""
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest: Dict[str, str] = {}
+    for ext, source_dir in ASSET_SOURCES.items():
+        if not os.path.isdir(source_dir):
+            continue
+        for name in sorted(os.listdir(source_dir)):
+            if not name.endswith(ext):
+                continue
+            with open(os.path.join(source_dir, name), "r", encoding="utf-8") as f:
+                text = f.read()
+            if minify:
+                text = _MINIFIERS[ext](text)
+            data = text.encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = f"{name[:-len(ext)]}.{digest}{ext}"
+            target = os.path.join(dist_dir, hashed)
+            # Content-addressed: an existing file with this name already has these bytes
+            if not os.path.exists(target):
+                _atomic_write(target, data)
+            if not os.path.exists(target + ".gz"):
+                _atomic_write(target + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+            manifest[name] = hashed
+    _atomic_write(os.path.join(dist_dir, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    _prune(dist_dir, set(manifest.values()))
+    return manifest
+
+
+def _prune(dist_dir: str, current: set) -> None:
+    cutoff = time.time() - ASSET_KEEP_SECONDS
+    for name in os.listdir(dist_dir):
+        if not _HASHED_NAME.match(name) or name.replace(".gz", "") in current:
+            continue
+        path = os.path.join(dist_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def asset_url(name: str) -> str:
+    """URL of the fingerprinted build of `name`, or the plain source file if it was not built."""
+    hashed = _manifest.get(name)
+    if hashed:
+        return url_for("assets", filename=hashed)
+    folder = "css" if name.endswith(".css") else "js"
+    return url_for("static", filename=f"{folder}/{name}")
+
+
+def _compute_version() -> str:
+    digest = hashlib.sha256(json.dumps(_manifest, sort_keys=True).encode("utf-8"))
+    try:
+        with open(_SW_PATH, "rb") as f:
+            digest.update(f.read())
+    except OSError:
+        pass
+    return digest.hexdigest()[:12]
+
+
+def asset_version() -> str:
+    """Deployment id derived from the built bundles and the service worker source."""
+    if not _version["id"]:
+        _version["id"] = _compute_version()
+    return _version["id"]
+
+
+def service_worker_view():
+    # Served from the site root so the worker's scope covers the whole panel
+    response = send_from_directory(STATIC_DIR, "sw.js", mimetype="text/javascript", max_age=0)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Service-Worker-Allowed"] = "/"
+    return response
+
+
+def assets_view(filename: str):
+    if not _HASHED_NAME.match(filename) or filename.endswith(".gz"):
+        abort(404)
+    gz_path = os.path.join(ASSET_DIST_DIR, filename + ".gz")
+    if "gzip" in request.headers.get("Accept-Encoding", "") and os.path.isfile(gz_path):
+        response = send_from_directory(ASSET_DIST_DIR, filename + ".gz", mimetype=mimetypes.guess_type(filename)[0])
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename)
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# ----------------------------------------------------------------------------
+# Flask wiring
+# ----------------------------------------------------------------------------
+def init_assets(app: Flask) -> None:
+    """Build the bundles, register /assets/<file> and /sw.js and the template helpers."""
+    try:
+        _manifest.clear()
+        _manifest.update(build_assets())
+    except OSError as e:
+        # Pages still work from the unhashed files under /static/
+        print(f"[assets] build failed, serving unhashed sources: {e}")
+    _version["id"] = _compute_version()
+    app.add_url_rule("/assets/<path:filename>", "assets", assets_view)
+    app.add_url_rule("/sw.js", "service_worker", service_worker_view)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.jinja_env.globals["asset_version"] = asset_version
+
+
+if __name__ == "__main__":
+    built = build_assets()
+    for logical, hashed in sorted(built.items()):
+        print(f"{logical:20} -> {hashed}")
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+همگام‌سازی تدریجی: تغییرات دفتر کل بعد از یک version مشخص
+
+change_log با trigger روی جداول SYNCED_TABLES پر می‌شود. برای هر ردیف فقط آخرین تغییر
+برگردانده می‌شود: ردیف‌های موجود به صورت upsert (ستون‌ها یک بار، مقادیر به صورت آرایه) و
+ردیف‌های حذف‌شده به صورت tombstone (فقط id).
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from db import RESET_MARKER, SYNCED_TABLES, read_transaction
+
+CHANGES_PAGE_SIZE = 1000
+_ID_CHUNK = 500
+
+
+def _select_rows(cur, table: str, ids: Optional[List[int]] = None):
+    """Current rows of `table` (all of them when ids is None) as (columns, rows)."""
+    if ids is None:
+        cur.execute(f"SELECT * FROM {table} ORDER BY id")
+        rows = cur.fetchall()
+    else:
+        rows = []
+        for start in range(0, len(ids), _ID_CHUNK):
+            chunk = ids[start:start + _ID_CHUNK]
+            cur.execute(f"SELECT * FROM {table} WHERE id IN ({','.join('?' * len(chunk))}) ORDER BY id", chunk)
+            rows.extend(cur.fetchall())
+    columns = [d[0] for d in cur.description] if cur.description else []
+    return columns, [list(r) for r in rows]
+
+
+def changes_since(since: int, tables: Optional[Iterable[str]] = None, limit: int = CHANGES_PAGE_SIZE, conn=None) -> Dict[str, Any]:
+    """Compact delta of the synced tables after change_log version `since`.
+
+    Returns {"since", "version", "reset", "has_more", "tables": {name: {"columns", "upserts", "deletes"}}}.
+    With reset=True the client must drop its local copy: `tables` then holds a
+    full snapshot. Clients pass the returned `version` as the next `since`.
+    """
+    wanted = [t for t in SYNCED_TABLES if tables is None or t in tables]
+    result: Dict[str, Any] = {"since": since, "version": since, "reset": False, "has_more": False, "tables": {}}
+
+    with read_transaction(conn) as cur:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+        latest = int(cur.fetchone()[0])
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log WHERE table_name = ?", (RESET_MARKER,))
+        last_reset = int(cur.fetchone()[0])
+
+        if since <= 0 or since > latest or last_reset > since:
+            # First sync, a cursor from another database, or the ledger was wiped
+            result.update({"version": latest, "reset": True})
+            for table in wanted:
+                columns, rows = _select_rows(cur, table)
+                result["tables"][table] = {"columns": columns, "upserts": rows, "deletes": []}
+            return result
+
+        # Latest entry per row, oldest first, so a page boundary is a valid cursor
+        cur.execute(
+            f"""
+            SELECT c.version, c.table_name, c.row_id, c.op
+            FROM change_log c
+            JOIN (
+                SELECT MAX(version) AS version FROM change_log
+                WHERE version > ? AND table_name IN ({','.join('?' * len(wanted))})
+                GROUP BY table_name, row_id
+            ) last ON last.version = c.version
+            ORDER BY c.version
+            LIMIT ?
+            """,
+            [since, *wanted, limit + 1],
+        )
+        entries = cur.fetchall()
+        if len(entries) > limit:
+            entries = entries[:limit]
+            result["has_more"] = True
+            result["version"] = int(entries[-1]["version"])
+        else:
+            result["version"] = latest
+
+        upsert_ids: Dict[str, List[int]] = {}
+        deletes: Dict[str, List[int]] = {}
+        for entry in entries:
+            bucket = deletes if entry["op"] == "delete" else upsert_ids
+            bucket.setdefault(entry["table_name"], []).append(int(entry["row_id"]))
+
+        for table in wanted:
+            ids = upsert_ids.get(table, [])
+            gone = deletes.get(table, [])
+            if not ids and not gone:
+                continue
+            columns, rows = _select_rows(cur, table, ids) if ids else ([], [])
+            # A logged upsert whose row is missing was removed without a trigger firing
+            found = {row[columns.index("id")] for row in rows}
+            gone = gone + [i for i in ids if i not in found]
+            result["tables"][table] = {"columns": columns, "upserts": rows, "deletes": sorted(gone)}
+    return result
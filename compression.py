@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+فشرده‌سازی پاسخ‌های متنی (HTML/JSON/CSS/JS) بر اساس Accept-Encoding
+
+- brotli (اگر ماژول brotli نصب باشد) و gzip
+- فقط پاسخ‌های بزرگ‌تر از آستانه؛ پاسخ‌های stream (خروجی‌ها، SSE) و فایل‌های send_file دست نمی‌خورند
+- بدنه‌های فشرده‌شده در یک LRU کوچک با کلید ETag نگه داشته می‌شوند تا پاسخ‌های تکراری
+  (مثلاً poll هر ۲۰ ثانیه /api/dashboard) دوباره فشرده نشوند؛ برای GETهای بدون ETag، یک
+  ETag ضعیف از هش بدنه ساخته می‌شود
+
+متغیرهای محیطی:
+- PPLUS_COMPRESS=0               خاموش کردن
+- PPLUS_COMPRESS_MIN_BYTES=500   آستانه حجم
+- PPLUS_GZIP_LEVEL=6
+- PPLUS_BROTLI_QUALITY=5
+- PPLUS_COMPRESS_CACHE_MB=8
+"""
+
+import gzip
+import os
+from typing import Optional
+
+from flask import Flask, request
+
+from metrics import Counter, REGISTRY
+from render_cache import RenderCache
+
+try:  # optional
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESS_ENABLED = os.environ.get("PPLUS_COMPRESS", "1") != "0"
+COMPRESS_MIN_BYTES = int(os.environ.get("PPLUS_COMPRESS_MIN_BYTES", "500"))
+GZIP_LEVEL = int(os.environ.get("PPLUS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("PPLUS_BROTLI_QUALITY", "5"))
+COMPRESS_CACHE_BYTES = int(float(os.environ.get("PPLUS_COMPRESS_CACHE_MB", "8")) * 1024 * 1024)
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "image/svg+xml",
+}
+
+COMPRESSED_TOTAL = Counter("pplus_compressed_responses_total", "Compressed responses by encoding and cache result.", ("encoding", "cache"))
+REGISTRY.append(COMPRESSED_TOTAL)
+
+# (etag, encoding) -> compressed body
+_compressed_cache = RenderCache(max_bytes=COMPRESS_CACHE_BYTES, max_entries=1024)
+
+
+def _encodings() -> tuple:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _should_compress(response) -> bool:
+    if response.direct_passthrough or response.is_streamed:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if "Content-Encoding" in response.headers:
+        return False
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return False
+    return (response.content_length or 0) >= COMPRESS_MIN_BYTES
+
+
+def compress_response(response):
+    """after_request hook: negotiate an encoding and compress the body in place."""
+    if not COMPRESS_ENABLED or not _should_compress(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding: Optional[str] = request.accept_encodings.best_match(_encodings())
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    if etag is None and request.method == "GET" and response.status_code == 200:
+        # A weak validator is cheap to compute and lets repeat bodies hit the cache
+        response.add_etag(weak=True)
+        etag, weak = response.get_etag()
+
+    data = response.get_data()
+    key = (etag, encoding) if etag else None
+    body = _compressed_cache.get(key) if key else None
+    if body is None:
+        body = compress(data, encoding)
+        if key:
+            _compressed_cache.set(key, body)
+        COMPRESSED_TOTAL.inc((encoding, "miss" if key else "none"))
+    else:
+        COMPRESSED_TOTAL.inc((encoding, "hit"))
+
+    if len(body) >= len(data):
+        return response
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    if etag and not weak:
+        # A strong validator must differ between representations
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+# ----------------------------------------------------------------------------
+# Flask wiring
+# ----------------------------------------------------------------------------
+def init_compression(app: Flask) -> None:
+    """Register the compression hook.
+
+    Call before any other after_request hook is registered: Flask runs them
+    in reverse order, so this one then sees the final body and headers.
+    """
+    app.after_request(compress_response)
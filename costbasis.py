@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+مقایسه روش‌های بهای تمام‌شده (FIFO / LIFO / HIFO / میانگین)
+
+دفتر کل یک بار و به ترتیب زمان مرور می‌شود و هر معامله همزمان به چهار دفتر لات (lots.BOOKS)
+برای کل پورتفولیو و برای کیف پول خودش داده می‌شود. نتیجه (سود تحقق‌یافته، BTC و بهای لات‌های باز)
+برای هر data_version کش می‌شود؛ سود/زیان باز با قیمت لحظه‌ای در O(1) از همان اعداد ساخته
+می‌شود، پس عوض کردن روش یا قیمت هیچ محاسبه دوباره‌ای از دفتر کل ندارد.
+
+روش پیش‌فرض هر کیف پول در wallets.cost_basis_method ذخیره می‌شود (پیش‌فرض fifo).
+"""
+
+import threading
+from heapq import merge
+from typing import Any, Dict, Optional
+
+from dashboard_data import load_dashboard_data
+from db import get_data_version, get_db_connection
+from lots import BOOKS, COST_BASIS_METHODS, LotCurve
+
+DEFAULT_METHOD = "fifo"
+
+_cache: Dict[str, Any] = {"data_version": None, "result": None}
+_lock = threading.Lock()
+
+
+def _summary(book) -> Dict[str, Any]:
+    return {
+        "realized_pnl_usd": book.realized,
+        "open_btc": book.open_btc,
+        "open_cost_usd": book.open_cost,
+        "average_cost_usd": book.open_cost / book.open_btc if book.open_btc > 0 else None,
+        "open_lots": len(book.open_lots()),
+        "unmatched_btc": 0.0,
+    }
+
+
+def _walk(conn) -> Dict[str, Any]:
+    """Every method for the whole portfolio and for each wallet, in one chronological pass."""
+    data = load_dashboard_data(conn, include_deposits=False)
+    cur = conn.cursor()
+    cur.execute("SELECT id, cost_basis_method FROM wallets")
+    wallet_methods = {int(r["id"]): r["cost_basis_method"] or DEFAULT_METHOD for r in cur.fetchall()}
+
+    total = {method: book() for method, book in BOOKS.items()}
+    wallets: Dict[int, Dict[str, Any]] = {}
+    unmatched = {"total": dict.fromkeys(BOOKS, 0.0), "wallets": {}}
+    events = merge(
+        (("buy", p) for p in data["purchases"]),
+        (("sell", w) for w in data["withdrawals"]),
+        key=lambda e: e[1]["created_at"],
+    )
+    for kind, trade in events:
+        wallet_id = trade["wallet_id"]
+        if wallet_id not in wallets:
+            wallets[wallet_id] = {method: book() for method, book in BOOKS.items()}
+            unmatched["wallets"][wallet_id] = dict.fromkeys(BOOKS, 0.0)
+        for method in BOOKS:
+            for scope, book in ((unmatched["total"], total[method]), (unmatched["wallets"][wallet_id], wallets[wallet_id][method])):
+                if kind == "buy":
+                    book.buy(trade)
+                else:
+                    scope[method] += book.sell(trade)
+
+    def summarize(books, short):
+        return {method: {**_summary(book), "unmatched_btc": short[method]} for method, book in books.items()}
+
+    def curves(books):
+        return {method: LotCurve(book.open_lots()) for method, book in books.items()}
+
+    def flows(totals):
+        return {"purchased_usd": totals["purchased_usd"], "withdrawn_usd": totals["withdrawn_usd"]}
+
+    return {
+        "total": summarize(total, unmatched["total"]),
+        "wallets": {
+            wallet_id: {"method": wallet_methods.get(wallet_id, DEFAULT_METHOD), "methods": summarize(books, unmatched["wallets"][wallet_id])}
+            for wallet_id, books in wallets.items()
+        },
+        # Open-lot state for the what-if simulator (whatif.py)
+        "curves": {"total": curves(total), "wallets": {wallet_id: curves(books) for wallet_id, books in wallets.items()}},
+        "flows": {"total": flows(data["totals"]), "wallets": {wallet_id: flows(t) for wallet_id, t in data["wallet_totals"].items()}},
+    }
+
+
+def _results(conn=None) -> Dict[str, Any]:
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        version = get_data_version(conn)
+        with _lock:
+            if _cache["data_version"] != version:
+                _cache.update({"data_version": version, "result": _walk(conn)})
+            return _cache["result"]
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def open_state(method: str, wallet_id: Optional[int] = None, conn=None) -> Dict[str, Any]:
+    """Cached open-lot curve, realized P&L and USD flows of one method/scope (for what-if simulation)."""
+    results = _results(conn)
+    if wallet_id is None:
+        summary = results["total"][method]
+        curve, flows = results["curves"]["total"][method], results["flows"]["total"]
+    else:
+        empty_flows = {"purchased_usd": 0.0, "withdrawn_usd": 0.0}
+        wallet = results["wallets"].get(wallet_id)
+        summary = wallet["methods"][method] if wallet else {"realized_pnl_usd": 0.0}
+        curve = results["curves"]["wallets"].get(wallet_id, {}).get(method) or LotCurve([])
+        flows = results["flows"]["wallets"].get(wallet_id, empty_flows)
+    return {"curve": curve, "realized_pnl_usd": summary["realized_pnl_usd"], **flows}
+
+
+def _with_price(summary: Dict[str, Any], price: Optional[float]) -> Dict[str, Any]:
+    value = summary["open_btc"] * price if price else None
+    unrealized = value - summary["open_cost_usd"] if value is not None else None
+    return {
+        **summary,
+        "open_value_usd": value,
+        "unrealized_pnl_usd": unrealized,
+        "total_pnl_usd": summary["realized_pnl_usd"] + unrealized if unrealized is not None else None,
+    }
+
+
+def cost_basis(price: Optional[float], method: Optional[str] = None, wallet_id: Optional[int] = None, conn=None) -> Dict[str, Any]:
+    """All methods side by side for the portfolio (or one wallet), plus the selected one.
+
+    The selected method is `method` if given, else the wallet's own setting (FIFO for the portfolio).
+    """
+    if method is not None and method not in COST_BASIS_METHODS:
+        raise ValueError(f"method must be one of {', '.join(COST_BASIS_METHODS)}")
+    results = _results(conn)
+    if wallet_id is None:
+        methods, selected = results["total"], method or DEFAULT_METHOD
+    else:
+        wallet = results["wallets"].get(wallet_id)
+        if wallet is None:
+            empty = {m: {"realized_pnl_usd": 0.0, "open_btc": 0.0, "open_cost_usd": 0.0, "average_cost_usd": None, "open_lots": 0, "unmatched_btc": 0.0} for m in COST_BASIS_METHODS}
+            wallet = {"method": DEFAULT_METHOD, "methods": empty}
+        methods, selected = wallet["methods"], method or wallet["method"]
+    return {
+        "wallet_id": wallet_id,
+        "selected": selected,
+        "btc_price": price,
+        "methods": {m: _with_price(summary, price) for m, summary in methods.items()},
+    }
+
+
+def set_wallet_method(wallet_id: int, method: str) -> bool:
+    if method not in COST_BASIS_METHODS:
+        raise ValueError(f"method must be one of {', '.join(COST_BASIS_METHODS)}")
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE wallets SET cost_basis_method = ? WHERE id = ?", (method, wallet_id))
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+سرویس داده داشبورد
+
+همه صفحات پنل و APIهای خلاصه از این سرویس می‌خوانند: هر جدول دفتر کل حداکثر یک بار
+و داخل یک تراکنش خواندنی خوانده می‌شود، و همه جمع‌ها، لیست‌ها و ورودی‌های FIFO از
+همان یک عبور ساخته می‌شوند؛ بنابراین هیچ صفحه‌ای نیمه‌ی یک نوشتن را نمی‌بیند.
+"""
+
+import calendar
+from datetime import datetime, timezone
+from heapq import merge
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import read_transaction
+from lots import fifo_pnl
+from money import btc, to_micro, to_rial, toman, trade_values, usd
+
+
+def trade_row(row) -> Dict[str, Any]:
+    """Trade dict: integer amount_sat / price_micro / cost_micro, and their float values for display."""
+    if row["amount_sat"] is not None:
+        amount_sat, price_micro, cost = int(row["amount_sat"]), int(row["price_micro"]), int(row["cost_micro"])
+    else:  # ledger event recorded before the integer columns existed
+        amount_sat, price_micro, cost = trade_values(row["amount_btc"], row["price_usd_per_btc"])
+    return {
+        "id": int(row["id"]),
+        "created_at": row["created_at"],
+        "amount_sat": amount_sat,
+        "price_micro": price_micro,
+        "cost_micro": cost,
+        "amount_btc": btc(amount_sat),
+        "price_usd_per_btc": usd(price_micro),
+        "amount_usd": usd(cost),
+        "wallet_id": row["wallet_id"] if row["wallet_id"] is not None else 1,
+    }
+
+
+def deposit_row(row) -> Dict[str, Any]:
+    if row["amount_usd_micro"] is not None:
+        amount_micro, amount_rial = int(row["amount_usd_micro"]), int(row["amount_rial"])
+    else:
+        amount_micro, amount_rial = to_micro(row["amount_usd"]), to_rial(row["amount_toman"])
+    return {
+        "id": int(row["id"]),
+        "created_at": row["created_at"],
+        "amount_usd_micro": amount_micro,
+        "amount_rial": amount_rial,
+        "amount_usd": usd(amount_micro),
+        "price_toman_per_usd": float(row["price_toman_per_usd"]),
+        "amount_toman": toman(amount_rial),
+    }
+
+
+def _parse_iso(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def epoch(value: str) -> int:
+    """created_at (ISO, UTC) as the integer `ts` column: whole seconds since 1970-01-01."""
+    return calendar.timegm(datetime.fromisoformat(value[:19]).timetuple())
+
+
+def ledger_filter(wallet_id: Optional[int] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Optional[int]]:
+    """{"wallet_id", "ts_from", "ts_to"} for ?wallet_id= / ?from= / ?to= (ISO dates or datetimes).
+
+    Values without an offset are UTC; an offset (or Z) is converted to UTC. A bare date as `to`
+    includes that whole day. Raises ValueError for unparsable dates.
+    """
+    bounds = []
+    for name, value in (("from", date_from), ("to", date_to)):
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO date or datetime (UTC)")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        ts = calendar.timegm(parsed.timetuple())
+        bounds.append(ts + 86399 if name == "to" and len(value) == 10 else ts)
+    return {"wallet_id": wallet_id, "ts_from": bounds[0], "ts_to": bounds[1]}
+
+
+def filter_sql(filters: Optional[Dict[str, Optional[int]]], wallet: bool = True) -> Tuple[str, List[int]]:
+    """SQL conditions ("" or " AND ...") over the indexed (wallet_id, ts) columns."""
+    sql, params = "", []
+    for column, op, key in (("wallet_id", "=", "wallet_id"), ("ts", ">=", "ts_from"), ("ts", "<=", "ts_to")):
+        if filters and filters.get(key) is not None and (wallet or column != "wallet_id"):
+            sql += f" AND {column} {op} ?"
+            params.append(filters[key])
+    return sql, params
+
+
+def in_filter(filters: Optional[Dict[str, Optional[int]]], row: Dict[str, Any], wallet: bool = True) -> bool:
+    """filter_sql() for rows already in memory (e.g. rebuilt from the ledger event log)."""
+    if not filters:
+        return True
+    if wallet and filters.get("wallet_id") is not None and row.get("wallet_id", 1) != filters["wallet_id"]:
+        return False
+    if filters.get("ts_from") is None and filters.get("ts_to") is None:
+        return True
+    ts = epoch(row["created_at"])
+    return (filters.get("ts_from") is None or ts >= filters["ts_from"]) and (filters.get("ts_to") is None or ts <= filters["ts_to"])
+
+
+def load_dashboard_data(conn=None, include_deposits: bool = True, filters: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, Any]:
+    """Read the ledger once in a single read transaction and derive every aggregate.
+
+    Returns a dict with:
+    - purchases / withdrawals: trade dicts ordered oldest first (FIFO input)
+    - usd_deposits: newest first
+    - settings: key/value map of the settings table
+    - totals: ledger-wide sums and counts
+    - wallet_totals: the same sums per wallet_id
+
+    `filters` (ledger_filter) limits the rows by wallet and date range through the (wallet_id, ts)
+    indexes; USD deposits have no wallet and are only filtered by date.
+    """
+    trade_where, trade_params = filter_sql(filters)
+    deposit_where, deposit_params = filter_sql(filters, wallet=False)
+    with read_transaction(conn) as cur:
+        columns = "id, created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro, wallet_id"
+        cur.execute(f"SELECT {columns} FROM purchases WHERE 1{trade_where} ORDER BY created_at ASC, id ASC", trade_params)
+        purchases = [trade_row(r) for r in cur.fetchall()]
+        cur.execute(f"SELECT {columns} FROM withdrawals WHERE 1{trade_where} ORDER BY created_at ASC, id ASC", trade_params)
+        withdrawals = [trade_row(r) for r in cur.fetchall()]
+        usd_deposits: List[Dict[str, Any]] = []
+        if include_deposits:
+            cur.execute(
+                "SELECT id, created_at, amount_usd, price_toman_per_usd, amount_toman, amount_usd_micro, amount_rial "
+                f"FROM usd_deposits WHERE 1{deposit_where} ORDER BY id DESC",
+                deposit_params,
+            )
+            usd_deposits = [deposit_row(r) for r in cur.fetchall()]
+        cur.execute("SELECT key, value FROM settings")
+        settings = {r["key"]: r["value"] for r in cur.fetchall()}
+    return derive_dashboard_data(purchases, withdrawals, usd_deposits, settings)
+
+
+def derive_dashboard_data(
+    purchases: List[Dict[str, Any]],
+    withdrawals: List[Dict[str, Any]],
+    usd_deposits: List[Dict[str, Any]],
+    settings: Dict[str, str],
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Aggregates of load_dashboard_data over already-loaded rows (trades oldest first, deposits newest first).
+
+    Also used for point-in-time ledger states rebuilt from ledger_events (ledger.py); `now` is then the as-of time.
+    """
+    # Exact integer sums (sat / micro-USD / rial); converted to BTC / USD / Toman once at the end
+    sums = {"purchased_sat": 0, "purchased_micro": 0, "withdrawn_sat": 0, "withdrawn_micro": 0}
+    wallet_sums: Dict[int, Dict[str, int]] = {}
+    for side, trades in (("purchased", purchases), ("withdrawn", withdrawals)):
+        for t in trades:
+            w = wallet_sums.setdefault(t["wallet_id"], dict.fromkeys(sums, 0))
+            for target in (sums, w):
+                target[f"{side}_sat"] += t["amount_sat"]
+                target[f"{side}_micro"] += t["cost_micro"]
+
+    def as_float(s: Dict[str, int]) -> Dict[str, float]:
+        return {
+            "purchased_btc": btc(s["purchased_sat"]),
+            "purchased_usd": usd(s["purchased_micro"]),
+            "withdrawn_btc": btc(s["withdrawn_sat"]),
+            "withdrawn_usd": usd(s["withdrawn_micro"]),
+        }
+
+    totals = {
+        **as_float(sums),
+        "usd_deposits": usd(sum(d["amount_usd_micro"] for d in usd_deposits)),
+        "usd_deposits_toman": toman(sum(d["amount_rial"] for d in usd_deposits)),
+        "purchases_count": len(purchases),
+        "withdrawals_count": len(withdrawals),
+        "current_btc_balance": btc(sums["purchased_sat"] - sums["withdrawn_sat"]),
+        "net_invested_usd": usd(sums["purchased_micro"] - sums["withdrawn_micro"]),
+    }
+    wallet_totals = {wallet_id: as_float(w) for wallet_id, w in wallet_sums.items()}
+
+    first_purchase_at = purchases[0]["created_at"] if purchases else None
+    last_dates = [rows[-1]["created_at"] for rows in (purchases, withdrawals) if rows]
+    first_dt = _parse_iso(first_purchase_at)
+
+    return {
+        "purchases": purchases,
+        "withdrawals": withdrawals,
+        "usd_deposits": usd_deposits,
+        "settings": settings,
+        "totals": totals,
+        "wallet_totals": wallet_totals,
+        "first_purchase_at": first_purchase_at,
+        "last_transaction_at": max(last_dates) if last_dates else None,
+        "inception_days": max(0, ((now or datetime.utcnow()) - first_dt).days) if first_dt else 0,
+    }
+
+
+def latest(rows: List[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Rows ordered by id, newest first (the order the ledger tables are listed in)."""
+    ordered = sorted(rows, key=lambda r: r["id"], reverse=True)
+    return ordered if limit is None else ordered[:limit]
+
+
+def transactions(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Purchases and withdrawals merged into one list, newest first."""
+    purchases = ({**p, "type": "purchase"} for p in reversed(data["purchases"]))
+    withdrawals = ({**w, "type": "withdrawal"} for w in reversed(data["withdrawals"]))
+    return list(merge(purchases, withdrawals, key=lambda t: t["created_at"], reverse=True))
+
+
+def roi(data: Dict[str, Any], current_btc_price: float, net_invested_usd: float) -> Dict[str, Any]:
+    """FIFO profit/loss and ROI over the loaded ledger."""
+    pnl = fifo_pnl(data["purchases"], data["withdrawals"], current_btc_price)
+    roi_percentage = (pnl["total_profit"] / net_invested_usd) * 100 if net_invested_usd > 0 else 0.0
+    return {
+        "profit_loss_usd": pnl["total_profit"],
+        "closed_profit_usd": pnl["closed_profit"],
+        "open_cost_usd": pnl["open_cost"],
+        "open_value_usd": pnl["open_value"],
+        "roi_percentage": roi_percentage,
+    }
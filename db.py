@@ -1,12 +1,72 @@
 import os
 import sqlite3
+import time
 from datetime import datetime
 from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from money import to_micro, to_rial, trade_values
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Allow overriding DB location via env so webhook resets do not affect data
 DB_PATH = os.environ.get("PPLUS_DB_PATH") or os.path.join(BASE_DIR, "pplus.sqlite3")
 
+# Callbacks receiving the duration (seconds) of every executed statement
+_query_observers: List[Callable[[float], None]] = []
+
+
+def add_query_observer(callback: Callable[[float], None]) -> None:
+    """Register a callback invoked with the duration of each SQL statement."""
+    if callback not in _query_observers:
+        _query_observers.append(callback)
+
+
+def _notify_query(elapsed: float) -> None:
+    for callback in _query_observers:
+        try:
+            callback(elapsed)
+        except Exception:
+            pass
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statement timings to the registered observers."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify_query(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify_query(time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _notify_query(time.perf_counter() - started)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
 
 def get_db_connection() -> sqlite3.Connection:
     """Get a database connection with optimized settings."""
@@ -16,15 +76,16 @@ def get_db_connection() -> sqlite3.Connection:
     except Exception:
         pass
     
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    conn = sqlite3.connect(DB_PATH, timeout=30.0, factory=_TimedConnection)
     conn.row_factory = sqlite3.Row
     
     # Optimize SQLite settings for better performance
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA synchronous=NORMAL")
-    conn.execute("PRAGMA cache_size=10000")
-    conn.execute("PRAGMA temp_store=MEMORY")
-    conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+    # (run through the base class so connection setup is not counted as queries)
+    sqlite3.Connection.execute(conn, "PRAGMA journal_mode=WAL")
+    sqlite3.Connection.execute(conn, "PRAGMA synchronous=NORMAL")
+    sqlite3.Connection.execute(conn, "PRAGMA cache_size=10000")
+    sqlite3.Connection.execute(conn, "PRAGMA temp_store=MEMORY")
+    sqlite3.Connection.execute(conn, "PRAGMA mmap_size=268435456")  # 256MB
     
     return conn
 
@@ -45,6 +106,270 @@ def get_db_context():
             conn.close()
 
 
+@contextmanager
+def read_transaction(conn: Optional[sqlite3.Connection] = None):
+    """Yield a cursor whose reads all see one consistent snapshot of the database.
+
+    Opens (and closes) its own connection unless one is passed in.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN")
+        yield cur
+    finally:
+        try:
+            conn.rollback()
+        finally:
+            if own_conn:
+                conn.close()
+
+
+# Tables whose writes bump data_version (and so invalidate rendered pages)
+VERSIONED_TABLES = (
+    "purchases", "withdrawals", "usd_deposits", "wallets",
+    "portfolio_goals", "risk_limits", "settings",
+)
+# settings keys that only cache a fetched value (not shown from the ledger): writing them does not bump data_version
+UNVERSIONED_SETTINGS = ("last_price_usd",)
+
+
+# Tables whose row changes are recorded in change_log for delta sync (/api/changes)
+SYNCED_TABLES = (
+    "purchases", "withdrawals", "usd_deposits", "wallets",
+    "portfolio_goals", "risk_limits", "price_alerts",
+)
+# Columns the goal/risk evaluation (evaluation.py) rewrites after every price change; an UPDATE of
+# only these does not bump data_version or add a change_log row (triggers are AFTER UPDATE OF the rest)
+EVALUATED_COLUMNS = {
+    "portfolio_goals": ("current_value", "progress", "is_achieved", "evaluated_at", "achieved_at"),
+    "risk_limits": ("current_value", "utilization", "state", "baseline_price", "baseline_date", "evaluated_at"),
+}
+# change_log.table_name used for "everything was wiped" markers
+RESET_MARKER = "*"
+
+# Ledger tables whose full row history is kept in ledger_events (ledger.py), with the logged columns
+LEDGER_EVENT_TABLES = {
+    "purchases": ("id", "created_at", "amount_btc", "price_usd_per_btc", "amount_sat", "price_micro", "cost_micro", "wallet_id", "notes"),
+    "withdrawals": ("id", "created_at", "amount_btc", "price_usd_per_btc", "amount_sat", "price_micro", "cost_micro", "wallet_id", "notes"),
+    "usd_deposits": ("id", "created_at", "amount_usd", "price_toman_per_usd", "amount_toman", "amount_usd_micro", "amount_rial"),
+}
+# Free-text columns indexed in search_index (search.py): table -> (kind code, columns)
+# search_index.rowid = row id << SEARCH_KIND_BITS | kind code, so syncing a row is a rowid lookup
+SEARCH_SOURCES = {
+    "purchases": (1, ("notes",)),
+    "withdrawals": (2, ("notes",)),
+    "wallets": (3, ("name", "description")),
+    "portfolio_goals": (4, ("goal_name",)),
+}
+SEARCH_KIND_BITS = 3
+# Persian/Arabic spelling variants folded before indexing and querying: Arabic yeh/kaf, teh marbuta,
+# hamza forms; ZWNJ, tatweel and harakat are dropped. Kept short: each entry is one nested replace()
+# in the triggers (SQLite's parser allows ~28); digit forms are expanded at query time (search.py)
+PERSIAN_NORMALIZE = {
+    "\u064a": "\u06cc", "\u0649": "\u06cc", "\u0643": "\u06a9", "\u0629": "\u0647", "\u06c0": "\u0647",
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627",
+    "\u200c": "", "\u0640": "",
+    **{chr(c): "" for c in range(0x064B, 0x0653)},
+}
+# created_at (ISO text, UTC) as integer epoch seconds, for indexed date-range / per-wallet queries
+_TS_COLUMN = "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', created_at) AS INTEGER)) VIRTUAL"
+# Integer fixed-point columns (money.py) and the REAL columns they are computed from
+_TRADE_INT_COLUMNS = (("amount_sat", "INTEGER"), ("price_micro", "INTEGER"), ("cost_micro", "INTEGER"))
+_DEPOSIT_INT_COLUMNS = (("amount_usd_micro", "INTEGER"), ("amount_rial", "INTEGER"))
+# Integer column -> (REAL columns it is computed from, SQL computing it from the current row) for the
+# triggers that fill it when a writer sets only the REAL columns (money.py rounding, half away from zero)
+_SAT_SQL = "ROUND(amount_btc * 100000000)"
+_PRICE_MICRO_SQL = "ROUND(price_usd_per_btc * 1000000)"
+_TRADE_DERIVED = {
+    "amount_sat": (("amount_btc",), f"CAST({_SAT_SQL} AS INTEGER)"),
+    "price_micro": (("price_usd_per_btc",), f"CAST({_PRICE_MICRO_SQL} AS INTEGER)"),
+    "cost_micro": (("amount_btc", "price_usd_per_btc"), f"CAST(ROUND({_SAT_SQL} * {_PRICE_MICRO_SQL} / 100000000) AS INTEGER)"),
+}
+FIXED_POINT_DERIVED = {
+    "purchases": _TRADE_DERIVED,
+    "withdrawals": _TRADE_DERIVED,
+    "usd_deposits": {
+        "amount_usd_micro": (("amount_usd",), "CAST(ROUND(amount_usd * 1000000) AS INTEGER)"),
+        "amount_rial": (("amount_toman",), "CAST(ROUND(amount_toman * 10) AS INTEGER)"),
+    },
+}
+
+
+def _json_row(columns, prefix: str = "") -> str:
+    """SQL json_object(...) expression over the given columns (prefix e.g. 'NEW.' inside triggers)."""
+    return "json_object(" + ", ".join(f"'{c}', {prefix}{c}" for c in columns) + ")"
+
+
+def normalize_sql(expr: str) -> str:
+    """SQL expression applying PERSIAN_NORMALIZE to `expr` (nested replace(), usable inside triggers)."""
+    for source, target in PERSIAN_NORMALIZE.items():
+        expr = f"replace({expr}, char({ord(source)}), '{target}')"
+    return expr
+
+
+def _search_text(columns, prefix: str = "") -> str:
+    return normalize_sql(" || ' ' || ".join(f"COALESCE({prefix}{c}, '')" for c in columns))
+
+
+def record_reset(cur) -> None:
+    """Log that the synced tables were dropped/recreated, so clients resync from scratch."""
+    cur.execute("INSERT INTO change_log(table_name, row_id, op) VALUES(?, 0, 'reset')", (RESET_MARKER,))
+    cur.execute("INSERT INTO ledger_events(table_name, row_id, op) VALUES(?, 0, 'reset')", (RESET_MARKER,))
+
+
+def prune_change_log(conn: sqlite3.Connection) -> int:
+    """Drop change_log entries superseded by a later entry for the same row."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        DELETE FROM change_log WHERE version NOT IN (
+            SELECT MAX(version) FROM change_log GROUP BY table_name, row_id
+        )
+        """
+    )
+    return cur.rowcount
+
+
+def get_data_version(conn: Optional[sqlite3.Connection] = None) -> int:
+    """Current value of the data_version counter (0 if the table is missing)."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+        return int(row[0]) if row else 0
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def backup_database(dest_path: str) -> str:
+    """Consistent online copy of the database (SQLite backup API; safe while writers are active)."""
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    tmp_path = dest_path + ".tmp"
+    src = get_db_connection()
+    try:
+        dest = sqlite3.connect(tmp_path)
+        try:
+            src.backup(dest, pages=256)
+        finally:
+            dest.close()
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        src.close()
+    return dest_path
+
+
+def optimize_database() -> dict:
+    """Routine maintenance: prune change_log, refresh planner stats, truncate the WAL."""
+    conn = get_db_connection()
+    try:
+        pruned = prune_change_log(conn)
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return {"change_log_pruned": pruned, "wal_pages": wal_pages, "checkpointed": checkpointed, "busy": busy}
+    finally:
+        conn.close()
+
+
+def _update_event(cur, table: str) -> str:
+    """Trigger event for row updates of `table`: UPDATE, or UPDATE OF its non-evaluated columns."""
+    if table not in EVALUATED_COLUMNS:
+        return "UPDATE"
+    cur.execute(f"PRAGMA table_xinfo({table})")
+    columns = [row[1] for row in cur.fetchall() if row[1] not in EVALUATED_COLUMNS[table]]
+    return f"UPDATE OF {', '.join(columns)}"
+
+
+def _ensure_column(cur, table: str, column: str, decl: str) -> None:
+    """ALTER TABLE ... ADD COLUMN for databases created before the column existed."""
+    cur.execute(f"PRAGMA table_xinfo({table})")  # also lists generated columns
+    if column not in {row[1] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _create_fixed_point_triggers(cur) -> None:
+    """Keep the integer columns in step with writers that only set the REAL ones.
+
+    After an INSERT with a NULL integer column, or an UPDATE that changed a REAL column but left
+    its integer column as it was, that integer column is recomputed from the row. Writers that set
+    both (the app) are left alone, so sums over the integer columns never miss a row.
+    """
+    for table, derived in FIXED_POINT_DERIVED.items():
+        sources = sorted({s for columns, _sql in derived.values() for s in columns})
+        for name, event, stale in (
+            ("insert", "INSERT", lambda column, columns: f"NEW.{column} IS NULL"),
+            (
+                "update",
+                f"UPDATE OF {', '.join(sources)}",
+                lambda column, columns: f"NEW.{column} IS NULL OR ("
+                + " OR ".join(f"NEW.{s} IS NOT OLD.{s}" for s in columns)
+                + f") AND NEW.{column} IS OLD.{column}",
+            ),
+        ):
+            conditions = {column: stale(column, columns) for column, (columns, _sql) in derived.items()}
+            assignments = ", ".join(
+                f"{column} = CASE WHEN {conditions[column]} THEN {sql} ELSE {column} END" for column, (_columns, sql) in derived.items()
+            )
+            cur.execute(f"DROP TRIGGER IF EXISTS {table}_{name}_fixed_point")
+            cur.execute(
+                f"""
+                CREATE TRIGGER {table}_{name}_fixed_point
+                AFTER {event} ON {table}
+                WHEN {' OR '.join(f"({c})" for c in conditions.values())}
+                BEGIN
+                    UPDATE {table} SET {assignments} WHERE id = NEW.id;
+                END
+                """
+            )
+
+
+def _backfill_fixed_point(cur) -> None:
+    """Fill the integer columns of rows written before they existed.
+
+    This is a storage migration, not a ledger correction: the per-row update triggers
+    (recreated further down in ensure_db) are dropped first so no change_log / ledger_events
+    entries are written; data_version is bumped once and the rollup state is rebuilt.
+    """
+    cur.execute("SELECT id, amount_btc, price_usd_per_btc FROM purchases WHERE amount_sat IS NULL")
+    purchases = cur.fetchall()
+    cur.execute("SELECT id, amount_btc, price_usd_per_btc FROM withdrawals WHERE amount_sat IS NULL")
+    withdrawals = cur.fetchall()
+    cur.execute("SELECT id, amount_usd, amount_toman FROM usd_deposits WHERE amount_usd_micro IS NULL")
+    deposits = cur.fetchall()
+    if not (purchases or withdrawals or deposits):
+        return
+    for table in LEDGER_EVENT_TABLES:
+        for trigger in (f"{table}_update_data_version", f"{table}_update_change_log", f"{table}_correct_ledger_event"):
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for table, rows in (("purchases", purchases), ("withdrawals", withdrawals)):
+        cur.executemany(
+            f"UPDATE {table} SET amount_sat = ?, price_micro = ?, cost_micro = ? WHERE id = ?",
+            [(*trade_values(r["amount_btc"], r["price_usd_per_btc"]), r["id"]) for r in rows],
+        )
+    cur.executemany(
+        "UPDATE usd_deposits SET amount_usd_micro = ?, amount_rial = ? WHERE id = ?",
+        [(to_micro(r["amount_usd"]), to_rial(r["amount_toman"]), r["id"]) for r in deposits],
+    )
+    for sql in ("UPDATE data_version SET version = version + 1 WHERE id = 1", "DELETE FROM rollup_state"):
+        try:
+            cur.execute(sql)
+        except sqlite3.OperationalError:
+            pass  # created later in ensure_db
+
+
 def ensure_db() -> None:
 	conn = get_db_connection()
 	cur = conn.cursor()
@@ -55,8 +380,12 @@ def ensure_db() -> None:
 			created_at TEXT NOT NULL,
 			amount_btc REAL NOT NULL,
 			price_usd_per_btc REAL NOT NULL,
+			amount_sat INTEGER,
+			price_micro INTEGER,
+			cost_micro INTEGER,
 			wallet_id INTEGER DEFAULT 1,
 			notes TEXT,
+			ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', created_at) AS INTEGER)) VIRTUAL,
 			FOREIGN KEY (wallet_id) REFERENCES wallets (id)
 		)
 		"""
@@ -68,8 +397,12 @@ def ensure_db() -> None:
 			created_at TEXT NOT NULL,
 			amount_btc REAL NOT NULL,
 			price_usd_per_btc REAL NOT NULL,
+			amount_sat INTEGER,
+			price_micro INTEGER,
+			cost_micro INTEGER,
 			wallet_id INTEGER DEFAULT 1,
 			notes TEXT,
+			ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', created_at) AS INTEGER)) VIRTUAL,
 			FOREIGN KEY (wallet_id) REFERENCES wallets (id)
 		)
 		"""
@@ -81,7 +414,10 @@ def ensure_db() -> None:
 			created_at TEXT NOT NULL,
 			amount_usd REAL NOT NULL,
 			price_toman_per_usd REAL NOT NULL,
-			amount_toman REAL NOT NULL
+			amount_toman REAL NOT NULL,
+			amount_usd_micro INTEGER,
+			amount_rial INTEGER,
+			ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', created_at) AS INTEGER)) VIRTUAL
 		)
 		"""
 	)
@@ -128,6 +464,208 @@ def ensure_db() -> None:
 		)
 		"""
 	)
+	# دیتابیس‌های قدیمی‌تر از کیف پول‌ها: ستون‌های wallet_id و notes معاملات
+	for table in ("purchases", "withdrawals"):
+		_ensure_column(cur, table, "wallet_id", "INTEGER DEFAULT 1")
+		_ensure_column(cur, table, "notes", "TEXT")
+	# مقادیر صحیح (ساتوشی، میکرودلار، ریال) برای دیتابیس‌های قدیمی‌تر؛ ردیف‌های موجود یک بار پر می‌شوند
+	# و triggerها آن‌ها را برای نویسنده‌هایی که فقط ستون‌های REAL را می‌نویسند پر می‌کنند
+	for table in ("purchases", "withdrawals"):
+		for column, decl in _TRADE_INT_COLUMNS:
+			_ensure_column(cur, table, column, decl)
+	for column, decl in _DEPOSIT_INT_COLUMNS:
+		_ensure_column(cur, "usd_deposits", column, decl)
+	_backfill_fixed_point(cur)
+	_create_fixed_point_triggers(cur)
+	# ستون ts (زمان به ثانیه، محاسبه‌شده از created_at) و ایندکس‌های بازه زمانی / کیف پول
+	for table in ("purchases", "withdrawals", "usd_deposits"):
+		_ensure_column(cur, table, "ts", _TS_COLUMN)
+		cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(ts)")
+	for table in ("purchases", "withdrawals"):
+		cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_wallet_ts ON {table}(wallet_id, ts)")
+	# روش بهای تمام‌شده پیش‌فرض هر کیف پول (costbasis.py)
+	_ensure_column(cur, "wallets", "cost_basis_method", "TEXT DEFAULT 'fifo'")
+	# نتایج موتور ارزیابی اهداف و محدودیت‌های ریسک (evaluation.py)
+	for column, decl in (("progress", "REAL DEFAULT 0"), ("evaluated_at", "TEXT"), ("achieved_at", "TEXT")):
+		_ensure_column(cur, "portfolio_goals", column, decl)
+	for column, decl in (
+		("current_value", "REAL DEFAULT 0"),
+		("utilization", "REAL DEFAULT 0"),
+		("state", "TEXT DEFAULT 'ok'"),
+		("baseline_price", "REAL"),
+		("baseline_date", "TEXT"),
+		("evaluated_at", "TEXT"),
+	):
+		_ensure_column(cur, "risk_limits", column, decl)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS threshold_events (
+			id INTEGER PRIMARY KEY AUTOINCREMENT,
+			created_at TEXT NOT NULL,
+			kind TEXT NOT NULL,
+			ref_id INTEGER NOT NULL,
+			wallet_id INTEGER,
+			previous_state TEXT,
+			state TEXT NOT NULL,
+			value REAL,
+			utilization REAL
+		)
+		"""
+	)
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_threshold_events_created ON threshold_events(created_at)")
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS evaluation_state (
+			id INTEGER PRIMARY KEY CHECK (id = 1),
+			change_version INTEGER NOT NULL DEFAULT 0,
+			price_version INTEGER NOT NULL DEFAULT -1,
+			evaluated_at TEXT
+		)
+		"""
+	)
+	cur.execute("INSERT OR IGNORE INTO evaluation_state(id) VALUES(1)")
+	# هشدارهای قیمت (alerts.py) و صف ارسال هشدارهای فعال‌شده
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS price_alerts (
+			id INTEGER PRIMARY KEY AUTOINCREMENT,
+			created_at TEXT NOT NULL,
+			symbol TEXT NOT NULL,
+			kind TEXT NOT NULL,
+			threshold REAL NOT NULL,
+			window_seconds INTEGER,
+			note TEXT,
+			is_active BOOLEAN DEFAULT 1,
+			triggered_at TEXT,
+			triggered_price REAL
+		)
+		"""
+	)
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_price_alerts_active ON price_alerts(is_active)")
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS alert_outbox (
+			id INTEGER PRIMARY KEY AUTOINCREMENT,
+			created_at TEXT NOT NULL,
+			alert_id INTEGER NOT NULL,
+			message TEXT NOT NULL,
+			payload TEXT,
+			status TEXT NOT NULL DEFAULT 'pending',
+			attempts INTEGER NOT NULL DEFAULT 0,
+			delivered_at TEXT,
+			last_error TEXT
+		)
+		"""
+	)
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_alert_outbox_status ON alert_outbox(status, id)")
+	# تاریخچه قیمت ساعتی و NAV روزانه/ساعتی هر کیف پول (nav.py)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS price_history (
+			hour TEXT PRIMARY KEY,
+			btc_usd REAL NOT NULL,
+			usdt_toman REAL
+		)
+		"""
+	)
+	# تاریخچه نرخ تتر/تومان (fx.py): یک ردیف برای هر تغییر نرخ؛ بار اول از نرخ‌های ساعتی پر می‌شود
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS fx_rates (
+			ts TEXT PRIMARY KEY,
+			usdt_toman REAL NOT NULL,
+			source TEXT NOT NULL
+		) WITHOUT ROWID
+		"""
+	)
+	cur.execute("SELECT COUNT(*) FROM fx_rates")
+	if cur.fetchone()[0] == 0:
+		cur.execute(
+			"""
+			INSERT OR IGNORE INTO fx_rates(ts, usdt_toman, source)
+			SELECT hour || ':00', usdt_toman, 'history' FROM price_history WHERE usdt_toman IS NOT NULL
+			"""
+		)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS nav_snapshots (
+			period TEXT NOT NULL,
+			wallet_id INTEGER NOT NULL,
+			bucket TEXT NOT NULL,
+			btc_balance REAL NOT NULL,
+			cost_basis_usd REAL NOT NULL,
+			realized_pnl_usd REAL NOT NULL,
+			unrealized_pnl_usd REAL,
+			value_usd REAL,
+			value_toman REAL,
+			btc_usd REAL,
+			usdt_toman REAL,
+			price_source TEXT,
+			created_at TEXT NOT NULL,
+			PRIMARY KEY (period, wallet_id, bucket)
+		) WITHOUT ROWID
+		"""
+	)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS nav_state (
+			id INTEGER PRIMARY KEY CHECK (id = 1),
+			data_version INTEGER NOT NULL,
+			built_through TEXT NOT NULL,
+			built_at TEXT NOT NULL
+		)
+		"""
+	)
+	# جمع ماهانه/سالانه سود تحقق‌یافته و حجم‌ها، میلادی و شمسی (rollups.py)، با مقادیر صحیح (money.py)
+	cur.execute("PRAGMA table_info(pnl_rollups)")
+	if "btc_bought" in {row[1] for row in cur.fetchall()}:
+		# جدول قدیمی با ستون‌های REAL: فقط کش است و دوباره از دفتر کل ساخته می‌شود
+		cur.execute("DROP TABLE pnl_rollups")
+		cur.execute("DROP TABLE IF EXISTS rollup_state")
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS pnl_rollups (
+			calendar TEXT NOT NULL,
+			period TEXT NOT NULL,
+			bucket TEXT NOT NULL,
+			realized_pnl_micro INTEGER NOT NULL DEFAULT 0,
+			realized_pnl_rial INTEGER NOT NULL DEFAULT 0,
+			sat_bought INTEGER NOT NULL DEFAULT 0,
+			usd_bought_micro INTEGER NOT NULL DEFAULT 0,
+			sat_sold INTEGER NOT NULL DEFAULT 0,
+			usd_sold_micro INTEGER NOT NULL DEFAULT 0,
+			usd_deposited_micro INTEGER NOT NULL DEFAULT 0,
+			rial_deposited INTEGER NOT NULL DEFAULT 0,
+			trades INTEGER NOT NULL DEFAULT 0,
+			PRIMARY KEY (calendar, period, bucket)
+		) WITHOUT ROWID
+		"""
+	)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS rollup_state (
+			id INTEGER PRIMARY KEY CHECK (id = 1),
+			change_version INTEGER NOT NULL,
+			last_purchase_at TEXT NOT NULL DEFAULT '',
+			last_withdrawal_at TEXT NOT NULL DEFAULT '',
+			unmatched_btc REAL NOT NULL DEFAULT 0,
+			lots TEXT,
+			updated_at TEXT
+		)
+		"""
+	)
+	# آخرین وضعیت موتور اندیکاتورها (indicators.py) برای ادامه بعد از ری‌استارت
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS indicator_checkpoints (
+			series TEXT PRIMARY KEY,
+			bar_start INTEGER,
+			state TEXT NOT NULL,
+			snapshot TEXT,
+			updated_at TEXT NOT NULL
+		)
+		"""
+	)
 	cur.execute(
 		"""
 		CREATE TABLE IF NOT EXISTS settings (
@@ -136,6 +674,168 @@ def ensure_db() -> None:
 		)
 		"""
 	)
+	# شمارنده نسخه داده‌ها: هر تغییر در جداول زیر آن را یک واحد بالا می‌برد (کلید کش رندر)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS data_version (
+			id INTEGER PRIMARY KEY CHECK (id = 1),
+			version INTEGER NOT NULL
+		)
+		"""
+	)
+	cur.execute("INSERT OR IGNORE INTO data_version(id, version) VALUES(1, 0)")
+	unversioned = ", ".join(f"'{key}'" for key in UNVERSIONED_SETTINGS)
+	for table in VERSIONED_TABLES:
+		for event in ("INSERT", "UPDATE", "DELETE"):
+			when = ""
+			if table == "settings":
+				when = f"WHEN {'OLD' if event == 'DELETE' else 'NEW'}.key NOT IN ({unversioned})"
+			if table in EVALUATED_COLUMNS or table == "settings":
+				# Recreated on every start: the UPDATE OF column list / WHEN clause follows the code
+				cur.execute(f"DROP TRIGGER IF EXISTS {table}_{event.lower()}_data_version")
+			cur.execute(
+				f"""
+				CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_data_version
+				AFTER {_update_event(cur, table) if event == "UPDATE" else event} ON {table}
+				{when}
+				BEGIN
+					UPDATE data_version SET version = version + 1 WHERE id = 1;
+				END
+				"""
+			)
+	
+	# لاگ تغییرات ردیف‌ها برای همگام‌سازی تدریجی کلاینت‌ها (version یکتا و صعودی است)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS change_log (
+			version INTEGER PRIMARY KEY AUTOINCREMENT,
+			table_name TEXT NOT NULL,
+			row_id INTEGER NOT NULL,
+			op TEXT NOT NULL,
+			changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+		)
+		"""
+	)
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log(table_name, row_id)")
+	for table in SYNCED_TABLES:
+		for event, ref, op in (("INSERT", "NEW", "insert"), ("UPDATE", "NEW", "update"), ("DELETE", "OLD", "delete")):
+			if table in EVALUATED_COLUMNS:
+				cur.execute(f"DROP TRIGGER IF EXISTS {table}_{op}_change_log")
+			cur.execute(
+				f"""
+				CREATE TRIGGER IF NOT EXISTS {table}_{op}_change_log
+				AFTER {_update_event(cur, table) if event == "UPDATE" else event} ON {table}
+				BEGIN
+					INSERT INTO change_log(table_name, row_id, op) VALUES('{table}', {ref}.id, '{op}');
+				END
+				"""
+			)
+	prune_change_log(conn)
+	
+	# دفتر رویدادهای دفتر کل (فقط افزودنی): ثبت، اصلاح و حذف هر ردیف با مقادیر کامل آن (ledger.py)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS ledger_events (
+			seq INTEGER PRIMARY KEY AUTOINCREMENT,
+			recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now')),
+			table_name TEXT NOT NULL,
+			row_id INTEGER NOT NULL,
+			op TEXT NOT NULL,
+			payload TEXT
+		)
+		"""
+	)
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_events_recorded ON ledger_events(recorded_at)")
+	cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_events_row ON ledger_events(table_name, row_id)")
+	cur.execute("SELECT COUNT(*) FROM ledger_events")
+	seed_events = cur.fetchone()[0] == 0
+	for table, columns in LEDGER_EVENT_TABLES.items():
+		for event, ref, op in (("INSERT", "NEW", "create"), ("UPDATE", "NEW", "correct"), ("DELETE", "OLD", "delete")):
+			payload = "NULL" if op == "delete" else _json_row(columns, f"{ref}.")
+			# Recreated on every start so the logged payload follows LEDGER_EVENT_TABLES
+			cur.execute(f"DROP TRIGGER IF EXISTS {table}_{op}_ledger_event")
+			cur.execute(
+				f"""
+				CREATE TRIGGER {table}_{op}_ledger_event
+				AFTER {event} ON {table}
+				BEGIN
+					INSERT INTO ledger_events(table_name, row_id, op, payload) VALUES('{table}', {ref}.id, '{op}', {payload});
+				END
+				"""
+			)
+	if seed_events:
+		# Databases from before the event log: one 'create' per existing row, at its own date
+		seed = " UNION ALL ".join(
+			f"SELECT substr(created_at, 1, 19) AS at, '{table}' AS t, id, {_json_row(columns)} AS payload FROM {table}"
+			for table, columns in LEDGER_EVENT_TABLES.items()
+		)
+		cur.execute(
+			f"""
+			INSERT INTO ledger_events(recorded_at, table_name, row_id, op, payload)
+			SELECT at, t, id, 'create', payload FROM ({seed}) ORDER BY at, t, id
+			"""
+		)
+	for event in ("UPDATE", "DELETE"):
+		cur.execute(
+			f"""
+			CREATE TRIGGER IF NOT EXISTS ledger_events_no_{event.lower()}
+			BEFORE {event} ON ledger_events
+			BEGIN
+				SELECT RAISE(ABORT, 'ledger_events is append-only');
+			END
+			"""
+		)
+	cur.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS ledger_snapshots (
+			seq INTEGER PRIMARY KEY,
+			recorded_at TEXT NOT NULL,
+			taken_at TEXT NOT NULL,
+			state TEXT NOT NULL
+		)
+		"""
+	)
+	
+	# جستجوی متنی (FTS5) روی یادداشت معاملات، نام/توضیح کیف پول‌ها و نام اهداف (search.py)
+	try:
+		cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+		build_index = cur.fetchone() is None
+		cur.execute(
+			"""
+			CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+				body,
+				tokenize = 'unicode61 remove_diacritics 2',
+				prefix = '2 3'
+			)
+			"""
+		)
+		for table, (kind, columns) in SEARCH_SOURCES.items():
+			key = f"(%s.id << {SEARCH_KIND_BITS}) | {kind}"
+			insert = (
+				f"INSERT INTO search_index(rowid, body) SELECT {key % 'NEW'}, {_search_text(columns, 'NEW.')} "
+				f"WHERE trim({_search_text(columns, 'NEW.')}) <> '';"
+			)
+			delete = f"DELETE FROM search_index WHERE rowid = {key % 'OLD'};"
+			for name, event, body in (
+				("insert", "INSERT", insert),
+				("update", f"UPDATE OF {', '.join(columns)}", delete + insert),
+				("delete", "DELETE", delete),
+			):
+				# Recreated on every start so the indexed text follows SEARCH_SOURCES / PERSIAN_NORMALIZE
+				cur.execute(f"DROP TRIGGER IF EXISTS {table}_{name}_search")
+				cur.execute(f"CREATE TRIGGER {table}_{name}_search AFTER {event} ON {table} BEGIN {body} END")
+			if build_index:
+				cur.execute(
+					f"""
+					INSERT INTO search_index(rowid, body)
+					SELECT (id << {SEARCH_KIND_BITS}) | {kind}, {_search_text(columns)} FROM {table}
+					WHERE trim({_search_text(columns)}) <> ''
+					"""
+				)
+	except sqlite3.OperationalError as e:
+		# SQLite بدون FTS5: بقیه برنامه بدون جستجو کار می‌کند
+		print(f"Full-text search disabled: {e}")
+	
 	# USD to Toman rate is now automatically fetched from Wallex API
 	# No need to store in database
 	
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+موتور ارزیابی اهداف پورتفولیو و محدودیت‌های ریسک
+
+نتایج در خود جدول‌ها ذخیره می‌شوند (portfolio_goals.current_value/progress/is_achieved و
+risk_limits.current_value/utilization/state) و صفحه پورتفولیو فقط آن‌ها را می‌خواند.
+هر عبور و خروج از آستانه (رسیدن به هدف، هشدار/عبور از محدودیت) در threshold_events ثبت می‌شود.
+
+ارزیابی تدریجی است:
+- تغییرات دفتر کل از change_log بعد از cursor ذخیره‌شده خوانده می‌شود و فقط کیف پول‌های
+  درگیر دوباره محاسبه می‌شوند
+- با تغییر snapshot قیمت فقط اهداف/محدودیت‌های وابسته به قیمت ارزیابی می‌شوند
+- ردیف‌ها فقط وقتی مقدارشان واقعاً عوض شده باشد نوشته می‌شوند
+"""
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from db import RESET_MARKER, get_db_connection
+from money import btc, usd
+from price_fetcher import get_current_btc_price, get_snapshot_version
+
+# Goal/limit types whose measured value moves with the BTC price
+PRICE_GOALS = {"value", "roi"}
+PRICE_LIMITS = {"max_loss", "daily_loss", "position_size"}
+
+LEDGER_TABLES = ("purchases", "withdrawals")
+
+_EMPTY_POSITION = {"btc": 0.0, "purchased_usd": 0.0, "withdrawn_usd": 0.0}
+
+
+def _placeholders(values) -> str:
+    return ",".join("?" * len(values))
+
+
+def wallet_positions(cur, wallet_ids: Set[int]) -> Dict[int, Dict[str, float]]:
+    """BTC balance and USD flows of each wallet in `wallet_ids` (one grouped query per table)."""
+    positions = {wid: dict(_EMPTY_POSITION) for wid in wallet_ids}
+    if not wallet_ids:
+        return positions
+    ids = sorted(wallet_ids)
+    for table, sign, usd_key in (("purchases", 1, "purchased_usd"), ("withdrawals", -1, "withdrawn_usd")):
+        # Exact integer sums (sat, micro-USD), converted once per wallet
+        cur.execute(
+            f"""
+            SELECT COALESCE(wallet_id, 1) AS wid, SUM(amount_sat) AS sat, SUM(cost_micro) AS micro
+            FROM {table} WHERE COALESCE(wallet_id, 1) IN ({_placeholders(ids)})
+            GROUP BY wid
+            """,
+            ids,
+        )
+        for row in cur.fetchall():
+            position = positions[int(row["wid"])]
+            position["btc"] += sign * btc(row["sat"] or 0)
+            position[usd_key] += usd(row["micro"] or 0)
+    return positions
+
+
+def wallet_metrics(position: Dict[str, float], price: Optional[float]) -> Dict[str, Optional[float]]:
+    value = position["btc"] * price if price else None
+    pnl = value + position["withdrawn_usd"] - position["purchased_usd"] if value is not None else None
+    roi = (pnl / position["purchased_usd"] * 100) if pnl is not None and position["purchased_usd"] > 0 else (0.0 if pnl is not None else None)
+    return {
+        "btc": position["btc"],
+        "value": value,
+        "pnl": pnl,
+        "roi": roi,
+        "net_invested": max(0.0, position["purchased_usd"] - position["withdrawn_usd"]),
+    }
+
+
+def goal_measure(goal_type: str, metrics: Dict[str, Optional[float]]) -> Optional[float]:
+    if goal_type == "btc":
+        return metrics["btc"]
+    if goal_type == "roi":
+        return metrics["roi"]
+    return metrics["value"]
+
+
+def _limit_measure(limit, metrics: Dict[str, Optional[float]], price: Optional[float], today: str) -> Dict[str, Any]:
+    """Measured quantity for a risk limit, plus the daily baseline for daily_loss."""
+    limit_type = limit["limit_type"]
+    baseline_price, baseline_date = limit["baseline_price"], limit["baseline_date"]
+    if limit_type == "max_investment":
+        measure = metrics["net_invested"]
+    elif price is None:
+        measure = None
+    elif limit_type == "max_loss":
+        measure = max(0.0, -metrics["pnl"])
+    elif limit_type == "daily_loss":
+        # Loss of the current position against the first price seen today
+        if baseline_date != today or not baseline_price:
+            baseline_price, baseline_date = price, today
+        measure = max(0.0, metrics["btc"] * (baseline_price - price))
+    else:  # position_size
+        measure = metrics["value"]
+    return {"measure": measure, "baseline_price": baseline_price, "baseline_date": baseline_date}
+
+
+def _limit_state(utilization: float, alert_threshold: float) -> str:
+    if utilization >= 1.0:
+        return "breached"
+    if utilization >= alert_threshold:
+        return "alert"
+    return "ok"
+
+
+def _dirty_scope(cur, since: int) -> Dict[str, Any]:
+    """What changed after change_log version `since`: wallets, goal ids, limit ids, or everything."""
+    scope: Dict[str, Any] = {"full": since <= 0, "wallets": set(), "goals": set(), "limits": set()}
+    if scope["full"]:
+        return scope
+    cur.execute(
+        "SELECT table_name, row_id, op FROM change_log WHERE version > ? AND table_name IN (?, ?, ?, ?, ?)",
+        (since, RESET_MARKER, *LEDGER_TABLES, "portfolio_goals", "risk_limits"),
+    )
+    inserted: Dict[str, List[int]] = {table: [] for table in LEDGER_TABLES}
+    for row in cur.fetchall():
+        table, row_id, op = row["table_name"], int(row["row_id"]), row["op"]
+        if table == RESET_MARKER or (table in LEDGER_TABLES and op != "insert"):
+            # The old wallet_id of an edited/deleted trade is gone: recompute every wallet
+            scope["full"] = True
+            return scope
+        if table in LEDGER_TABLES:
+            inserted[table].append(row_id)
+        elif table == "portfolio_goals":
+            scope["goals"].add(row_id)
+        else:
+            scope["limits"].add(row_id)
+    for table, ids in inserted.items():
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cur.execute(f"SELECT DISTINCT COALESCE(wallet_id, 1) FROM {table} WHERE id IN ({_placeholders(chunk)})", chunk)
+            scope["wallets"].update(int(r[0]) for r in cur.fetchall())
+    return scope
+
+
+def _select_items(cur, table: str, type_column: str, price_types: Iterable[str], scope: Dict[str, Any], price_changed: bool, extra_where: str = "") -> List[Any]:
+    if scope["full"]:
+        cur.execute(f"SELECT * FROM {table} WHERE 1=1 {extra_where}")
+        return cur.fetchall()
+    clauses, params = [], []
+    if scope["wallets"]:
+        clauses.append(f"COALESCE(wallet_id, 1) IN ({_placeholders(scope['wallets'])})")
+        params.extend(sorted(scope["wallets"]))
+    ids = scope["goals"] if table == "portfolio_goals" else scope["limits"]
+    if ids:
+        clauses.append(f"id IN ({_placeholders(ids)})")
+        params.extend(sorted(ids))
+    if price_changed:
+        types = sorted(price_types)
+        clauses.append(f"{type_column} IN ({_placeholders(types)})")
+        params.extend(types)
+    if not clauses:
+        return []
+    cur.execute(f"SELECT * FROM {table} WHERE ({' OR '.join(clauses)}) {extra_where}", params)
+    return cur.fetchall()
+
+
+def wallet_of(row) -> int:
+    return int(row["wallet_id"]) if row["wallet_id"] is not None else 1
+
+
+def _event(cur, now: str, kind: str, row, previous: Optional[str], state: str, value: Optional[float], utilization: Optional[float]) -> None:
+    cur.execute(
+        "INSERT INTO threshold_events(created_at, kind, ref_id, wallet_id, previous_state, state, value, utilization) VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+        (now, kind, row["id"], row["wallet_id"], previous, state, value, utilization),
+    )
+
+
+def evaluate(force_full: bool = False, conn=None) -> Dict[str, Any]:
+    """Re-evaluate the goals and risk limits affected since the last run and persist the results.
+
+    Returns counts of what was looked at and written. Safe to call from any process:
+    everything happens inside one write transaction together with the cursor update.
+    """
+    price = get_current_btc_price()
+    price_version = get_snapshot_version()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    result = {"full": False, "wallets": 0, "goals": 0, "limits": 0, "updated": 0, "events": 0}
+    try:
+        cur = conn.cursor()
+        # Cheap check first, without taking the write lock
+        cur.execute("SELECT change_version, price_version FROM evaluation_state WHERE id = 1")
+        state = cur.fetchone()
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+        latest = int(cur.fetchone()[0])
+        if not force_full and state and state["change_version"] == latest and state["price_version"] == price_version:
+            return result
+        conn.commit()
+
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT change_version, price_version FROM evaluation_state WHERE id = 1")
+        state = cur.fetchone()
+        since = 0 if force_full or state is None else int(state["change_version"])
+        price_changed = state is None or int(state["price_version"]) != price_version
+        scope = _dirty_scope(cur, since)
+        result["full"] = scope["full"]
+
+        goals = _select_items(cur, "portfolio_goals", "goal_type", PRICE_GOALS, scope, price_changed)
+        limits = _select_items(cur, "risk_limits", "limit_type", PRICE_LIMITS, scope, price_changed, "AND is_active = 1")
+        wallet_ids = {wallet_of(r) for r in list(goals) + list(limits)}
+        metrics = {wid: wallet_metrics(p, price) for wid, p in wallet_positions(cur, wallet_ids).items()}
+        result.update({"wallets": len(wallet_ids), "goals": len(goals), "limits": len(limits)})
+
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        today = date.today().isoformat()
+        for goal in goals:
+            measure = goal_measure(goal["goal_type"], metrics[wallet_of(goal)])
+            if measure is None:
+                continue  # price-dependent goal and no price yet: keep the last result
+            target = float(goal["target_value"])
+            current = round(measure, 8)
+            progress = round(max(0.0, measure / target), 6) if target > 0 else 0.0
+            achieved = target > 0 and measure >= target
+            if current == goal["current_value"] and progress == goal["progress"] and achieved == bool(goal["is_achieved"]):
+                continue
+            cur.execute(
+                "UPDATE portfolio_goals SET current_value = ?, progress = ?, is_achieved = ?, evaluated_at = ?, achieved_at = ? WHERE id = ?",
+                (current, progress, int(achieved), now, (goal["achieved_at"] or now) if achieved else None, goal["id"]),
+            )
+            result["updated"] += 1
+            if achieved != bool(goal["is_achieved"]):
+                _event(cur, now, "goal", goal, "achieved" if goal["is_achieved"] else "open", "achieved" if achieved else "open", current, progress)
+                result["events"] += 1
+
+        for limit in limits:
+            limit_metrics = metrics[wallet_of(limit)]
+            measured = _limit_measure(limit, limit_metrics, price, today)
+            if measured["measure"] is None:
+                continue
+            limit_value = float(limit["limit_value"])
+            current = round(measured["measure"], 8)
+            utilization = round(measured["measure"] / limit_value, 6) if limit_value > 0 else 0.0
+            new_state = _limit_state(utilization, float(limit["alert_threshold"] if limit["alert_threshold"] is not None else 0.8))
+            unchanged = (
+                current == limit["current_value"] and utilization == limit["utilization"] and new_state == limit["state"]
+                and measured["baseline_price"] == limit["baseline_price"] and measured["baseline_date"] == limit["baseline_date"]
+            )
+            if unchanged:
+                continue
+            cur.execute(
+                "UPDATE risk_limits SET current_value = ?, utilization = ?, state = ?, baseline_price = ?, baseline_date = ?, evaluated_at = ? WHERE id = ?",
+                (current, utilization, new_state, measured["baseline_price"], measured["baseline_date"], now, limit["id"]),
+            )
+            result["updated"] += 1
+            if new_state != (limit["state"] or "ok"):
+                _event(cur, now, "risk", limit, limit["state"] or "ok", new_state, current, utilization)
+                result["events"] += 1
+
+        # Our own UPDATEs only touch db.EVALUATED_COLUMNS and are not logged; other writers' changes
+        # committed before BEGIN IMMEDIATE were in scope above
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+        cur.execute(
+            "UPDATE evaluation_state SET change_version = ?, price_version = ?, evaluated_at = ? WHERE id = 1",
+            (int(cur.fetchone()[0]), price_version, now),
+        )
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def recent_events(limit: int = 50, conn=None) -> List[Dict[str, Any]]:
+    """Newest threshold events first."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM threshold_events ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        if own_conn:
+            conn.close()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+تاریخچه نرخ تتر/تومان و ارزش‌گذاری تومانی هر معامله به نرخ زمان خودش
+
+- fx_rates: هر بار که نرخ تتر در tickهای price_fetcher عوض شود یک ردیف (زمان UTC، نرخ) ثبت می‌شود؛
+  در اولین اجرا از نرخ‌های ساعتی price_history پر می‌شود
+- نرخ واریزهای دلاری (usd_deposits.price_toman_per_usd) هم نرخ شناخته‌شده همان لحظه است
+
+هر دو در حافظه به صورت لیست‌های مرتب زمان نگه داشته می‌شوند (بازار: فقط ردیف‌های جدیدتر از آخرین
+ردیف شاخص خوانده می‌شوند؛ واریزها: با تغییر data_version دوباره خوانده می‌شوند). نرخ در زمان t آخرین
+نرخ شناخته‌شده تا t است (جدیدتر از بین بازار و واریز) و با bisect در O(log n) و بدون هیچ فراخوانی
+بیرونی پیدا می‌شود.
+
+واحد همه نرخ‌ها «تومان برای هر دلار» است: نرخ بازار تومان برای هر تتر است و تتر هم‌ارز دلار گرفته
+می‌شود (همان فرض btc_toman در price_fetcher/API)، و price_toman_per_usd واریزها خودش تومان برای هر دلار
+است. همه جمع‌های تومانی برنامه با toman_per_usd() به همین واحد حساب می‌شوند؛ فقط تنظیم usd_to_toman
+(نرخ دستی، وقتی هیچ نرخی در دست نیست) به واحد قدیمی ذخیره می‌شود (ریال برای هر دلار) و اینجا تبدیل می‌شود.
+"""
+
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from db import get_data_version, get_db_connection
+from money import toman, usd
+from price_fetcher import get_current_usdt_price
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOMAN_PER_USD = 60000.0
+
+
+class RateIndex:
+    """Sorted (timestamp, rate) pairs with last-known-value lookup."""
+
+    def __init__(self, rows: Iterable[Tuple[str, float]] = ()):
+        pairs = sorted(rows)
+        self.keys: List[str] = [p[0] for p in pairs]
+        self.rates: List[float] = [p[1] for p in pairs]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def append(self, ts: str, rate: float) -> None:
+        i = bisect_right(self.keys, ts)
+        self.keys.insert(i, ts)
+        self.rates.insert(i, rate)
+
+    def at(self, ts: str) -> Tuple[Optional[str], Optional[float]]:
+        i = bisect_right(self.keys, ts) - 1
+        return (self.keys[i], self.rates[i]) if i >= 0 else (None, None)
+
+    def last(self) -> Optional[float]:
+        return self.rates[-1] if self.rates else None
+
+
+_lock = threading.Lock()
+_market: Optional[RateIndex] = None
+_deposits: Dict[str, Any] = {"data_version": None, "index": RateIndex()}
+
+
+def _now() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _indexes(conn=None) -> Tuple[RateIndex, RateIndex]:
+    """Market and deposit indexes, loading/refreshing them from the database when needed."""
+    global _market
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        version = get_data_version(conn)
+        with _lock:
+            if _market is None:
+                _market = RateIndex()
+            # Only rows newer than the index (usually none): the tick listener may run in another process
+            last = _market.keys[-1] if _market.keys else ""
+            for r in conn.execute("SELECT ts, usdt_toman FROM fx_rates WHERE ts > ? ORDER BY ts", (last,)).fetchall():
+                _market.append(r["ts"], float(r["usdt_toman"]))
+            if _deposits["data_version"] != version:
+                rows = conn.execute("SELECT created_at, price_toman_per_usd FROM usd_deposits").fetchall()
+                _deposits.update({"data_version": version, "index": RateIndex((r[0], float(r[1])) for r in rows)})
+            return _market, _deposits["index"]
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def record_fx_tick(prices: Dict[str, Optional[float]]) -> None:
+    """price_fetcher tick listener: store the USDT/Toman rate whenever it changes."""
+    rate = prices.get("usdt_toman")
+    if not rate:
+        return
+    rate = float(rate)
+    conn = get_db_connection()
+    try:
+        market, _ = _indexes(conn)
+        if market.last() == rate:
+            return
+        ts = _now()
+        conn.execute("INSERT OR REPLACE INTO fx_rates(ts, usdt_toman, source) VALUES(?, ?, 'market')", (ts, rate))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"[fx] cannot record rate: {e}")
+    finally:
+        conn.close()
+
+
+def _pick(market: RateIndex, deposits: RateIndex, ts: str) -> Optional[float]:
+    # Both indexes hold Toman per USD (market: Toman per USDT at par), so the newer one wins as is
+    market_key, market_rate = market.at(ts)
+    deposit_key, deposit_rate = deposits.at(ts)
+    if market_key is None:
+        return deposit_rate
+    if deposit_key is None:
+        return market_rate
+    # Same-minute tie goes to the market rate
+    return deposit_rate if deposit_key[:16] > market_key[:16] else market_rate
+
+
+def rate_at(ts: str, conn=None) -> Optional[float]:
+    """Last known USDT/Toman rate at `ts` (ISO, UTC); None before the first known rate."""
+    market, deposits = _indexes(conn)
+    with _lock:
+        return _pick(market, deposits, ts)
+
+
+def rates_at(timestamps: Iterable[str], conn=None) -> List[Optional[float]]:
+    """rate_at() for many timestamps with one index check (bulk valuation)."""
+    market, deposits = _indexes(conn)
+    with _lock:
+        return [_pick(market, deposits, ts) for ts in timestamps]
+
+
+def current_rate(conn=None) -> Optional[float]:
+    """Toman per USD now: the live USDT rate, else the last known rate (None when there is none)."""
+    live = get_current_usdt_price()
+    if live:
+        return float(live)
+    market, deposits = _indexes(conn)
+    with _lock:
+        return _pick(market, deposits, "9999")
+
+
+def toman_per_usd(conn=None, settings: Optional[Dict[str, str]] = None) -> float:
+    """Toman per USD for values at today's rate: current_rate(), else the usd_to_toman setting.
+
+    The setting is stored in Rial per USD (the unit the old USDT × 10 rate had); `settings` is an
+    already loaded settings dict, otherwise the row is read through `conn`.
+    """
+    rate = current_rate(conn)
+    if rate:
+        return rate
+    if settings is not None:
+        value = settings.get("usd_to_toman")
+    else:
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'usd_to_toman'").fetchone()
+            value = row[0] if row else None
+        finally:
+            if own_conn:
+                conn.close()
+    return toman(float(value)) if value else DEFAULT_TOMAN_PER_USD
+
+
+def toman_at_trade(trades: List[Dict[str, Any]], fallback: Optional[float] = None, conn=None) -> List[Optional[float]]:
+    """Toman value of each trade (cost_micro) at the rate of its own created_at (`fallback` before history)."""
+    rates = rates_at((t["created_at"] for t in trades), conn)
+    return [usd(t["cost_micro"]) * (rate or fallback) if (rate or fallback) else None for t, rate in zip(trades, rates)]
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+موتور اندیکاتورهای غلتان (SMA / EMA / نوسان / افت از سقف)
+
+دو سری: btc_usd (قیمت بیت‌کوین) و portfolio_usd (ارزش BTC موجود به قیمت روز).
+SMA/EMA هر سری روی خود مقدار است؛ بازده (نوسان) و افت از سقف portfolio_usd روی NAV هر واحد
+(time-weighted) حساب می‌شوند تا خرید و برداشت بازده یا افت به حساب نیایند.
+tickهای price_fetcher به کندل‌های BAR_SECONDS ثانیه‌ای تبدیل می‌شوند و با بسته شدن هر کندل
+وضعیت هر پنجره با هزینه O(1) به‌روزرسانی می‌شود (جمع غلتان، EMA، جمع مربعات بازده لگاریتمی،
+سقف و بیشترین افت). هیچ درخواستی اندیکاتورها را از تاریخچه خام دوباره حساب نمی‌کند.
+
+بعد از هر کندل، وضعیت کامل و مقادیر محاسبه‌شده در indicator_checkpoints ذخیره می‌شوند:
+- بعد از ری‌استارت، موتور از همان نقطه ادامه می‌دهد
+- API و صفحات (در هر worker) فقط همین ردیف‌ها را می‌خوانند
+- نوشتن compare-and-set روی bar_start است؛ وضعیت قدیمی‌تر هیچ‌وقت checkpoint جدیدتر را بازنویسی نمی‌کند
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from db import get_data_version, get_db_connection
+from money import btc
+
+BAR_SECONDS = 300
+# window name -> number of bars
+WINDOWS = {"1h": 12, "4h": 48, "24h": 288}
+VOLATILITY_WINDOW = "24h"
+BARS_PER_YEAR = 365 * 24 * 3600 / BAR_SECONDS
+SERIES = ("btc_usd", "portfolio_usd")
+
+logger = logging.getLogger(__name__)
+
+
+class RollingStats:
+    """Sum and sum of squares of the last `n` values, O(1) per push."""
+
+    def __init__(self, n: int, values: Iterable[float] = ()):
+        self.n = n
+        self.values: deque = deque(maxlen=n)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._since_resum = 0
+        for value in values:
+            self.push(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def push(self, x: float) -> None:
+        if len(self.values) == self.n:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        self._since_resum += 1
+        if self._since_resum >= 8 * self.n:
+            # Re-add from scratch now and then so float error cannot accumulate (amortized O(1))
+            self._since_resum = 0
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+
+    def full(self) -> bool:
+        return len(self.values) == self.n
+
+    def mean(self) -> Optional[float]:
+        return self.total / len(self.values) if self.values else None
+
+    def stdev(self) -> Optional[float]:
+        k = len(self.values)
+        if k < 2:
+            return None
+        variance = (self.total_sq - self.total * self.total / k) / (k - 1)
+        return math.sqrt(max(0.0, variance))
+
+
+class SeriesState:
+    """Bar builder plus the rolling indicator state of one series."""
+
+    def __init__(self):
+        self.bar_start: Optional[int] = None
+        self.pending: Optional[float] = None  # close of the bar still being built
+        self.last_close: Optional[float] = None
+        self.bars = 0
+        self.sma = {name: RollingStats(n) for name, n in WINDOWS.items()}
+        self.ema: Dict[str, Optional[float]] = {name: None for name in WINDOWS}
+        self.returns = RollingStats(WINDOWS[VOLATILITY_WINDOW])
+        self.peak: Optional[float] = None
+        self.max_drawdown = 0.0
+        # Returns and drawdown are measured on the basis (the value itself, or a flow-adjusted NAV)
+        self.pending_basis: Optional[float] = None
+        self.last_basis: Optional[float] = None
+        # portfolio_usd only: {"value", "price", "btc"} of the per-unit NAV, see _portfolio_basis
+        self.nav: Optional[Dict[str, float]] = None
+
+    def add_tick(self, ts: float, value: float, basis: Optional[float]) -> bool:
+        """Feed one observation; returns True when it closed the previous bar."""
+        bucket = int(ts // BAR_SECONDS) * BAR_SECONDS
+        if self.bar_start is None or self.pending is None:
+            self.bar_start, self.pending, self.pending_basis = bucket, value, basis
+            return False
+        if bucket <= self.bar_start:
+            if bucket == self.bar_start:
+                self.pending, self.pending_basis = value, basis
+            return False
+        self._close_bar(self.pending, self.pending_basis)
+        self.bar_start, self.pending, self.pending_basis = bucket, value, basis
+        return True
+
+    def _close_bar(self, close: float, basis: Optional[float]) -> None:
+        for name, n in WINDOWS.items():
+            self.sma[name].push(close)
+            ema = self.ema[name]
+            self.ema[name] = close if ema is None else ema + (2.0 / (n + 1)) * (close - ema)
+        self.last_close = close
+        self.bars += 1
+        if basis is None:
+            return
+        if self.last_basis and self.last_basis > 0 and basis > 0:
+            self.returns.push(math.log(basis / self.last_basis))
+        self.last_basis = basis
+        if self.peak is None or basis > self.peak:
+            self.peak = basis
+        if self.peak and self.peak > 0:
+            self.max_drawdown = max(self.max_drawdown, (self.peak - basis) / self.peak)
+
+    def snapshot(self) -> Dict[str, Any]:
+        stdev = self.returns.stdev()
+        vol_bars = WINDOWS[VOLATILITY_WINDOW]
+        return {
+            "bars": self.bars,
+            "close": self.last_close,
+            "sma": {name: (stats.mean() if stats.full() else None) for name, stats in self.sma.items()},
+            "ema": {name: (self.ema[name] if self.bars >= n else None) for name, n in WINDOWS.items()},
+            "volatility": {
+                "window": VOLATILITY_WINDOW,
+                "period_pct": stdev * math.sqrt(vol_bars) * 100 if stdev is not None else None,
+                "annualized_pct": stdev * math.sqrt(BARS_PER_YEAR) * 100 if stdev is not None else None,
+            },
+            "drawdown": {
+                "peak": self.peak,
+                "current_pct": ((self.peak - self.last_basis) / self.peak * 100) if self.peak and self.last_basis is not None else None,
+                "max_pct": self.max_drawdown * 100,
+            },
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "bar_start": self.bar_start,
+            "pending": self.pending,
+            "last_close": self.last_close,
+            "bars": self.bars,
+            "sma": {name: list(stats.values) for name, stats in self.sma.items()},
+            "ema": self.ema,
+            "returns": list(self.returns.values),
+            "peak": self.peak,
+            "max_drawdown": self.max_drawdown,
+            "pending_basis": self.pending_basis,
+            "last_basis": self.last_basis,
+            "nav": self.nav,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SeriesState":
+        series = cls()
+        series.bar_start = state.get("bar_start")
+        series.pending = state.get("pending")
+        series.last_close = state.get("last_close")
+        series.bars = int(state.get("bars") or 0)
+        for name, n in WINDOWS.items():
+            series.sma[name] = RollingStats(n, state.get("sma", {}).get(name, []))
+            series.ema[name] = state.get("ema", {}).get(name)
+        series.returns = RollingStats(WINDOWS[VOLATILITY_WINDOW], state.get("returns", []))
+        series.peak = state.get("peak")
+        series.max_drawdown = float(state.get("max_drawdown") or 0.0)
+        series.pending_basis = state.get("pending_basis", series.pending)
+        series.last_basis = state.get("last_basis", series.last_close)
+        series.nav = state.get("nav")
+        return series
+
+
+# ----------------------------------------------------------------------------
+# Engine (runs in the process that refreshes prices)
+# ----------------------------------------------------------------------------
+_series: Dict[str, SeriesState] = {}
+_lock = threading.Lock()
+_balance_cache: Dict[str, Any] = {"data_version": None, "btc": 0.0}
+
+
+def _load_checkpoints(conn) -> None:
+    """(Re)load every series missing from memory from its checkpoint."""
+    missing = [name for name in SERIES if name not in _series]
+    cur = conn.cursor()
+    cur.execute(f"SELECT series, state FROM indicator_checkpoints WHERE series IN ({', '.join('?' * len(missing))})", missing)
+    for row in cur.fetchall():
+        try:
+            state = json.loads(row["state"])
+            if row["series"] == "portfolio_usd" and "nav" not in state:
+                # Checkpoint from before flow adjustment: its returns/drawdown include buys and withdrawals
+                state.update(returns=[], peak=None, max_drawdown=0.0, pending_basis=None, last_basis=None)
+            _series[row["series"]] = SeriesState.from_state(state)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[indicators] ignoring bad checkpoint for {row['series']}: {e}")
+    for name in missing:
+        _series.setdefault(name, SeriesState())
+    logger.info(f"[indicators] resumed from checkpoints: {', '.join(f'{n}={_series[n].bars} bars' for n in missing)}")
+
+
+def _btc_balance(conn) -> float:
+    """Total BTC held, re-read only when the ledger's data_version moved."""
+    version = get_data_version(conn)
+    if _balance_cache["data_version"] != version:
+        row = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(amount_sat), 0) FROM purchases) - (SELECT COALESCE(SUM(amount_sat), 0) FROM withdrawals)"
+        ).fetchone()
+        _balance_cache.update({"data_version": version, "btc": btc(row[0] or 0)})
+    return _balance_cache["btc"]
+
+
+def _portfolio_basis(series: SeriesState, price: float, balance: float) -> Optional[float]:
+    """Per-unit NAV of the portfolio (time-weighted).
+
+    Between two ticks the NAV moves with the BTC price only if BTC was held; a buy or withdrawal
+    changes the balance, not the NAV. It starts at the portfolio value of the first tick with BTC.
+    """
+    nav = series.nav
+    if nav is None:
+        if balance <= 0:
+            return None
+        nav = series.nav = {"value": balance * price, "price": price, "btc": balance}
+    elif nav["btc"] > 0 and nav["price"] > 0:
+        nav["value"] *= price / nav["price"]
+    nav.update(price=price, btc=balance)
+    return nav["value"]
+
+
+def _save_checkpoints(conn, names: List[str]) -> List[str]:
+    """Compare-and-set on bar_start; returns the series whose stored checkpoint was already as new.
+
+    Those are dropped from memory so the next tick resumes from the stored state instead of
+    overwriting it.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    cur = conn.cursor()
+    stale = []
+    for name in names:
+        series = _series[name]
+        state, snapshot = json.dumps(series.to_state()), json.dumps(series.snapshot())
+        cur.execute(
+            "UPDATE indicator_checkpoints SET bar_start = ?, state = ?, snapshot = ?, updated_at = ? WHERE series = ? AND bar_start < ?",
+            (series.bar_start, state, snapshot, now, name, series.bar_start),
+        )
+        if cur.rowcount == 0:
+            cur.execute(
+                "INSERT OR IGNORE INTO indicator_checkpoints(series, bar_start, state, snapshot, updated_at) VALUES(?, ?, ?, ?, ?)",
+                (name, series.bar_start, state, snapshot, now),
+            )
+            if cur.rowcount == 0:
+                stale.append(name)
+    conn.commit()
+    for name in stale:
+        logger.warning(f"[indicators] checkpoint of {name} is newer than ours, reloading it")
+        del _series[name]
+    return stale
+
+
+def process_tick(btc_price: float, ts: Optional[float] = None) -> List[str]:
+    """Feed one BTC price observation; returns the series whose bar closed (and were checkpointed)."""
+    ts = ts or time.time()
+    with _lock:
+        conn = get_db_connection()
+        try:
+            if len(_series) < len(SERIES):
+                _load_checkpoints(conn)
+            balance = _btc_balance(conn)
+            values = {
+                "btc_usd": (btc_price, btc_price),
+                "portfolio_usd": (balance * btc_price, _portfolio_basis(_series["portfolio_usd"], btc_price, balance)),
+            }
+            closed = [name for name, (value, basis) in values.items() if _series[name].add_tick(ts, value, basis)]
+            if closed:
+                stale = _save_checkpoints(conn, closed)
+                closed = [name for name in closed if name not in stale]
+            return closed
+        finally:
+            conn.close()
+
+
+def on_price_tick(prices: Dict[str, Optional[float]]) -> None:
+    """price_fetcher tick listener."""
+    btc_price = prices.get("btc_usd")
+    if not btc_price:
+        return
+    try:
+        process_tick(float(btc_price))
+    except Exception as e:
+        logger.error(f"[indicators] tick processing failed: {e}")
+
+
+def get_indicators(conn=None) -> Dict[str, Any]:
+    """Latest checkpointed indicator values of every series (no computation)."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT series, bar_start, snapshot, updated_at FROM indicator_checkpoints")
+        series = {}
+        for row in cur.fetchall():
+            values = json.loads(row["snapshot"]) if row["snapshot"] else {}
+            values.update({"bar_start": row["bar_start"], "updated_at": row["updated_at"]})
+            series[row["series"]] = values
+        return {"bar_seconds": BAR_SECONDS, "windows": WINDOWS, "series": series}
+    finally:
+        if own_conn:
+            conn.close()
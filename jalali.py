@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+تبدیل تاریخ میلادی به شمسی (جلالی)
+
+الگوریتم محاسباتی رایج (بدون وابستگی خارجی). تاریخ‌های دیتابیس به وقت UTC ذخیره شده‌اند؛
+برای گروه‌بندی شمسی ابتدا به وقت تهران (UTC+03:30، بدون ساعت تابستانی از ۱۴۰۱) برده می‌شوند.
+"""
+
+from datetime import datetime, timedelta
+from typing import Tuple
+
+TEHRAN_OFFSET = timedelta(hours=3, minutes=30)
+
+MONTH_NAMES = (
+    "فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور",
+    "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند",
+)
+
+_CUMULATIVE_DAYS = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+
+def gregorian_to_jalali(gy: int, gm: int, gd: int) -> Tuple[int, int, int]:
+    gy2 = gy + 1 if gm > 2 else gy
+    days = 355666 + 365 * gy + (gy2 + 3) // 4 - (gy2 + 99) // 100 + (gy2 + 399) // 400 + gd + _CUMULATIVE_DAYS[gm - 1]
+    jy = -1595 + 33 * (days // 12053)
+    days %= 12053
+    jy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        jy += (days - 1) // 365
+        days = (days - 1) % 365
+    if days < 186:
+        return jy, 1 + days // 31, 1 + days % 31
+    return jy, 7 + (days - 186) // 30, 1 + (days - 186) % 30
+
+
+def jalali_date(utc_iso: str) -> Tuple[int, int, int]:
+    """Jalali (year, month, day) in Tehran time of a stored UTC timestamp."""
+    local = datetime.fromisoformat(utc_iso[:19]) + TEHRAN_OFFSET
+    return gregorian_to_jalali(local.year, local.month, local.day)
+
+
+def month_label(bucket: str) -> str:
+    """'1405-07' -> 'مهر ۱۴۰۵'"""
+    year, month = bucket.split("-")
+    return f"{MONTH_NAMES[int(month) - 1]} {year.translate(str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹'))}"
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+کارهای دوره‌ای برنامه که در زمان‌بند (scheduler.py) ثبت می‌شوند
+
+- price_refresh     هر ۳۰ ثانیه، قیمت تتر و بیت‌کوین (price_fetcher.refresh_prices)؛ هر tick با
+                    هشدارهای قیمت (alerts.py) تطبیق داده می‌شود، به موتور اندیکاتورها (indicators.py) می‌رود
+                    و اولین قیمت هر ساعت در price_history و هر تغییر نرخ تتر در fx_rates (fx.py) ثبت می‌شود؛
+                    این listenerها فقط در پروسه صاحب زمان‌بند اجرا می‌شوند (حتی برای /api/force-update)
+- wallet_balances   هر دقیقه، موجودی on-chain آدرس‌های تنظیم‌شده (گرم نگه داشتن کش /api/wallet_balance)
+- goal_risk         ارزیابی اهداف و محدودیت‌های ریسک (evaluation.py)؛ بلافاصله بعد از هر تغییر قیمت،
+                    و هر ۱۵ ثانیه برای تغییرات دفتر کل (اگر چیزی عوض نشده باشد فوراً برمی‌گردد)
+- pnl_rollups       هر دقیقه، جمع ماهانه/سالانه سود/زیان (rollups.py) برای تغییراتی که مسیر ثبت آن را
+                    به‌روز نکرده (حذف از API، وب‌هوک...)؛ اگر چیزی عوض نشده باشد فوراً برمی‌گردد
+- nav_snapshot      هر ساعت، ردیف NAV روز و ساعت جاری هر کیف پول (nav.py)؛ در اولین اجرا و بعد از هر
+                    تغییر دفتر کل، روزهای گذشته از روی دفتر کل و تاریخچه قیمت بازسازی می‌شوند
+- ledger_snapshot   هر ۱۰ دقیقه، snapshot وضعیت دفتر کل (ledger.py) اگر از آخرین snapshot حداقل ۵۰۰ رویداد
+                    یا یک روز گذشته باشد
+- db_backup         هر شب، نسخه پشتیبان SQLite در پوشه backups/ (نگهداری آخرین N نسخه)
+- db_maintenance    هر شب، پاک‌سازی change_log، PRAGMA optimize و کوتاه کردن WAL
+
+متغیرهای محیطی:
+- PPLUS_BACKUP_DIR=backups
+- PPLUS_BACKUP_KEEP=14
+- PPLUS_NAV_HOURLY=1      0 = فقط ردیف‌های روزانه NAV
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from db import BASE_DIR, backup_database, get_db_context, optimize_database
+from alerts import on_price_tick
+from evaluation import evaluate
+from fx import record_fx_tick
+from indicators import on_price_tick as feed_indicators
+from nav import record_price_tick, snapshot_nav
+from ledger import take_snapshot
+from rollups import refresh_rollups
+from price_fetcher import add_price_listener, add_tick_listener, start_price_fetcher
+from scheduler import scheduler
+
+BACKUP_DIR = os.environ.get("PPLUS_BACKUP_DIR") or os.path.join(BASE_DIR, "backups")
+BACKUP_KEEP = int(os.environ.get("PPLUS_BACKUP_KEEP", "14"))
+BACKUP_PREFIX = "pplus_"
+
+logger = logging.getLogger(__name__)
+
+
+def poll_wallet_balances() -> None:
+    from routes.api import _read_wallet_addresses, _wallet_balance_payload
+
+    with get_db_context() as conn:
+        settings = _read_wallet_addresses(conn.cursor())
+    if settings.get("btc_wallet_address") or settings.get("usdt_wallet_address"):
+        _wallet_balance_payload(settings, max_age=0)
+
+
+def evaluate_goals_and_limits() -> None:
+    result = evaluate()
+    if result["updated"] or result["events"]:
+        logger.info(f"[jobs] goal/risk evaluation: {result}")
+
+
+def refresh_rollups_job() -> None:
+    result = refresh_rollups()
+    if result["rebuilt"]:
+        logger.info(f"[jobs] P&L rollups rebuilt: {result}")
+
+
+def snapshot_nav_job() -> None:
+    result = snapshot_nav()
+    if result["rebuilt"]:
+        logger.info(f"[jobs] NAV snapshots rebuilt: {result}")
+
+
+def ledger_snapshot_job() -> None:
+    result = take_snapshot()
+    if result["taken"]:
+        logger.info(f"[jobs] ledger snapshot: {result}")
+
+
+def _on_price_change(version: int) -> None:
+    scheduler.run_now("goal_risk")
+
+
+# Listeners fed with every price tick; a refresh outside the scheduler owner (e.g. POST /api/force-update
+# served by another worker) only updates the shared snapshot, so alerts, indicators, NAV and FX rates
+# are processed by one process only
+TICK_LISTENERS = (on_price_tick, feed_indicators, record_price_tick, record_fx_tick)
+
+
+def _on_price_tick(prices) -> None:
+    if not scheduler.owner:
+        return
+    for callback in TICK_LISTENERS:
+        try:
+            callback(prices)
+        except Exception as e:
+            logger.error(f"[jobs] tick listener {callback.__module__}.{callback.__name__} failed: {e}")
+
+
+def backup_db() -> None:
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite3"
+    path = backup_database(os.path.join(BACKUP_DIR, name))
+    logger.info(f"[jobs] backup written: {path}")
+    backups = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith(BACKUP_PREFIX) and f.endswith(".sqlite3"))
+    for old in backups[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        try:
+            os.remove(os.path.join(BACKUP_DIR, old))
+        except OSError as e:
+            logger.warning(f"[jobs] cannot remove old backup {old}: {e}")
+
+
+def maintain_db() -> None:
+    result = optimize_database()
+    logger.info(f"[jobs] db maintenance: {result}")
+
+
+def start_background_jobs() -> None:
+    """Register every periodic job and start the scheduler (jobs run in one process per host)."""
+    start_price_fetcher()
+    scheduler.add_job("wallet_balances", poll_wallet_balances, interval=55, jitter=5, timeout=60)
+    scheduler.add_job("goal_risk", evaluate_goals_and_limits, interval=15, timeout=60, run_at_start=True)
+    add_price_listener(_on_price_change)
+    add_tick_listener(_on_price_tick)
+    scheduler.add_job("pnl_rollups", refresh_rollups_job, interval=60, jitter=5, timeout=120, run_at_start=True)
+    scheduler.add_job("nav_snapshot", snapshot_nav_job, cron="1 * * * *", jitter=30, timeout=300, run_at_start=True)
+    scheduler.add_job("ledger_snapshot", ledger_snapshot_job, interval=600, jitter=30, timeout=300, run_at_start=True)
+    scheduler.add_job("db_backup", backup_db, cron="30 3 * * *", jitter=120, timeout=600)
+    scheduler.add_job("db_maintenance", maintain_db, cron="15 4 * * *", jitter=120, timeout=300)
+    scheduler.start()
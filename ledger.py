@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+دفتر رویدادهای دفتر کل و پرس‌وجوی نقطه‌ای در زمان (as_of)
+
+هر ثبت، اصلاح یا حذف در purchases / withdrawals / usd_deposits با trigger یک ردیف فقط‌افزودنی
+در ledger_events می‌نویسد (مقادیر کامل ردیف به صورت JSON؛ حذف فقط id). ریست سیستم یک رویداد
+reset ثبت می‌کند و خود ledger_events حذف نمی‌شود، پس تاریخچه بعد از ریست هم باقی می‌ماند.
+
+ledger_snapshots وضعیت کامل سه جدول را بعد از یک seq مشخص نگه می‌دارد؛ هر SNAPSHOT_EVERY رویداد
+یا هر روز (کار ledger_snapshot در jobs.py) یک snapshot تازه از snapshot قبلی + رویدادهای بعد از آن
+ساخته می‌شود. وضعیت در زمان D = نزدیک‌ترین snapshot قبل از آخرین رویداد ثبت‌شده تا D + بازپخش
+فقط رویدادهای دنباله آن.
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from dashboard_data import derive_dashboard_data, deposit_row, in_filter, trade_row
+from db import LEDGER_EVENT_TABLES, get_db_connection, read_transaction
+
+SNAPSHOT_EVERY = 500  # events
+SNAPSHOT_MAX_AGE = timedelta(days=1)
+
+State = Dict[str, Dict[str, Dict[str, Any]]]  # table -> str(row id) -> row
+
+
+def _empty_state() -> State:
+    return {table: {} for table in LEDGER_EVENT_TABLES}
+
+
+def parse_as_of(value: str) -> str:
+    """Upper bound on ledger_events.recorded_at for an ?as_of= value (a date means the end of that day)."""
+    value = (value or "").strip()
+    try:
+        if len(value) == 10:
+            return datetime.fromisoformat(value).strftime("%Y-%m-%dT23:59:59")
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None).strftime("%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        raise ValueError("as_of must be an ISO date or datetime (UTC)")
+
+
+def _apply(state: State, events) -> None:
+    for e in events:
+        if e["op"] == "reset":
+            for rows in state.values():
+                rows.clear()
+        elif e["op"] == "delete":
+            state[e["table_name"]].pop(str(e["row_id"]), None)
+        else:
+            state[e["table_name"]][str(e["row_id"])] = json.loads(e["payload"])
+
+
+def _rebuild(cur, seq: int) -> Tuple[State, int, int]:
+    """(state after event `seq`, seq of the snapshot used, number of events replayed)."""
+    cur.execute("SELECT seq, state FROM ledger_snapshots WHERE seq <= ? ORDER BY seq DESC LIMIT 1", (seq,))
+    snapshot = cur.fetchone()
+    state = json.loads(snapshot["state"]) if snapshot else _empty_state()
+    base = snapshot["seq"] if snapshot else 0
+    cur.execute(
+        "SELECT table_name, row_id, op, payload FROM ledger_events WHERE seq > ? AND seq <= ? ORDER BY seq",
+        (base, seq),
+    )
+    events = cur.fetchall()
+    _apply(state, events)
+    return state, base, len(events)
+
+
+def ledger_as_of(as_of: str, conn=None) -> Dict[str, Any]:
+    """Ledger rows as they were recorded at `as_of` (see parse_as_of), trades dated after it excluded.
+
+    Returns {"as_of", "seq", "snapshot_seq", "replayed", "purchases", "withdrawals", "usd_deposits", "settings"}
+    with trade lists oldest first and deposits newest first, like load_dashboard_data
+    (settings are the current ones; they have no history).
+    """
+    bound = parse_as_of(as_of)
+    with read_transaction(conn) as cur:
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM ledger_events WHERE recorded_at <= ?", (bound,))
+        seq = int(cur.fetchone()[0])
+        state, base, replayed = _rebuild(cur, seq)
+        cur.execute("SELECT key, value FROM settings")
+        settings = {r["key"]: r["value"] for r in cur.fetchall()}
+
+    def rows(table: str) -> List[Dict[str, Any]]:
+        # Events logged before a column existed lack its key (e.g. the integer money columns)
+        blank = dict.fromkeys(LEDGER_EVENT_TABLES[table])
+        return [{**blank, **r} for r in state[table].values() if (r.get("created_at") or "")[:19] <= bound]
+
+    deposits = [deposit_row(r) for r in rows("usd_deposits")]
+    return {
+        "as_of": bound,
+        "seq": seq,
+        "snapshot_seq": base,
+        "replayed": replayed,
+        "purchases": sorted((trade_row(r) for r in rows("purchases")), key=lambda t: (t["created_at"], t["id"])),
+        "withdrawals": sorted((trade_row(r) for r in rows("withdrawals")), key=lambda t: (t["created_at"], t["id"])),
+        "usd_deposits": sorted(deposits, key=lambda d: d["id"], reverse=True),
+        "settings": settings,
+    }
+
+
+def dashboard_data_as_of(as_of: str, conn=None, filters: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, Any]:
+    """load_dashboard_data() for the ledger as of `as_of`, plus data["ledger"] = {as_of, seq, snapshot_seq, replayed}."""
+    ledger = ledger_as_of(as_of, conn)
+    data = derive_dashboard_data(
+        [t for t in ledger["purchases"] if in_filter(filters, t)],
+        [t for t in ledger["withdrawals"] if in_filter(filters, t)],
+        [d for d in ledger["usd_deposits"] if in_filter(filters, d, wallet=False)],
+        ledger["settings"],
+        now=datetime.fromisoformat(ledger["as_of"]),
+    )
+    data["ledger"] = {k: ledger[k] for k in ("as_of", "seq", "snapshot_seq", "replayed")}
+    return data
+
+
+def take_snapshot(force: bool = False, conn=None) -> Dict[str, Any]:
+    """Materialize the current state if SNAPSHOT_EVERY events or SNAPSHOT_MAX_AGE passed since the last one."""
+    now = datetime.utcnow()
+    with read_transaction(conn) as cur:
+        cur.execute("SELECT seq, recorded_at FROM ledger_events ORDER BY seq DESC LIMIT 1")
+        head = cur.fetchone()
+        cur.execute("SELECT seq, taken_at FROM ledger_snapshots ORDER BY seq DESC LIMIT 1")
+        last = cur.fetchone()
+        if head is None or (last is not None and last["seq"] >= head["seq"]):
+            return {"taken": False, "seq": last["seq"] if last else 0}
+        pending = head["seq"] - (last["seq"] if last else 0)
+        stale = last is None or now - datetime.fromisoformat(last["taken_at"]) >= SNAPSHOT_MAX_AGE
+        if not (force or stale or pending >= SNAPSHOT_EVERY):
+            return {"taken": False, "seq": last["seq"], "pending_events": pending}
+        state, _base, replayed = _rebuild(cur, head["seq"])
+
+    write = conn or get_db_connection()
+    try:
+        write.execute(
+            "INSERT OR IGNORE INTO ledger_snapshots(seq, recorded_at, taken_at, state) VALUES(?, ?, ?, ?)",
+            (head["seq"], head["recorded_at"], now.isoformat(timespec="seconds"), json.dumps(state, separators=(",", ":"))),
+        )
+        write.commit()
+    finally:
+        if conn is None:
+            write.close()
+    return {"taken": True, "seq": head["seq"], "replayed": replayed, "rows": sum(len(r) for r in state.values())}
+
+
+def row_history(table: str, row_id: int, conn=None) -> List[Dict[str, Any]]:
+    """Every recorded version of one ledger row, oldest first."""
+    if table not in LEDGER_EVENT_TABLES:
+        raise ValueError(f"table must be one of {', '.join(LEDGER_EVENT_TABLES)}")
+    with read_transaction(conn) as cur:
+        cur.execute(
+            "SELECT seq, recorded_at, op, payload FROM ledger_events WHERE table_name = ? AND row_id = ? ORDER BY seq",
+            (table, row_id),
+        )
+        return [
+            {"seq": r["seq"], "recorded_at": r["recorded_at"], "op": r["op"], "row": json.loads(r["payload"]) if r["payload"] else None}
+            for r in cur.fetchall()
+        ]
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+موتور لات‌ها برای محاسبه سود/زیان معاملات بسته و ارزش معاملات باز
+
+روش‌های بهای تمام‌شده: FIFO (deque)، LIFO (پشته)، HIFO (max-heap روی قیمت) و میانگین (جمع‌های جاری).
+
+ورودی‌ها لیست خریدها و برداشت‌ها به ترتیب زمان هستند (dict با کلیدهای amount_sat / price_micro /
+cost_micro یا amount_btc / price_usd_per_btc، یا tuple به شکل (id, created_at, amount_btc, price)).
+همه حساب‌ها با عدد صحیح (ساتوشی و میکرودلار، money.py) انجام می‌شود: بهای بخشی از یک لات سهم
+متناسب از بهای باقی‌مانده همان لات است و مصرف کامل لات دقیقاً باقی‌مانده را برمی‌دارد، پس جمع‌ها
+بدون خطای گرد کردن بسته می‌شوند. realized / open_btc / open_cost همان مقادیر به دلار و BTC هستند.
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from money import SAT_PER_BTC, btc, cost_micro, trade_values, usd
+
+
+def _as_lot(row) -> List[Any]:
+    """[id, created_at, amount_sat, price_micro, cost_micro]; cost_micro is the lot's remaining cost."""
+    if isinstance(row, dict):
+        if row.get("amount_sat") is not None:
+            amount, price = int(row["amount_sat"]), int(row["price_micro"])
+            cost = row.get("cost_micro")
+            return [row.get("id"), row.get("created_at"), amount, price, int(cost) if cost is not None else cost_micro(amount, price)]
+        return [row.get("id"), row.get("created_at"), *trade_values(row["amount_btc"], row["price_usd_per_btc"])]
+    return [row[0], row[1], *trade_values(row[2], row[3])]
+
+
+def _share(total: int, part: int, whole: int) -> int:
+    """`total` allocated to `part` of `whole` (all of it when part == whole)."""
+    return total if part == whole else total * part // whole
+
+
+class FifoBook:
+    """Open lots of one book, consumed oldest-first; keeps running totals so that
+    realized P&L, open BTC and open cost are O(1) to read at any point of a replay.
+
+    LifoBook / HifoBook only change which open lot a withdrawal consumes next."""
+
+    method = "fifo"
+
+    def __init__(self):
+        self.lots: Any = deque()
+        self.realized_micro = 0
+        self.open_sat = 0
+        self.open_cost_micro = 0
+
+    @property
+    def realized(self) -> float:
+        return usd(self.realized_micro)
+
+    @property
+    def open_btc(self) -> float:
+        return btc(self.open_sat)
+
+    @property
+    def open_cost(self) -> float:
+        return usd(self.open_cost_micro)
+
+    def _push(self, lot: List[Any]) -> None:
+        self.lots.append(lot)
+
+    def _next(self) -> List[Any]:
+        return self.lots[0]
+
+    def _pop(self) -> None:
+        self.lots.popleft()
+
+    def open_lots(self) -> List[List[Any]]:
+        """Open lots in the order they would be consumed."""
+        return list(self.lots)
+
+    def restore(self, lots: Iterable[List[Any]]) -> None:
+        """Load open lots saved from `self.lots` (e.g. json round-trip of a FifoBook's deque)."""
+        for lot in lots:
+            self._push(list(lot))
+            self.open_sat += lot[2]
+            self.open_cost_micro += lot[4]
+
+    def buy(self, row) -> None:
+        lot = _as_lot(row)
+        self._push(lot)
+        self.open_sat += lot[2]
+        self.open_cost_micro += lot[4]
+
+    def sell(self, row) -> float:
+        """Consume lots for a withdrawal; returns the BTC left unmatched (no open lots left)."""
+        _wid, _wdate, remaining, _price, proceeds = _as_lot(row)
+        while remaining and self.lots:
+            lot = self._next()
+            take = min(remaining, lot[2])
+            cost = _share(lot[4], take, lot[2])
+            part = _share(proceeds, take, remaining)
+            self.realized_micro += part - cost
+            self.open_sat -= take
+            self.open_cost_micro -= cost
+            lot[2] -= take
+            lot[4] -= cost
+            remaining -= take
+            proceeds -= part
+            if not lot[2]:
+                self._pop()
+        return btc(remaining)
+
+
+class LifoBook(FifoBook):
+    """Newest lot first (the deque used as a stack)."""
+
+    method = "lifo"
+
+    def _next(self) -> List[Any]:
+        return self.lots[-1]
+
+    def _pop(self) -> None:
+        self.lots.pop()
+
+    def open_lots(self) -> List[List[Any]]:
+        return list(reversed(self.lots))
+
+
+class HifoBook(FifoBook):
+    """Highest-cost lot first: max-heap on price (ties: oldest first)."""
+
+    method = "hifo"
+
+    def __init__(self):
+        super().__init__()
+        self.lots = []
+        self._seq = 0
+
+    def _push(self, lot: List[Any]) -> None:
+        heapq.heappush(self.lots, (-lot[3], self._seq, lot))
+        self._seq += 1
+
+    def _next(self) -> List[Any]:
+        return self.lots[0][2]
+
+    def _pop(self) -> None:
+        heapq.heappop(self.lots)
+
+    def open_lots(self) -> List[List[Any]]:
+        return [entry[2] for entry in sorted(self.lots)]
+
+
+class AverageBook:
+    """Average cost: one pooled position; a withdrawal realizes against the running average price."""
+
+    method = "average"
+
+    realized = FifoBook.realized
+    open_btc = FifoBook.open_btc
+    open_cost = FifoBook.open_cost
+
+    def __init__(self):
+        self.realized_micro = 0
+        self.open_sat = 0
+        self.open_cost_micro = 0
+
+    def open_lots(self) -> List[List[Any]]:
+        if not self.open_sat:
+            return []
+        return [[None, None, self.open_sat, self.open_cost_micro * SAT_PER_BTC // self.open_sat, self.open_cost_micro]]
+
+    def buy(self, row) -> None:
+        lot = _as_lot(row)
+        self.open_sat += lot[2]
+        self.open_cost_micro += lot[4]
+
+    def sell(self, row) -> float:
+        _wid, _wdate, amount, _price, proceeds = _as_lot(row)
+        matched = min(amount, self.open_sat)
+        if matched:
+            cost = _share(self.open_cost_micro, matched, self.open_sat)
+            self.realized_micro += _share(proceeds, matched, amount) - cost
+            self.open_sat -= matched
+            self.open_cost_micro -= cost
+        return btc(amount - matched)
+
+
+class LotCurve:
+    """Open lots in consumption order as prefix sums of satoshis and cost (micro-USD).
+
+    The cost of the first x sat a withdrawal would consume is a bisect away (O(log n)),
+    so hypothetical withdrawals never walk or copy the lot queue."""
+
+    def __init__(self, lots: Iterable[List[Any]]):
+        self.prices: List[int] = []
+        self.cum_sat: List[int] = []
+        self.cum_cost: List[int] = []
+        self._lot_cost: List[int] = []
+        sat = cost = 0
+        for lot in lots:
+            if not lot[2]:
+                continue
+            sat += lot[2]
+            cost += lot[4]
+            self.prices.append(lot[3])
+            self.cum_sat.append(sat)
+            self.cum_cost.append(cost)
+            self._lot_cost.append(lot[4])
+        self.total_sat = sat
+        self.total_cost = cost
+
+    def cost(self, x: int) -> int:
+        """Cost basis (micro-USD) of the first `x` sat (clipped to the open amount)."""
+        if x <= 0 or not self.cum_sat:
+            return 0
+        if x >= self.total_sat:
+            return self.total_cost
+        k = bisect_left(self.cum_sat, x)
+        prev_sat = self.cum_sat[k - 1] if k else 0
+        prev_cost = self.cum_cost[k - 1] if k else 0
+        return prev_cost + _share(self._lot_cost[k], x - prev_sat, self.cum_sat[k] - prev_sat)
+
+    def price_at(self, x: int) -> Optional[int]:
+        """Price (micro-USD) of the lot the sat right after the first `x` comes from (None when exhausted)."""
+        k = bisect_right(self.cum_sat, x)
+        return self.prices[k] if k < len(self.prices) else None
+
+    def amount_before_price_below(self, price: int, start: int) -> int:
+        """For a curve in descending price order (HIFO): sat after `start` still priced >= `price`."""
+        lo = bisect_right(self.cum_sat, start)
+        hi = len(self.prices)
+        # prices are non-increasing: first index with a price below `price`
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.prices[mid] >= price:
+                lo = mid + 1
+            else:
+                hi = mid
+        end = self.cum_sat[lo - 1] if lo else 0
+        return max(0, end - start)
+
+
+BOOKS = {book.method: book for book in (FifoBook, LifoBook, HifoBook, AverageBook)}
+COST_BASIS_METHODS = tuple(BOOKS)
+
+
+def fifo_pnl(purchases: Iterable, withdrawals: Iterable, current_btc_price: float) -> Dict[str, Any]:
+    """Match withdrawals against the oldest open purchases (FIFO).
+
+    Returns closed-trade profit, open-lot cost/value and the remaining open lots.
+    """
+    book = FifoBook()
+    for purchase in purchases:
+        book.buy(purchase)
+    for withdrawal in withdrawals:
+        book.sell(withdrawal)
+
+    open_value = book.open_btc * current_btc_price
+    open_trades_profit = open_value - book.open_cost
+    return {
+        "closed_profit": book.realized,
+        "open_cost": book.open_cost,
+        "open_value": open_value,
+        "open_profit": open_trades_profit,
+        "total_profit": book.realized + open_trades_profit,
+        "open_lots": list(book.lots),
+    }
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Request-level instrumentation served at /metrics (Prometheus text format)
+- تأخیر هر endpoint (هیستوگرام)، شمارش وضعیت‌ها و درخواست‌های در حال اجرا
+- تعداد و زمان کوئری‌های دیتابیس در هر درخواست
+- زمان فراخوانی‌های HTTP بیرونی در هر درخواست
+- آمار منابع قیمت از price_fetcher
+
+مقادیر در حافظه هر پروسه نگهداری می‌شوند؛ با چند worker هر پروسه سری خودش را دارد.
+"""
+
+import hmac
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Tuple, Optional, Iterable
+
+from flask import Flask, Response, g, has_request_context, request, session, abort
+
+from db import add_query_observer
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = self.header()
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = self.header()
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], series[:-1]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(series[-1])}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+# ----------------------------------------------------------------------------
+# Registry
+# ----------------------------------------------------------------------------
+REQUEST_LATENCY = Histogram("pplus_http_request_duration_seconds", "Request latency per endpoint.", ("endpoint", "method"))
+REQUEST_TOTAL = Counter("pplus_http_requests_total", "Requests per endpoint and status.", ("endpoint", "method", "status"))
+REQUESTS_IN_FLIGHT = Gauge("pplus_http_requests_in_flight", "Requests currently being served.")
+DB_QUERIES_PER_REQUEST = Histogram("pplus_db_queries_per_request", "SQLite statements executed per request.", ("endpoint",), QUERY_COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram("pplus_db_query_seconds_per_request", "Time spent in SQLite per request.", ("endpoint",))
+OUTBOUND_TIME_PER_REQUEST = Histogram("pplus_outbound_http_seconds_per_request", "Time spent in outbound HTTP calls per request.", ("endpoint",))
+OUTBOUND_TOTAL = Counter("pplus_outbound_http_requests_total", "Outbound HTTP calls made while serving requests.", ("endpoint", "target"))
+OUTBOUND_SECONDS = Counter("pplus_outbound_http_seconds_total", "Outbound HTTP time spent while serving requests.", ("endpoint", "target"))
+
+REGISTRY = [
+    REQUEST_LATENCY,
+    REQUEST_TOTAL,
+    REQUESTS_IN_FLIGHT,
+    DB_QUERIES_PER_REQUEST,
+    DB_TIME_PER_REQUEST,
+    OUTBOUND_TIME_PER_REQUEST,
+    OUTBOUND_TOTAL,
+    OUTBOUND_SECONDS,
+]
+
+
+def _endpoint_label() -> str:
+    # Unmatched URLs share one label so 404 scans cannot blow up cardinality
+    return request.endpoint or "unmatched"
+
+
+def _on_query(seconds: float) -> None:
+    if not has_request_context():
+        return
+    stats = g.get("_metrics")
+    if stats is not None:
+        stats["db_queries"] += 1
+        stats["db_seconds"] += seconds
+
+
+@contextmanager
+def track_outbound(target: str):
+    """Time an outbound HTTP call and attribute it to the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if has_request_context():
+            stats = g.get("_metrics")
+            if stats is not None:
+                stats["outbound_seconds"] += elapsed
+                labels = (_endpoint_label(), target)
+                OUTBOUND_TOTAL.inc(labels)
+                OUTBOUND_SECONDS.inc(labels, elapsed)
+
+
+def _render_price_sources() -> list:
+    """Expose price_fetcher per-source stats alongside request metrics."""
+    from price_fetcher import get_source_health  # local import keeps metrics importable standalone
+
+    lines = [
+        "# HELP pplus_price_source_latency_seconds Upstream price source latency.",
+        "# TYPE pplus_price_source_latency_seconds histogram",
+    ]
+    apis = get_source_health()["apis"]
+    for name, info in sorted(apis.items()):
+        latency = info["latency"]
+        for bound, cumulative in latency["buckets"].items():
+            lines.append(f'pplus_price_source_latency_seconds_bucket{{source="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'pplus_price_source_latency_seconds_sum{{source="{name}"}} {_format_value(latency["sum"])}')
+        lines.append(f'pplus_price_source_latency_seconds_count{{source="{name}"}} {latency["count"]}')
+    lines += [
+        "# HELP pplus_price_source_results_total Upstream price fetch results by class.",
+        "# TYPE pplus_price_source_results_total counter",
+    ]
+    for name, info in sorted(apis.items()):
+        lines.append(f'pplus_price_source_results_total{{source="{name}",result="success"}} {info["success_count"]}')
+        for error_class, count in sorted(info["error_counts"].items()):
+            lines.append(f'pplus_price_source_results_total{{source="{name}",result="{error_class}"}} {count}')
+    lines += [
+        "# HELP pplus_price_source_breaker_open Whether the source circuit breaker is open (1) or not (0).",
+        "# TYPE pplus_price_source_breaker_open gauge",
+    ]
+    for name, info in sorted(apis.items()):
+        lines.append(f'pplus_price_source_breaker_open{{source="{name}"}} {1 if info["breaker"] == "open" else 0}')
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    try:
+        lines.extend(_render_price_sources())
+    except Exception:
+        pass
+    return "\n".join(lines) + "\n"
+
+
+def _authorized() -> bool:
+    if session.get("logged_in") is True:
+        return True
+    if not METRICS_TOKEN:
+        return False
+    supplied = request.headers.get("Authorization", "")
+    if supplied.startswith("Bearer "):
+        supplied = supplied[len("Bearer "):]
+    else:
+        supplied = request.args.get("token", "")
+    return hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode())
+
+
+def metrics_view():
+    if not _authorized():
+        abort(403)
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ----------------------------------------------------------------------------
+# Flask wiring
+# ----------------------------------------------------------------------------
+def init_metrics(app: Flask) -> None:
+    """Register request hooks and the /metrics endpoint.
+
+    Must be called before blueprints are registered so the timing hook runs
+    ahead of `enforce_login` (which may short-circuit later hooks).
+    """
+    add_query_observer(_on_query)
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics = {
+            "started": time.perf_counter(),
+            "status": 500,
+            "db_queries": 0,
+            "db_seconds": 0.0,
+            "outbound_seconds": 0.0,
+        }
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _metrics_status(response):
+        stats = g.get("_metrics")
+        if stats is not None:
+            stats["status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc: Optional[BaseException]):
+        stats = g.pop("_metrics", None)
+        if stats is None:
+            return
+        REQUESTS_IN_FLIGHT.dec()
+        endpoint = _endpoint_label()
+        elapsed = time.perf_counter() - stats["started"]
+        REQUEST_LATENCY.observe(elapsed, (endpoint, request.method))
+        REQUEST_TOTAL.inc((endpoint, request.method, str(stats["status"])))
+        DB_QUERIES_PER_REQUEST.observe(stats["db_queries"], (endpoint,))
+        DB_TIME_PER_REQUEST.observe(stats["db_seconds"], (endpoint,))
+        OUTBOUND_TIME_PER_REQUEST.observe(stats["outbound_seconds"], (endpoint,))
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+مقادیر پولی با ممیز ثابت (عدد صحیح)
+
+دفتر کل مقادیر را به صورت عدد صحیح نگه می‌دارد و همه جمع‌ها و موتور لات‌ها روی همین اعداد کار
+می‌کنند؛ تبدیل به float فقط در لبه API و قالب‌ها انجام می‌شود:
+- BTC به ساتوشی (1e-8)
+- دلار (قیمت هر BTC، بهای خرید/ارزش برداشت، واریز دلاری) به میکرودلار (1e-6)
+- تومان به ریال
+
+cost_micro هر معامله (amount_sat × price_micro / 1e8، گرد شده) هنگام ثبت ذخیره می‌شود.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Tuple
+
+SAT_PER_BTC = 100_000_000
+MICRO_PER_USD = 1_000_000
+RIAL_PER_TOMAN = 10
+
+
+def _scaled(value: Any, scale: int) -> int:
+    """round(value × scale) using the value's decimal text (0.1 BTC is exactly 10_000_000 sat)."""
+    try:
+        return int((Decimal(str(value)) * scale).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"not a finite number: {value!r}")
+
+
+def to_sat(btc: Any) -> int:
+    return _scaled(btc, SAT_PER_BTC)
+
+
+def to_micro(usd: Any) -> int:
+    return _scaled(usd, MICRO_PER_USD)
+
+
+def to_rial(toman: Any) -> int:
+    return _scaled(toman, RIAL_PER_TOMAN)
+
+
+def btc(sat: int) -> float:
+    return sat / SAT_PER_BTC
+
+
+def usd(micro: int) -> float:
+    return micro / MICRO_PER_USD
+
+
+def toman(rial: int) -> float:
+    return rial / RIAL_PER_TOMAN
+
+
+def cost_micro(amount_sat: int, price_micro: int) -> int:
+    """USD value (micro) of `amount_sat` at `price_micro` per BTC, rounded half up."""
+    value = amount_sat * price_micro
+    return (value + SAT_PER_BTC // 2) // SAT_PER_BTC if value >= 0 else -((-value + SAT_PER_BTC // 2) // SAT_PER_BTC)
+
+
+def trade_values(amount_btc: Any, price_usd_per_btc: Any) -> Tuple[int, int, int]:
+    """(amount_sat, price_micro, cost_micro) stored with a purchase/withdrawal."""
+    amount_sat, price_micro = to_sat(amount_btc), to_micro(price_usd_per_btc)
+    return amount_sat, price_micro, cost_micro(amount_sat, price_micro)
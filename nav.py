@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+تاریخچه ارزش خالص دارایی (NAV) و منحنی سرمایه
+
+- price_history: قیمت BTC و تتر در ابتدای هر ساعت (UTC)، از tickهای price_fetcher
+- nav_snapshots: برای هر کیف پول (و wallet_id=0 برای کل پورتفولیو) در هر روز (و اختیاری هر ساعت):
+  موجودی BTC، بهای تمام‌شده لات‌های باز، سود/زیان تحقق‌یافته و نیافته (FIFO)، ارزش دلاری و تومانی
+
+ردیف‌های روزانه با یک بار مرور دفتر کل ساخته می‌شوند (lots.FifoBook). برای روزهای گذشته آخرین قیمت
+شناخته‌شده تا پایان همان روز استفاده می‌شود: price_history، یا اگر تاریخچه بازار به آن روز نمی‌رسد
+قیمت آخرین معامله/واریز ثبت‌شده (price_source='ledger'). روز جاری با قیمت لحظه‌ای به‌روز می‌شود.
+اگر دفتر کل تغییر کند (data_version)، همه ردیف‌های روزانه دوباره نوشته می‌شوند؛ ردیف‌های ساعتی
+ثبت لحظه‌ای هستند و بازسازی نمی‌شوند.
+
+نمودارها و بازده دوره‌ها فقط یک بازه از کلید (period, wallet_id, bucket) را می‌خوانند.
+"""
+
+import logging
+import os
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from heapq import merge
+from typing import Any, Dict, List, Optional, Tuple
+
+from dashboard_data import load_dashboard_data
+from db import get_data_version, get_db_connection
+from lots import FifoBook
+from price_fetcher import get_price_info
+
+TOTAL_WALLET_ID = 0
+PERIODS = ("day", "hour")
+NAV_HOURLY = os.environ.get("PPLUS_NAV_HOURLY", "1") != "0"
+
+logger = logging.getLogger(__name__)
+
+_last_price_hour: Optional[str] = None
+
+
+def _hour_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:00")
+
+
+def record_price_tick(prices: Dict[str, Optional[float]]) -> None:
+    """price_fetcher tick listener: store the first price seen in each UTC hour."""
+    global _last_price_hour
+    hour = _hour_key(datetime.utcnow())
+    if hour == _last_price_hour or not prices.get("btc_usd"):
+        return
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "INSERT OR IGNORE INTO price_history(hour, btc_usd, usdt_toman) VALUES(?, ?, ?)",
+            (hour, float(prices["btc_usd"]), float(prices["usdt_toman"]) if prices.get("usdt_toman") else None),
+        )
+        conn.commit()
+        _last_price_hour = hour
+    except Exception as e:
+        logger.error(f"[nav] cannot record price history: {e}")
+    finally:
+        conn.close()
+
+
+class _PriceLookup:
+    """Last known BTC/USD and USD/Toman rate up to the end of a given day."""
+
+    def __init__(self, conn, data: Dict[str, Any]):
+        rows = conn.execute("SELECT hour, btc_usd, usdt_toman FROM price_history ORDER BY hour").fetchall()
+        self.market_keys = [r["hour"] for r in rows]
+        self.market = [(r["btc_usd"], r["usdt_toman"]) for r in rows]
+        trades = list(merge(data["purchases"], data["withdrawals"], key=lambda t: t["created_at"]))
+        self.trade_keys = [t["created_at"] for t in trades]
+        self.trade_prices = [t["price_usd_per_btc"] for t in trades]
+        deposits = sorted(data["usd_deposits"], key=lambda d: d["created_at"])
+        self.deposit_keys = [d["created_at"] for d in deposits]
+        self.deposit_rates = [d["price_toman_per_usd"] for d in deposits]
+
+    @staticmethod
+    def _last(keys: List[str], values: List[Any], bound: str) -> Tuple[Optional[str], Any]:
+        i = bisect_right(keys, bound) - 1
+        return (keys[i], values[i]) if i >= 0 else (None, None)
+
+    def at(self, day: str) -> Tuple[Optional[float], Optional[float], str]:
+        """(btc_usd, usdt_toman, source) as of the end of `day` (YYYY-MM-DD)."""
+        bound = day + "T~"  # sorts after every timestamp of that day
+        market_key, market = self._last(self.market_keys, self.market, bound)
+        trade_key, trade_price = self._last(self.trade_keys, self.trade_prices, bound)
+        deposit_key, deposit_rate = self._last(self.deposit_keys, self.deposit_rates, bound)
+        if market_key and (not trade_key or market_key[:10] >= trade_key[:10]):
+            btc_usd, source = market[0], "market"
+        else:
+            btc_usd, source = trade_price, "ledger"
+        usdt_toman = market[1] if market_key and market[1] and (not deposit_key or market_key[:10] >= deposit_key[:10]) else deposit_rate
+        return btc_usd, usdt_toman, source
+
+
+def _snapshot_row(book: FifoBook, btc_usd: Optional[float], usdt_toman: Optional[float]) -> Dict[str, Any]:
+    value_usd = book.open_btc * btc_usd if btc_usd is not None else None
+    return {
+        "btc_balance": book.open_btc,
+        "cost_basis_usd": book.open_cost,
+        "realized_pnl_usd": book.realized,
+        "unrealized_pnl_usd": value_usd - book.open_cost if value_usd is not None else None,
+        "value_usd": value_usd,
+        "value_toman": value_usd * usdt_toman if value_usd is not None and usdt_toman else None,
+        "btc_usd": btc_usd,
+        "usdt_toman": usdt_toman,
+    }
+
+
+def _replay_days(data: Dict[str, Any], prices: _PriceLookup, today: str, live: Tuple[Optional[float], Optional[float]]):
+    """Yield (day, wallet_id, row) for every day from the first trade through `today`, in one pass."""
+    events = list(merge(
+        (("buy", p) for p in data["purchases"]),
+        (("sell", w) for w in data["withdrawals"]),
+        key=lambda e: e[1]["created_at"],
+    ))
+    if not events:
+        return
+    books: Dict[int, FifoBook] = {TOTAL_WALLET_ID: FifoBook()}
+    day = date.fromisoformat(events[0][1]["created_at"][:10])
+    last_day = max(date.fromisoformat(today), date.fromisoformat(events[-1][1]["created_at"][:10]))
+    i = 0
+    while day <= last_day:
+        key = day.isoformat()
+        while i < len(events) and events[i][1]["created_at"][:10] <= key:
+            kind, trade = events[i]
+            if trade["wallet_id"] not in books:
+                books[trade["wallet_id"]] = FifoBook()
+            for book in (books[TOTAL_WALLET_ID], books[trade["wallet_id"]]):
+                if kind == "buy":
+                    book.buy(trade)
+                else:
+                    book.sell(trade)
+            i += 1
+        btc_usd, usdt_toman, source = prices.at(key)
+        if key == today:
+            btc_usd = live[0] or btc_usd
+            usdt_toman = live[1] or usdt_toman
+            source = "market" if live[0] else source
+        for wallet_id, book in books.items():
+            yield key, wallet_id, {**_snapshot_row(book, btc_usd, usdt_toman), "price_source": source}
+        day += timedelta(days=1)
+
+
+_COLUMNS = (
+    "btc_balance", "cost_basis_usd", "realized_pnl_usd", "unrealized_pnl_usd",
+    "value_usd", "value_toman", "btc_usd", "usdt_toman", "price_source",
+)
+
+
+def _write(conn, period: str, rows: List[Tuple[str, int, Dict[str, Any]]], now: str) -> None:
+    conn.executemany(
+        f"INSERT OR REPLACE INTO nav_snapshots(period, wallet_id, bucket, {', '.join(_COLUMNS)}, created_at) "
+        f"VALUES(?, ?, ?, {', '.join('?' for _ in _COLUMNS)}, ?)",
+        [(period, wallet_id, bucket, *(row[c] for c in _COLUMNS), now) for bucket, wallet_id, row in rows],
+    )
+
+
+def snapshot_nav(rebuild: bool = False) -> Dict[str, Any]:
+    """Write today's (and this hour's) NAV rows; backfill/rewrite past days when the ledger changed.
+
+    Returns {"days_written", "hour_rows", "rebuilt"}.
+    """
+    now = datetime.utcnow()
+    today = now.date().isoformat()
+    info = get_price_info()
+    live = (info.get("btc_price"), info.get("usdt_price")) if info.get("source") != "fallback" else (None, None)
+    conn = get_db_connection()
+    try:
+        data = load_dashboard_data(conn)
+        version = get_data_version(conn)
+        state = conn.execute("SELECT data_version, built_through FROM nav_state WHERE id = 1").fetchone()
+        rebuild = rebuild or state is None or state["data_version"] != version
+        # Unchanged ledger: only the days since the last build still need (re)writing
+        since = None if rebuild else state["built_through"]
+
+        rows = [
+            row for row in _replay_days(data, _PriceLookup(conn, data), today, live)
+            if since is None or row[0] >= since
+        ]
+        stamp = now.isoformat(timespec="seconds")
+        conn.execute("BEGIN IMMEDIATE")
+        if rebuild:
+            conn.execute("DELETE FROM nav_snapshots WHERE period = 'day'")
+        _write(conn, "day", rows, stamp)
+        hour_rows = []
+        if NAV_HOURLY and live[0]:
+            hour = _hour_key(now)
+            hour_rows = [(hour, wallet_id, row) for day, wallet_id, row in rows if day == today]
+            _write(conn, "hour", hour_rows, stamp)
+        conn.execute(
+            "INSERT OR REPLACE INTO nav_state(id, data_version, built_through, built_at) VALUES(1, ?, ?, ?)",
+            (version, today, stamp),
+        )
+        conn.commit()
+        return {"days_written": len({r[0] for r in rows}), "hour_rows": len(hour_rows), "rebuilt": rebuild}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def equity_curve(
+    period: str = "day",
+    wallet_id: int = TOTAL_WALLET_ID,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 1000,
+    conn=None,
+) -> Dict[str, Any]:
+    """Stored NAV points in [start, end] (bucket prefixes, inclusive), oldest first."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT bucket, {', '.join(_COLUMNS)} FROM nav_snapshots
+            WHERE period = ? AND wallet_id = ? AND bucket >= ? AND bucket <= ?
+            ORDER BY bucket DESC LIMIT ?
+            """,
+            (period, wallet_id, start or "", (end or "9999") + "~", limit),
+        )
+        points = [dict(r) for r in reversed(cur.fetchall())]
+    finally:
+        if own_conn:
+            conn.close()
+
+    result: Dict[str, Any] = {"period": period, "wallet_id": wallet_id, "points": points}
+    if len(points) >= 2:
+        first, last = points[0], points[-1]
+
+        def pnl(p):
+            return p["realized_pnl_usd"] + (p["unrealized_pnl_usd"] or 0.0)
+
+        # P&L change excludes deposits/withdrawals, unlike the raw value change
+        result["change"] = {
+            "from": first["bucket"],
+            "to": last["bucket"],
+            "value_usd": (last["value_usd"] or 0.0) - (first["value_usd"] or 0.0),
+            "pnl_usd": pnl(last) - pnl(first),
+        }
+    return result
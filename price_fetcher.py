@@ -2,9 +2,10 @@
 import asyncio
 import json
 import os
+import tempfile
 import time
-from threading import Thread
-from typing import Optional, Dict, Any
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
 import aiohttp
 import logging
 import requests
@@ -12,9 +13,17 @@ import requests
 # ------------------------------
 # Configuration
 # ------------------------------
-CACHE_FILE = "price_cache.json"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Fixed location under the app dir so every worker shares one snapshot regardless of CWD
+CACHE_FILE = os.environ.get("PPLUS_PRICE_CACHE") or os.path.join(BASE_DIR, "price_cache.json")
+CACHE_BACKUP_FILE = CACHE_FILE + ".bak"  # last-known-good snapshot
+# Per-source health written by the process running price_refresh, read by every other worker
+HEALTH_FILE = CACHE_FILE + ".health"
+CACHE_SCHEMA = 1
 CACHE_DURATION = 30  # seconds
+CACHE_HEARTBEAT = 600  # rewrite an unchanged snapshot at most this often (seconds)
 REQUEST_TIMEOUT = 10
+SNAPSHOT_POLL_INTERVAL = 5  # seconds between checks for a snapshot written by another process
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -28,109 +37,388 @@ price_cache: Dict[str, Any] = {
     "btc_price": None,
     "updated_at": None,
     "source": "unknown",
-    "last_error": None
+    "last_error": None,
+    "version": 0
 }
 
+# Fields that make up the on-disk snapshot
+_SNAPSHOT_FIELDS = ("usdt_price", "btc_price", "updated_at", "source", "last_error")
+
+_cache_lock = Lock()
+_cache_loaded = False
+_last_saved: Dict[str, Any] = {"fingerprint": None, "updated_at": 0, "snapshot": None}
+# Callbacks invoked with the new snapshot version whenever the prices actually change
+_price_listeners: List[Callable[[int], None]] = []
+# Callbacks invoked after every refresh with {"btc_usd": ..., "usdt_toman": ...}
+_tick_listeners: List[Callable[[Dict[str, Optional[float]]], None]] = []
+# mtime of the snapshot file last looked at by _follow_snapshot
+_snapshot_seen: Dict[str, float] = {"mtime": 0.0, "checked_at": 0.0}
+
 # ------------------------------
-# Price fetching functions
+# Price sources
 # ------------------------------
-def fetch_usdt_price() -> tuple[Optional[int], str]:
-    """دریافت قیمت تتر از چندین منبع"""
-    sources = [
-        {
-            "name": "wallex",
-            "url": "https://api.wallex.ir/v1/markets",
-            "parser": lambda data: int(float(data.get("result", {}).get("symbols", {}).get("USDTTMN", {}).get("stats", {}).get("lastPrice", 0)))
-        },
-        {
-            "name": "nobitex", 
-            "url": "https://api.nobitex.ir/market/stats",
-            "method": "POST",
-            "data": {"srcCurrency": "usdt", "dstCurrency": "rls"},
-            "parser": lambda data: int(float(data.get("stats", {}).get("usdt-rls", {}).get("latest", 0)) / 10)
-        },
-        {
-            "name": "bitpin",
-            "url": "https://api.bitpin.ir/v1/mkt/currencies/",
-            "parser": lambda data: int(float(next((item.get("price", 0) for item in data.get("results", []) if item.get("code") == "USDT"), 0)))
-        }
-    ]
-    
-    for source in sources:
+USDT_SOURCES = [
+    {
+        "name": "wallex",
+        "url": "https://api.wallex.ir/v1/markets",
+        "parser": lambda data: int(float(data.get("result", {}).get("symbols", {}).get("USDTTMN", {}).get("stats", {}).get("lastPrice", 0)))
+    },
+    {
+        "name": "nobitex", 
+        "url": "https://api.nobitex.ir/market/stats",
+        "method": "POST",
+        "data": {"srcCurrency": "usdt", "dstCurrency": "rls"},
+        "parser": lambda data: int(float(data.get("stats", {}).get("usdt-rls", {}).get("latest", 0)) / 10)
+    },
+    {
+        "name": "bitpin",
+        "url": "https://api.bitpin.ir/v1/mkt/currencies/",
+        "parser": lambda data: int(float(next((item.get("price", 0) for item in data.get("results", []) if item.get("code") == "USDT"), 0)))
+    }
+]
+
+BTC_SOURCES = [
+    {
+        "name": "coindesk",
+        "url": "https://api.coindesk.com/v1/bpi/currentprice/USD.json",
+        "parser": lambda data: float(data.get("bpi", {}).get("USD", {}).get("rate_float", 0))
+    },
+    {
+        "name": "binance",
+        "url": "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT",
+        "parser": lambda data: float(data.get("price", 0))
+    }
+]
+
+# ------------------------------
+# Per-source health metrics
+# ------------------------------
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+BREAKER_THRESHOLD = 3  # consecutive failures before a source is skipped
+BREAKER_COOLDOWN = 120  # seconds before an open breaker lets one probe through
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class SourceStats:
+    """آمار تأخیر، خطا و وضعیت breaker برای یک منبع قیمت"""
+
+    def __init__(self, name: str, market: str, priority: int):
+        self.name = name
+        self.market = market
+        self.priority = priority
+        self.lock = Lock()
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)  # last slot is +Inf
+        self.latency_sum = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.success_count = 0
+        self.error_counts: Dict[str, int] = {}
+        self.consecutive_failures = 0
+        self.last_success: Optional[int] = None
+        self.last_check: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.opened_at: Optional[float] = None
+
+    def _observe(self, latency: float) -> None:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.bucket_counts[i] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+        self.latency_sum += latency
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+        self.last_check = int(time.time())
+
+    def record_success(self, latency: float) -> None:
+        with self.lock:
+            self._observe(latency)
+            self.success_count += 1
+            self.consecutive_failures = 0
+            self.last_success = self.last_check
+            self.last_error = None
+            self.opened_at = None
+
+    def record_error(self, error_class: str, latency: float, message: str) -> None:
+        with self.lock:
+            self._observe(latency)
+            self.error_counts[error_class] = self.error_counts.get(error_class, 0) + 1
+            self.consecutive_failures += 1
+            self.last_error = f"{error_class}: {message}"[:300]
+            if self.consecutive_failures >= BREAKER_THRESHOLD:
+                self.opened_at = time.time()
+
+    def breaker_state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= BREAKER_COOLDOWN:
+            return "half_open"
+        return "open"
+
+    def sort_key(self) -> tuple:
+        # Closed/half-open before open, then fastest observed latency, then configured priority
+        state = self.breaker_state()
+        latency = self.latency_ewma if self.latency_ewma is not None else float("inf")
+        return (state == "open", latency, self.priority)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.success_count + sum(self.error_counts.values())
+            cumulative, buckets = 0, {}
+            for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], self.bucket_counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            state = self.breaker_state()
+            return {
+                "market": self.market,
+                "status": "success" if self.consecutive_failures == 0 and self.last_check else ("failed" if self.last_check else "unknown"),
+                "is_healthy": state == "closed" and self.consecutive_failures == 0,
+                "breaker": state,
+                "last_check": self.last_check,
+                "last_success": self.last_success,
+                "error": self.last_error,
+                "success_count": self.success_count,
+                "error_counts": dict(self.error_counts),
+                "consecutive_failures": self.consecutive_failures,
+                "latency": {
+                    "count": total,
+                    "sum": round(self.latency_sum, 4),
+                    "avg": round(self.latency_sum / total, 4) if total else None,
+                    "ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+                    "buckets": buckets,
+                },
+            }
+
+
+source_stats: Dict[str, SourceStats] = {}
+for _market, _sources in (("usdt", USDT_SOURCES), ("btc", BTC_SOURCES)):
+    for _priority, _source in enumerate(_sources):
+        source_stats[_source["name"]] = SourceStats(_source["name"], _market, _priority)
+
+
+def _classify_error(exc: Exception) -> str:
+    """دسته‌بندی خطا: dns / tls / timeout / connection / parse / other"""
+    if isinstance(exc, requests.exceptions.SSLError):
+        return "tls"
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        text = str(exc)
+        if any(marker in text for marker in ("NameResolutionError", "getaddrinfo", "Name or service not known", "nodename nor servname", "Temporary failure in name resolution")):
+            return "dns"
+        return "connection"
+    if isinstance(exc, (ValueError, KeyError, TypeError, AttributeError, StopIteration)):
+        return "parse"
+    return "other"
+
+
+def _ordered_sources(sources: list) -> list:
+    """منابع سالم و سریع‌تر اول؛ منابعی که breaker باز دارند رد می‌شوند"""
+    ordered = sorted(sources, key=lambda src: source_stats[src["name"]].sort_key())
+    allowed = [src for src in ordered if source_stats[src["name"]].breaker_state() != "open"]
+    # If every breaker is open, still try the best-known source rather than giving up
+    return allowed or ordered[:1]
+
+
+def _fetch_from_sources(sources: list, label: str):
+    for source in _ordered_sources(sources):
+        stats = source_stats[source["name"]]
+        started = time.perf_counter()
         try:
             if source.get("method") == "POST":
                 response = requests.post(source["url"], json=source.get("data", {}), timeout=REQUEST_TIMEOUT)
             else:
                 response = requests.get(source["url"], timeout=REQUEST_TIMEOUT)
             
-            if response.status_code == 200:
-                data = response.json()
-                price = source["parser"](data)
-                if price > 0:
-                    return price, source["name"]
+            if response.status_code != 200:
+                stats.record_error(f"http_{response.status_code}", time.perf_counter() - started, response.reason or "")
+                logger.warning(f"خطا در دریافت قیمت {label} از {source['name']}: HTTP {response.status_code}")
+                continue
+            data = response.json()
+            price = source["parser"](data)
+            if price > 0:
+                stats.record_success(time.perf_counter() - started)
+                return price, source["name"]
+            stats.record_error("parse", time.perf_counter() - started, "non-positive price")
         except Exception as e:
-            logger.warning(f"خطا در دریافت قیمت از {source['name']}: {e}")
+            stats.record_error(_classify_error(e), time.perf_counter() - started, str(e))
+            logger.warning(f"خطا در دریافت قیمت {label} از {source['name']}: {e}")
             continue
     
     return None, "error"
 
+# ------------------------------
+# Price fetching functions
+# ------------------------------
+def fetch_usdt_price() -> tuple[Optional[int], str]:
+    """دریافت قیمت تتر از چندین منبع"""
+    return _fetch_from_sources(USDT_SOURCES, "تتر")
+
 def fetch_btc_price() -> tuple[Optional[float], str]:
     """دریافت قیمت بیت‌کوین"""
-    sources = [
-        {
-            "name": "coindesk",
-            "url": "https://api.coindesk.com/v1/bpi/currentprice/USD.json",
-            "parser": lambda data: float(data.get("bpi", {}).get("USD", {}).get("rate_float", 0))
-        },
-        {
-            "name": "binance",
-            "url": "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT",
-            "parser": lambda data: float(data.get("price", 0))
-        }
-    ]
-    
-    for source in sources:
-        try:
-            response = requests.get(source["url"], timeout=REQUEST_TIMEOUT)
-            if response.status_code == 200:
-                data = response.json()
-                price = source["parser"](data)
-                if price > 0:
-                    return price, source["name"]
-        except Exception as e:
-            logger.warning(f"خطا در دریافت قیمت BTC از {source['name']}: {e}")
-            continue
-    
-    return None, "error"
+    return _fetch_from_sources(BTC_SOURCES, "BTC")
 
 # ------------------------------
 # Cache management
 # ------------------------------
-def load_cache() -> None:
-    """بارگذاری کش از فایل"""
-    global price_cache
-    if os.path.exists(CACHE_FILE):
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    """خواندن و اعتبارسنجی یک فایل snapshot؛ در صورت خرابی None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"snapshot نامعتبر در {path}: {e}")
+        return None
+    if not isinstance(data, dict) or data.get("schema") != CACHE_SCHEMA:
+        logger.warning(f"نسخه snapshot ناسازگار در {path}")
+        return None
+    if not isinstance(data.get("version"), int) or not isinstance(data.get("updated_at"), (int, type(None))):
+        return None
+    return data
+
+def _atomic_write_json(path: str, payload: Dict[str, Any]) -> None:
+    """نوشتن اتمیک: فایل موقت + fsync + rename، تا هیچ خواننده‌ای فایل نیمه‌کاره نبیند"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".price_cache.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
         try:
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                cached_data = json.load(f)
-                price_cache.update({
-                    "usdt_price": cached_data.get("usdt_price"),
-                    "btc_price": cached_data.get("btc_price"),
-                    "updated_at": cached_data.get("updated_at"),
-                    "source": cached_data.get("source", "unknown"),
-                    "last_error": cached_data.get("last_error")
-                })
-                logger.info("کش قیمت‌ها بارگذاری شد")
-        except Exception as e:
-            logger.error(f"خطا در بارگذاری کش: {e}")
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Persist the rename itself (not supported on Windows)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except (OSError, AttributeError):
+        pass
 
-def save_cache() -> None:
-    """ذخیره کش در فایل"""
+def _save_health() -> None:
+    """وضعیت منابع بعد از هر دور به‌روزرسانی، برای /api/api-health و /metrics پروسه‌های دیگر"""
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(price_cache, f, ensure_ascii=False, indent=2)
+        _atomic_write_json(HEALTH_FILE, {
+            "schema": CACHE_SCHEMA,
+            "written_at": int(time.time()),
+            "apis": {name: stats.snapshot() for name, stats in source_stats.items()},
+        })
     except Exception as e:
-        logger.error(f"خطا در ذخیره کش: {e}")
+        logger.error(f"خطا در ذخیره وضعیت منابع: {e}")
+
+def _read_health() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(HEALTH_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("schema") != CACHE_SCHEMA or not isinstance(data.get("apis"), dict):
+        return {}
+    return data["apis"]
+
+def _fingerprint() -> tuple:
+    return tuple(price_cache.get(k) for k in _SNAPSHOT_FIELDS if k != "updated_at")
+
+def _apply_snapshot(cached_data: Dict[str, Any]) -> None:
+    price_cache.update({k: cached_data.get(k) for k in _SNAPSHOT_FIELDS})
+    price_cache["source"] = price_cache.get("source") or "unknown"
+    price_cache["version"] = max(price_cache.get("version", 0), cached_data["version"])
+    _last_saved.update({
+        "fingerprint": _fingerprint(),
+        "updated_at": price_cache.get("updated_at") or 0,
+        "snapshot": cached_data,
+    })
+
+def _follow_snapshot() -> None:
+    """پروسه‌هایی که کار price_refresh را اجرا نمی‌کنند snapshot نوشته‌شده را دنبال می‌کنند"""
+    now = time.time()
+    if now - _snapshot_seen["checked_at"] < SNAPSHOT_POLL_INTERVAL:
+        return
+    _snapshot_seen["checked_at"] = now
+    try:
+        mtime = os.path.getmtime(CACHE_FILE)
+    except OSError:
+        return
+    if mtime == _snapshot_seen["mtime"]:
+        return
+    _snapshot_seen["mtime"] = mtime
+    cached_data = _read_snapshot(CACHE_FILE)
+    if cached_data is None:
+        return
+    with _cache_lock:
+        # Only newer data: the writing process itself already has it in memory
+        if (cached_data.get("updated_at") or 0) > (price_cache.get("updated_at") or 0):
+            _apply_snapshot(cached_data)
+
+def load_cache(force: bool = False) -> None:
+    """بارگذاری کش از فایل (یک بار در شروع؛ در صورت خرابی از نسخه پشتیبان)"""
+    global _cache_loaded
+    with _cache_lock:
+        if _cache_loaded and not force:
+            return
+        _cache_loaded = True
+        for path in (CACHE_FILE, CACHE_BACKUP_FILE):
+            cached_data = _read_snapshot(path)
+            if cached_data is None:
+                continue
+            _apply_snapshot(cached_data)
+            logger.info(f"کش قیمت‌ها بارگذاری شد ({os.path.basename(path)}, نسخه {cached_data['version']})")
+            return
+
+def add_price_listener(callback: Callable[[int], None]) -> None:
+    """ثبت تابعی که بعد از هر تغییر واقعی قیمت‌ها (نسخه جدید snapshot) صدا زده می‌شود"""
+    if callback not in _price_listeners:
+        _price_listeners.append(callback)
+
+def _notify_price_listeners(version: int) -> None:
+    for callback in _price_listeners:
+        try:
+            callback(version)
+        except Exception as e:
+            logger.error(f"خطا در listener قیمت: {e}")
+
+def add_tick_listener(callback: Callable[[Dict[str, Optional[float]]], None]) -> None:
+    """ثبت تابعی که بعد از هر دور به‌روزرسانی قیمت‌ها (حتی بدون تغییر) صدا زده می‌شود"""
+    if callback not in _tick_listeners:
+        _tick_listeners.append(callback)
+
+def save_cache() -> bool:
+    """ذخیره کش در فایل؛ اگر قیمت‌ها تغییری نکرده باشند نوشتن انجام نمی‌شود"""
+    with _cache_lock:
+        fingerprint = _fingerprint()
+        updated_at = price_cache.get("updated_at") or 0
+        changed = fingerprint != _last_saved["fingerprint"]
+        if not changed and updated_at - _last_saved["updated_at"] < CACHE_HEARTBEAT:
+            return False
+        if changed:
+            price_cache["version"] = price_cache.get("version", 0) + 1
+        snapshot = {k: price_cache.get(k) for k in _SNAPSHOT_FIELDS}
+        snapshot.update({"schema": CACHE_SCHEMA, "version": price_cache["version"]})
+        try:
+            previous = _last_saved["snapshot"]
+            if changed and previous is not None:
+                _atomic_write_json(CACHE_BACKUP_FILE, previous)
+            _atomic_write_json(CACHE_FILE, snapshot)
+            saved = True
+        except Exception as e:
+            logger.error(f"خطا در ذخیره کش: {e}")
+            saved = False
+        else:
+            _last_saved.update({"fingerprint": fingerprint, "updated_at": updated_at, "snapshot": snapshot})
+    if changed:
+        _notify_price_listeners(snapshot["version"])
+    return saved
 
 def is_cache_valid() -> bool:
     """بررسی اعتبار کش"""
@@ -141,98 +429,110 @@ def is_cache_valid() -> bool:
 # ------------------------------
 # Main update function
 # ------------------------------
-def update_prices():
-    """به‌روزرسانی قیمت‌ها"""
-    global price_cache
+def refresh_prices() -> None:
+    """یک دور به‌روزرسانی قیمت‌ها (کار price_refresh زمان‌بند)"""
+    try:
+        # Fetch USDT price
+        usdt_price, usdt_source = fetch_usdt_price()
+        if usdt_price:
+            price_cache["usdt_price"] = usdt_price
+            price_cache["source"] = usdt_source
+            logger.info(f"✅ قیمت تتر آپدیت شد: {usdt_price:,} تومان از {usdt_source}")
+        
+        # Fetch BTC price
+        btc_price, btc_source = fetch_btc_price()
+        if btc_price:
+            price_cache["btc_price"] = btc_price
+            logger.info(f"✅ قیمت بیت‌کوین آپدیت شد: ${btc_price:,.2f} از {btc_source}")
+        
+        price_cache["updated_at"] = int(time.time())
+        price_cache["last_error"] = None
+        save_cache()
+        
+    except Exception as e:
+        error_msg = f"❌ خطا در به‌روزرسانی قیمت‌ها: {e}"
+        price_cache["last_error"] = error_msg
+        logger.error(error_msg)
+        raise
+    finally:
+        _save_health()
     
-    while True:
+    tick = {"btc_usd": price_cache.get("btc_price"), "usdt_toman": price_cache.get("usdt_price")}
+    for callback in _tick_listeners:
         try:
-            # Skip if cache is still valid
-            if is_cache_valid():
-                time.sleep(5)
-                continue
-            
-            # Fetch USDT price
-            usdt_price, usdt_source = fetch_usdt_price()
-            if usdt_price:
-                price_cache["usdt_price"] = usdt_price
-                price_cache["source"] = usdt_source
-                logger.info(f"✅ قیمت تتر آپدیت شد: {usdt_price:,} تومان از {usdt_source}")
-            
-            # Fetch BTC price
-            btc_price, btc_source = fetch_btc_price()
-            if btc_price:
-                price_cache["btc_price"] = btc_price
-                logger.info(f"✅ قیمت بیت‌کوین آپدیت شد: ${btc_price:,.2f} از {btc_source}")
-            
-            price_cache["updated_at"] = int(time.time())
-            price_cache["last_error"] = None
-            save_cache()
-            
+            callback(tick)
         except Exception as e:
-            error_msg = f"❌ خطا در به‌روزرسانی قیمت‌ها: {e}"
-            price_cache["last_error"] = error_msg
-            logger.error(error_msg)
-        
-        time.sleep(CACHE_DURATION)
+            logger.error(f"خطا در listener قیمت: {e}")
 
 # ------------------------------
 # Public API functions
 # ------------------------------
 def get_current_usdt_price() -> Optional[int]:
     """دریافت قیمت فعلی تتر"""
+    _follow_snapshot()
     return price_cache.get("usdt_price")
 
 def get_current_btc_price() -> Optional[float]:
     """دریافت قیمت فعلی بیت‌کوین"""
+    _follow_snapshot()
     return price_cache.get("btc_price")
 
 def get_price_info() -> Dict[str, Any]:
     """دریافت اطلاعات کامل قیمت‌ها"""
+    _follow_snapshot()
     return {
         "usdt_price": price_cache.get("usdt_price"),
         "btc_price": price_cache.get("btc_price"),
         "updated_at": price_cache.get("updated_at"),
         "source": price_cache.get("source", "unknown"),
         "last_error": price_cache.get("last_error"),
-        "cache_valid": is_cache_valid()
+        "cache_valid": is_cache_valid(),
+        "version": price_cache.get("version", 0)
     }
 
+def get_source_health() -> Dict[str, Any]:
+    """وضعیت هر منبع قیمت به همراه بهترین منبع فعلی هر بازار
+
+    آمار این پروسه با فایل HEALTH_FILE (نوشته‌شده توسط پروسه صاحب price_refresh) ادغام می‌شود؛
+    برای هر منبع، نسخه‌ای که last_check جدیدتری دارد.
+    """
+    apis = {name: stats.snapshot() for name, stats in source_stats.items()}
+    for name, shared in _read_health().items():
+        if name in apis and (shared.get("last_check") or 0) > (apis[name]["last_check"] or 0):
+            apis[name] = shared
+    best: Dict[str, Optional[str]] = {}
+    for market, sources in (("usdt", USDT_SOURCES), ("btc", BTC_SOURCES)):
+        # Same order as SourceStats.sort_key: closed/half-open first, then latency, then priority
+        ordered = sorted(
+            ((apis[src["name"]], priority, src["name"]) for priority, src in enumerate(sources)),
+            key=lambda item: (
+                item[0]["breaker"] == "open",
+                item[0]["latency"]["ewma"] if item[0]["latency"]["ewma"] is not None else float("inf"),
+                item[1],
+            ),
+        )
+        healthy = [name for info, _priority, name in ordered if info["last_success"] is not None and info["breaker"] == "closed"]
+        best[market] = healthy[0] if healthy else None
+    return {"apis": apis, "best": best}
+
+def get_snapshot_version() -> int:
+    """نسخه snapshot قیمت‌ها؛ فقط با تغییر واقعی قیمت‌ها افزایش می‌یابد"""
+    _follow_snapshot()
+    return price_cache.get("version", 0)
+
 def force_price_update() -> bool:
     """اجبار به‌روزرسانی فوری قیمت‌ها"""
     try:
-        # Fetch USDT price
-        usdt_price, usdt_source = fetch_usdt_price()
-        if usdt_price:
-            price_cache["usdt_price"] = usdt_price
-            price_cache["source"] = usdt_source
-        
-        # Fetch BTC price
-        btc_price, btc_source = fetch_btc_price()
-        if btc_price:
-            price_cache["btc_price"] = btc_price
-            
-        price_cache["updated_at"] = int(time.time())
-        price_cache["last_error"] = None
-        save_cache()
-        
+        refresh_prices()
         return True
     except Exception as e:
         logger.error(f"خطا در به‌روزرسانی فوری: {e}")
         return False
 
 def start_price_fetcher():
-    """شروع فرآیند به‌روزرسانی قیمت‌ها"""
+    """ثبت کار به‌روزرسانی قیمت‌ها در زمان‌بند (اجرا فقط در پروسه صاحب زمان‌بند)"""
+    from scheduler import scheduler
+
     load_cache()  # بارگذاری آخرین کش
-    
-    def run_updater():
-        try:
-            update_prices()
-        except KeyboardInterrupt:
-            logger.info("فرآیند به‌روزرسانی قیمت‌ها متوقف شد")
-        except Exception as e:
-            logger.error(f"خطا در فرآیند به‌روزرسانی: {e}")
-    
-    # اجرای به‌روزرسانی در thread جداگانه
-    Thread(target=run_updater, daemon=True).start()
-    logger.info("🚀 فرآیند به‌روزرسانی قیمت‌ها شروع شد")
\ No newline at end of file
+    scheduler.add_job("price_refresh", refresh_prices, interval=CACHE_DURATION, jitter=2, timeout=2 * REQUEST_TIMEOUT + 5, run_at_start=not is_cache_valid())
+    logger.info("🚀 کار به‌روزرسانی قیمت‌ها در زمان‌بند ثبت شد")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+پروفایلر درخواست‌محور (اختیاری) برای پیدا کردن نقاط کند در محیط production
+
+فعال‌سازی با متغیرهای محیطی:
+- PPLUS_PROFILE=1                    روشن کردن middleware
+- PPLUS_PROFILE_TOKEN=...            توکن لازم در هدر X-Profile-Token یا پارامتر ?_profile=
+- PPLUS_PROFILE_SAMPLE=/balance=5    نمونه‌برداری درصدی از مسیرها (با کاما جدا شوند)
+- PPLUS_PROFILE_DIR=profiles         مسیر خروجی
+- PPLUS_PROFILE_MAX_FILES=50         حداکثر تعداد پروفایل‌های نگهداری شده
+
+برای هر درخواست پروفایل شده یک فایل .pstats و یک فایل .collapsed (قابل استفاده در
+flamegraph.pl یا speedscope) نوشته می‌شود.
+"""
+
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from werkzeug.wrappers import Request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_ENABLED = os.environ.get("PPLUS_PROFILE") == "1"
+PROFILE_TOKEN = os.environ.get("PPLUS_PROFILE_TOKEN")
+PROFILE_DIR = os.environ.get("PPLUS_PROFILE_DIR") or os.path.join(BASE_DIR, "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PPLUS_PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE = os.environ.get("PPLUS_PROFILE_SAMPLE", "")
+
+# Stack frames whose inline time is below this (microseconds) are dropped from collapsed output
+_COLLAPSED_MIN_US = 1
+_COLLAPSED_MAX_DEPTH = 64
+_COLLAPSED_MAX_VISITS = 200_000
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    """'/balance=5,/panel=0.5' -> {'/balance': 0.05, '/panel': 0.005}"""
+    rates: Dict[str, float] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        path, percent = item.split("=", 1)
+        try:
+            rates[path.strip()] = max(0.0, min(100.0, float(percent))) / 100.0
+        except ValueError:
+            continue
+    return rates
+
+
+def _frame_label(func: Tuple[str, int, str]) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name  # built-in
+    return f"{os.path.basename(filename)}:{name}:{lineno}"
+
+
+def collapse_stats(stats: pstats.Stats) -> List[str]:
+    """Build collapsed-stack lines ('a;b;c <microseconds>') from profile data.
+
+    cProfile only records caller/callee pairs, so full stacks are rebuilt by
+    walking the call graph from its roots and splitting each function's inline
+    time across callers in proportion to their call counts.
+    """
+    raw = stats.stats  # type: ignore[attr-defined]
+    callees: Dict[tuple, List[Tuple[tuple, int]]] = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in raw.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[1]))
+
+    weights: Dict[str, float] = {}
+    visits = [0]
+
+    def walk(func: tuple, stack: List[str], share: float, on_path: set) -> None:
+        _cc, _nc, tt, ct, _callers = raw[func]
+        # Subtrees worth less than the output resolution are not expanded (keeps the walk bounded)
+        if ct * share * 1e6 < _COLLAPSED_MIN_US or visits[0] >= _COLLAPSED_MAX_VISITS:
+            return
+        visits[0] += 1
+        stack.append(_frame_label(func))
+        inline_us = tt * share * 1e6
+        if inline_us >= _COLLAPSED_MIN_US:
+            key = ";".join(stack)
+            weights[key] = weights.get(key, 0.0) + inline_us
+        if len(stack) < _COLLAPSED_MAX_DEPTH:
+            on_path.add(func)
+            for callee, calls in callees.get(func, ()):
+                if callee in on_path or callee not in raw:
+                    continue
+                callee_total = raw[callee][1] or 1
+                walk(callee, stack, share * calls / callee_total, on_path)
+            on_path.discard(func)
+        stack.pop()
+
+    roots = [func for func, entry in raw.items() if not entry[4]]
+    for root in roots:
+        walk(root, [], 1.0, set())
+    return [f"{key} {int(round(value))}" for key, value in sorted(weights.items()) if value >= _COLLAPSED_MIN_US]
+
+
+class RequestProfiler:
+    """WSGI middleware that wraps selected requests in cProfile."""
+
+    def __init__(self, wsgi_app, token: Optional[str] = PROFILE_TOKEN, sample: str = PROFILE_SAMPLE,
+                 profile_dir: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.wsgi_app = wsgi_app
+        self.token = token
+        self.sample_rates = _parse_sample_rates(sample)
+        self.profile_dir = profile_dir
+        self.max_files = max(1, max_files)
+        # Newer Pythons allow a single active profiler, so profile one request at a time
+        self._lock = threading.Lock()
+
+    def _requested(self, request: Request) -> bool:
+        if not self.token:
+            return False
+        supplied = request.headers.get("X-Profile-Token") or request.args.get("_profile") or ""
+        return bool(supplied) and hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def _sampled(self, path: str) -> bool:
+        rate = self.sample_rates.get(path)
+        return bool(rate) and random.random() < rate
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if not (self._requested(request) or self._sampled(request.path)):
+            return self.wsgi_app(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                app_iter = self.wsgi_app(environ, start_response)
+                try:
+                    # Consume the body inside the profile so template streaming is included
+                    body = list(app_iter)
+                finally:
+                    if hasattr(app_iter, "close"):
+                        app_iter.close()
+            finally:
+                profile.disable()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            try:
+                self._dump(profile, request.method, request.path, elapsed_ms)
+            except Exception as e:
+                print(f"[profiler] dump failed: {e}")
+            return body
+        finally:
+            self._lock.release()
+
+    def _dump(self, profile: cProfile.Profile, method: str, path: str, elapsed_ms: float) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}_{method}_{slug}_{elapsed_ms:.0f}ms"
+        base = os.path.join(self.profile_dir, stem)
+        profile.dump_stats(base + ".pstats")
+        stats = pstats.Stats(profile)
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.write("\n".join(collapse_stats(stats)) + "\n")
+        self._prune()
+
+    def _prune(self) -> None:
+        """Keep only the newest `max_files` profiles (each is a .pstats/.collapsed pair)."""
+        stems: Dict[str, float] = {}
+        for name in os.listdir(self.profile_dir):
+            stem, ext = os.path.splitext(name)
+            if ext in (".pstats", ".collapsed"):
+                path = os.path.join(self.profile_dir, name)
+                stems[stem] = max(stems.get(stem, 0.0), os.path.getmtime(path))
+        for stem in sorted(stems, key=stems.get)[:-self.max_files]:
+            for ext in (".pstats", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, stem + ext))
+                except OSError:
+                    pass
+
+
+def init_profiler(app) -> None:
+    """Install the profiling middleware when PPLUS_PROFILE=1."""
+    if not PROFILE_ENABLED:
+        return
+    if not PROFILE_TOKEN and not PROFILE_SAMPLE:
+        print("[profiler] WARNING: PPLUS_PROFILE=1 but neither PPLUS_PROFILE_TOKEN nor PPLUS_PROFILE_SAMPLE is set")
+    app.wsgi_app = RequestProfiler(app.wsgi_app)
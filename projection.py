@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+پیش‌بینی مونت‌کارلو برای اهداف پورتفولیو
+
+هزاران مسیر قیمت روزانه BTC در آرایه‌های NumPy (paths × days) ساخته می‌شوند؛ مسیرها در دسته‌های
+CHUNK_CELLS خانه‌ای شبیه‌سازی می‌شوند تا حافظه محدود بماند و کل کار هر درخواست به MAX_CELLS محدود است:
+- gbm: حرکت براونی هندسی؛ نوسان از بازده‌های روزانه ذخیره‌شده در price_history (یا پیش‌فرض)
+- bootstrap: نمونه‌گیری با جایگذاری از همان بازده‌های روزانه
+
+موجودی فعلی کیف پول هدف (و در صورت تعیین، خرید دوره‌ای دلاری) روی همه مسیرها اعمال می‌شود و
+برای هر هدف احتمال رسیدن تا تاریخ هدف، احتمال بالاتر بودن در خود تاریخ هدف و باندهای صدکی
+برگردانده می‌شود. نتیجه برای هر (هدف، نسخه snapshot قیمت، نسخه دفتر کل، پارامترها) کش می‌شود.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from db import get_data_version, get_db_connection
+from evaluation import goal_measure, wallet_metrics, wallet_of, wallet_positions
+from price_fetcher import get_current_btc_price, get_snapshot_version
+
+MODELS = ("gbm", "bootstrap")
+DEFAULT_PATHS = 10000
+MAX_PATHS = 50000
+DEFAULT_HORIZON_DAYS = 365
+MAX_HORIZON_DAYS = 3650
+MIN_HISTORY_RETURNS = 30  # fewer stored daily returns than this: use DEFAULT_VOLATILITY / GBM
+DEFAULT_VOLATILITY = 0.60  # annualized
+PERCENTILES = (5, 25, 50, 75, 95)
+BAND_POINTS = 53  # points per percentile band (about weekly for a one-year horizon)
+CHUNK_CELLS = 2_000_000  # paths × days simulated at once (bounds memory)
+MAX_CELLS = 40_000_000  # paths × furthest horizon of one request (bounds CPU)
+CACHE_SIZE = 128
+
+_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def daily_log_returns(conn) -> np.ndarray:
+    """Log returns between consecutive stored daily closes (last hourly price of each UTC day)."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT substr(hour, 1, 10) AS day, btc_usd FROM price_history
+        WHERE hour IN (SELECT MAX(hour) FROM price_history GROUP BY substr(hour, 1, 10))
+        ORDER BY day
+        """
+    )
+    rows = cur.fetchall()
+    days = [date.fromisoformat(r["day"]) for r in rows]
+    closes = np.array([float(r["btc_usd"]) for r in rows])
+    if len(closes) < 2:
+        return np.empty(0)
+    # Only consecutive days: a gap in the history is not a one-day return
+    consecutive = np.array([(b - a).days == 1 for a, b in zip(days, days[1:])])
+    return np.diff(np.log(closes))[consecutive]
+
+
+def simulate_prices(
+    price: float,
+    days: int,
+    paths: int,
+    model: str,
+    returns: np.ndarray,
+    drift: float,
+    volatility: Optional[float],
+    rng: np.random.Generator,
+) -> Dict[str, Any]:
+    """(paths × days) array of simulated daily closes, plus the parameters actually used."""
+    if model == "bootstrap" and len(returns) >= MIN_HISTORY_RETURNS:
+        steps = rng.choice(returns, size=(paths, days))
+        params = {"model": "bootstrap", "history_returns": int(len(returns))}
+    else:
+        if volatility is None:
+            volatility = float(np.std(returns, ddof=1) * np.sqrt(365)) if len(returns) >= MIN_HISTORY_RETURNS else DEFAULT_VOLATILITY
+        dt = 1.0 / 365
+        steps = rng.standard_normal((paths, days))
+        steps *= volatility * np.sqrt(dt)
+        steps += (drift - 0.5 * volatility ** 2) * dt
+        params = {"model": "gbm", "drift": drift, "volatility": volatility, "history_returns": int(len(returns))}
+    np.cumsum(steps, axis=1, out=steps)
+    np.exp(steps, out=steps)
+    steps *= price
+    return {"prices": steps, "params": params}
+
+
+def _goal_paths(goal_type: str, prices: np.ndarray, position: Dict[str, float], buy_usd: float, buy_every: int) -> np.ndarray:
+    """Goal measure along every path (same units as portfolio_goals.target_value)."""
+    paths, days = prices.shape
+    btc = np.full((paths, days), position["btc"])
+    purchased = np.full(days, position["purchased_usd"])
+    if buy_usd > 0 and buy_every > 0:
+        buy_days = np.arange(buy_every - 1, days, buy_every)
+        bought = np.zeros((paths, days))
+        bought[:, buy_days] = buy_usd / prices[:, buy_days]
+        btc += np.cumsum(bought, axis=1)
+        flags = np.zeros(days)
+        flags[buy_days] = buy_usd
+        purchased = purchased + np.cumsum(flags)
+    if goal_type == "btc":
+        return btc
+    value = btc * prices
+    if goal_type == "roi":
+        pnl = value + position["withdrawn_usd"] - purchased
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(purchased > 0, pnl / purchased * 100, 0.0)
+    return value
+
+
+def _band_days(days: int) -> np.ndarray:
+    return np.unique(np.linspace(0, days - 1, min(days, BAND_POINTS)).round().astype(int))
+
+
+def _bands(sampled: np.ndarray, idx: np.ndarray, start: date) -> List[Dict[str, Any]]:
+    """Percentile bands of the measure sampled on days `idx` (paths × len(idx))."""
+    pct = np.percentile(sampled, PERCENTILES, axis=0)
+    return [
+        {"day": int(i) + 1, "date": (start + timedelta(days=int(i) + 1)).isoformat(), **{f"p{p}": float(pct[k, j]) for k, p in enumerate(PERCENTILES)}}
+        for j, i in enumerate(idx)
+    ]
+
+
+def project_goals(
+    goal_ids: Optional[List[int]] = None,
+    paths: int = DEFAULT_PATHS,
+    model: str = "gbm",
+    buy_usd: float = 0.0,
+    buy_every_days: int = 0,
+    drift: float = 0.0,
+    volatility: Optional[float] = None,
+    seed: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Projection of every goal in `goal_ids` (all goals when None).
+
+    ValueError when paths × the furthest horizon exceeds MAX_CELLS.
+    """
+    today = date.today()
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        sql = "SELECT id, wallet_id, goal_name, goal_type, target_value, target_date, is_achieved FROM portfolio_goals"
+        if goal_ids is not None:
+            if not goal_ids:
+                return []
+            sql += f" WHERE id IN ({','.join('?' * len(goal_ids))})"
+        cur.execute(sql + " ORDER BY id", goal_ids or [])
+        goals = cur.fetchall()
+        if not goals:
+            return []
+        version = (get_snapshot_version(), get_data_version(conn))
+        options = (paths, model, buy_usd, buy_every_days, drift, volatility, seed)
+
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = []
+        for goal in goals:
+            key = (goal["id"], goal["goal_type"], goal["target_value"], goal["target_date"], goal["wallet_id"], today, version, options)
+            with _cache_lock:
+                cached = _cache.get(key)
+                if cached is not None:
+                    _cache.move_to_end(key)
+            if cached is not None:
+                results[goal["id"]] = {**cached, "cached": True}
+            else:
+                pending.append((key, goal))
+        if pending:
+            price = get_current_btc_price()
+            if not price:
+                raise RuntimeError("no BTC price available")
+            positions = wallet_positions(cur, {wallet_of(goal) for _key, goal in pending})
+            returns = daily_log_returns(conn)
+    finally:
+        conn.close()
+
+    if pending:
+        horizons = [_horizon(goal, today) for _key, goal in pending]
+        longest = max(horizons)
+        if paths * longest > MAX_CELLS:
+            raise ValueError(f"paths × horizon must be <= {MAX_CELLS} (furthest target is {longest} days: use paths <= {MAX_CELLS // longest})")
+        # The same price paths for all goals, as long as the furthest target date; per goal only the
+        # running max, the last value and the band days of each chunk are kept
+        digest = hashlib.sha256(repr((version, options, today)).encode()).digest()
+        rng = np.random.default_rng(seed if seed is not None else int.from_bytes(digest[:8], "little"))
+        band_days = [_band_days(days) for days in horizons]
+        summaries: List[Dict[str, List[np.ndarray]]] = [{"max": [], "last": [], "bands": []} for _ in pending]
+        chunk = max(1, CHUNK_CELLS // longest)
+        for first in range(0, paths, chunk):
+            simulated = simulate_prices(price, longest, min(chunk, paths - first), model, returns, drift, volatility, rng)
+            for summary, (key, goal), days, idx in zip(summaries, pending, horizons, band_days):
+                measure = _goal_paths(goal["goal_type"], simulated["prices"][:, :days], positions[wallet_of(goal)], buy_usd, buy_every_days)
+                summary["max"].append(measure.max(axis=1))
+                summary["last"].append(measure[:, -1])
+                summary["bands"].append(measure[:, idx])
+            params = simulated["params"]
+        for summary, (key, goal), days, idx in zip(summaries, pending, horizons, band_days):
+            target = float(goal["target_value"])
+            result = {
+                "goal_id": goal["id"],
+                "goal_name": goal["goal_name"],
+                "goal_type": goal["goal_type"],
+                "target_value": target,
+                "target_date": goal["target_date"],
+                "horizon_days": days,
+                "current_value": goal_measure(goal["goal_type"], wallet_metrics(positions[wallet_of(goal)], price)),
+                "probability_by_date": float(np.mean(np.concatenate(summary["max"]) >= target)),
+                "probability_at_date": float(np.mean(np.concatenate(summary["last"]) >= target)),
+                "bands": _bands(np.concatenate(summary["bands"]), idx, today),
+                "paths": paths,
+                "btc_price": price,
+                "plan": {"buy_usd": buy_usd, "every_days": buy_every_days} if buy_usd > 0 and buy_every_days > 0 else None,
+                **params,
+            }
+            with _cache_lock:
+                _cache[key] = result
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+            results[goal["id"]] = {**result, "cached": False}
+    return [results[goal["id"]] for goal in goals]
+
+
+def _horizon(goal, today: date) -> int:
+    try:
+        target = date.fromisoformat(str(goal["target_date"])[:10]) if goal["target_date"] else None
+    except ValueError:
+        target = None
+    days = (target - today).days if target else DEFAULT_HORIZON_DAYS
+    return max(1, min(days, MAX_HORIZON_DAYS))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+کش رندر قالب‌ها (صفحه کامل و تکه‌ها)
+
+- کلید هر ورودی: نام قالب/تکه + نسخه داده (data_version در دیتابیس) + نسخه snapshot قیمت
+  + هش توکن CSRF نشست؛ هر نوشتن در دفتر کل یا به‌روزرسانی قیمت، ورودی‌های قدیمی را بی‌اثر می‌کند
+- حافظه محدود: LRU بر اساس مجموع حجم HTML (PPLUS_RENDER_CACHE_MB) و تعداد ورودی‌ها
+- صفحاتی که قیمت زنده BTC را همان لحظه می‌گیرند با ttl کوتاه کش می‌شوند
+- درخواست‌هایی که پیام flash در انتظار دارند کش نمی‌شوند
+- کش bytecode جینجا روی دیسک تا worker‌های تازه قالب‌ها را دوباره کامپایل نکنند
+
+متغیرهای محیطی:
+- PPLUS_RENDER_CACHE=0            خاموش کردن کش رندر
+- PPLUS_RENDER_CACHE_MB=16        سقف حافظه
+- PPLUS_JINJA_CACHE_DIR=...       مسیر کش bytecode (پیش‌فرض .jinja_cache)
+"""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import Flask, g, has_request_context, render_template, request, session
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from db import get_data_version
+from metrics import Counter, REGISTRY
+from price_fetcher import get_snapshot_version
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RENDER_CACHE_ENABLED = os.environ.get("PPLUS_RENDER_CACHE", "1") != "0"
+RENDER_CACHE_MAX_BYTES = int(float(os.environ.get("PPLUS_RENDER_CACHE_MB", "16")) * 1024 * 1024)
+RENDER_CACHE_MAX_ENTRIES = 512
+JINJA_CACHE_DIR = os.environ.get("PPLUS_JINJA_CACHE_DIR") or os.path.join(BASE_DIR, ".jinja_cache")
+
+RENDER_CACHE_TOTAL = Counter("pplus_render_cache_total", "Render cache lookups by kind and result.", ("kind", "result"))
+REGISTRY.append(RENDER_CACHE_TOTAL)
+
+
+class RenderCache:
+    """Thread-safe LRU of rendered HTML bounded by total size and entry count."""
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES, max_entries: int = RENDER_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        # key -> (html, expires_at or None)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            html, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return html
+
+    def set(self, key: Hashable, html: str, ttl: Optional[float] = None) -> None:
+        cost = len(html)
+        if cost > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (html, expires_at)
+            self.size += cost
+            while self._entries and (self.size > self.max_bytes or len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: Hashable) -> None:
+        html, _expires_at = self._entries.pop(key)
+        self.size -= len(html)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+RENDER_CACHE = RenderCache()
+
+
+def _data_version() -> int:
+    # One lookup per request; every cached page/fragment in the request shares it
+    if "_data_version" not in g:
+        g._data_version = get_data_version()
+    return g._data_version
+
+
+def _session_scope() -> str:
+    """Pages embed the session's CSRF token, so cached HTML is scoped to it."""
+    token = session.get("csrf_token") or ""
+    return hashlib.sha1(token.encode()).hexdigest()[:16]
+
+
+def _cacheable() -> bool:
+    # Pending flash messages are rendered (and consumed) by base.html
+    return RENDER_CACHE_ENABLED and has_request_context() and not session.get("_flashes")
+
+
+def _base_key(kind: str, name: str, prices: bool) -> tuple:
+    return (kind, name, _data_version(), get_snapshot_version() if prices else None, _session_scope())
+
+
+def _lookup(kind: str, key: tuple) -> Optional[str]:
+    html = RENDER_CACHE.get(key)
+    RENDER_CACHE_TOTAL.inc((kind, "hit" if html is not None else "miss"))
+    return html
+
+
+def render_page(template_name: str, build_context: Callable[[], Dict[str, Any]], ttl: Optional[float] = None) -> str:
+    """Render a full page through the cache.
+
+    `build_context` is only called on a miss, so a hit also skips the page's
+    database reads. Pages whose context includes a live price should pass a
+    short `ttl`.
+    """
+    if not _cacheable():
+        return render_template(template_name, **build_context())
+    # Make sure the session has its token before it becomes part of the key
+    _ensure_csrf_token()
+    key = _base_key("page", template_name, prices=True) + (request.full_path,)
+    html = _lookup("page", key)
+    if html is None:
+        html = render_template(template_name, **build_context())
+        if _cacheable():
+            RENDER_CACHE.set(key, html, ttl)
+    return html
+
+
+def cached_fragment(name: str, *vary: Hashable, prices: bool = False, ttl: Optional[float] = None, caller=None) -> Markup:
+    """Jinja helper used as a call block:
+
+        {% call cached_fragment("withdrawals_table") %} ... {% endcall %}
+
+    The fragment is keyed by data_version (and the price snapshot version when
+    `prices=True`) plus any extra `vary` values such as request.path.
+    """
+    if not _cacheable():
+        return Markup(caller())
+    key = _base_key("fragment", name, prices) + tuple(vary)
+    html = _lookup("fragment", key)
+    if html is None:
+        html = str(caller())
+        RENDER_CACHE.set(key, html, ttl)
+    return Markup(html)
+
+
+def _ensure_csrf_token() -> None:
+    try:
+        from flask_wtf.csrf import generate_csrf
+        generate_csrf()
+    except Exception:
+        pass
+
+
+# ----------------------------------------------------------------------------
+# Flask wiring
+# ----------------------------------------------------------------------------
+def init_render_cache(app: Flask) -> None:
+    """Enable the Jinja bytecode cache and expose `cached_fragment` to templates."""
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    except OSError as e:
+        print(f"[render_cache] bytecode cache disabled: {e}")
+    app.jinja_env.globals["cached_fragment"] = cached_fragment
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+جمع‌بندی دوره‌ای سود/زیان تحقق‌یافته و حجم معاملات (ماهانه/سالانه، میلادی و شمسی)
+
+هر معامله یا واریز دلاری سهم خود را به چهار سطل pnl_rollups اضافه می‌کند:
+(gregorian, month) (gregorian, year) (jalali, month) (jalali, year). سود/زیان تحقق‌یافته هر برداشت
+با FIFO (lots.FifoBook، همان ترتیب lots.fifo_pnl) به دوره تاریخ برداشت تعلق می‌گیرد؛ معادل تومانی
+با نرخ دلار همان زمان (fx.py: تاریخچه نرخ بازار یا آخرین واریز دلاری) حساب می‌شود.
+
+نگهداری تدریجی است: لات‌های باز و cursor تغییرات در rollup_state ذخیره می‌شوند و ردیف‌های تازه
+دفتر کل (از change_log) فقط سطل‌های خودشان را جمع می‌زنند. ویرایش/حذف، معامله با تاریخ قبل از
+آخرین معامله هم‌نوع، یا ریست دیتابیس باعث یک بار بازسازی کامل می‌شود.
+گزارش‌ها فقط ردیف‌های جمع‌شده را می‌خوانند: O(تعداد دوره‌ها).
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dashboard_data import deposit_row, trade_row
+from db import RESET_MARKER, get_db_connection
+from fx import rate_at
+from jalali import jalali_date, month_label
+from lots import FifoBook
+from money import btc, to_rial, toman, usd
+from price_fetcher import get_current_usdt_price
+
+logger = logging.getLogger(__name__)
+
+CALENDARS = ("gregorian", "jalali")
+PERIODS = ("month", "year")
+LEDGER_TABLES = ("purchases", "withdrawals", "usd_deposits")
+# Stored integer column (sat, micro-USD, Rial; summed exactly) -> reported metric and its conversion
+COLUMNS = {
+    "realized_pnl_micro": ("realized_pnl_usd", usd),
+    "realized_pnl_rial": ("realized_pnl_toman", toman),
+    "sat_bought": ("btc_bought", btc),
+    "usd_bought_micro": ("usd_bought", usd),
+    "sat_sold": ("btc_sold", btc),
+    "usd_sold_micro": ("usd_sold", usd),
+    "usd_deposited_micro": ("usd_deposited", usd),
+    "rial_deposited": ("toman_deposited", toman),
+    "trades": ("trades", int),
+}
+
+
+def _buckets(created_at: str) -> List[Tuple[str, str, str]]:
+    jy, jm, _jd = jalali_date(created_at)
+    return [
+        ("gregorian", "month", created_at[:7]),
+        ("gregorian", "year", created_at[:4]),
+        ("jalali", "month", f"{jy:04d}-{jm:02d}"),
+        ("jalali", "year", f"{jy:04d}"),
+    ]
+
+
+def _usd_toman_rate(cur, at: str) -> Optional[float]:
+    """Latest known USD/Toman rate at `at` (fx.rate_at: market history or the last USD deposit, whichever is newer)."""
+    rate = rate_at(at, cur.connection)
+    if rate:
+        return rate
+    current = get_current_usdt_price()
+    return float(current) if current else None
+
+
+class _Accumulator:
+    """Per-bucket metric deltas collected before one write."""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+
+    def add(self, created_at: str, **deltas: int) -> None:
+        for key in _buckets(created_at):
+            row = self.rows.setdefault(key, dict.fromkeys(COLUMNS, 0))
+            for name, value in deltas.items():
+                row[name] += value
+
+
+def _apply_trades(cur, book: FifoBook, acc: _Accumulator, purchases, withdrawals, deposits) -> float:
+    """Feed trades to the lot book (purchases first, as fifo_pnl does); returns BTC sold without open lots."""
+    unmatched = 0.0
+    for p in purchases:
+        book.buy(p)
+        acc.add(p["created_at"], sat_bought=p["amount_sat"], usd_bought_micro=p["cost_micro"], trades=1)
+    for w in withdrawals:
+        before = book.realized_micro
+        unmatched += book.sell(w)
+        realized = book.realized_micro - before
+        rate = _usd_toman_rate(cur, w["created_at"]) or 0.0
+        acc.add(
+            w["created_at"],
+            realized_pnl_micro=realized,
+            # Rounded to the Rial once per withdrawal, then summed exactly
+            realized_pnl_rial=to_rial(usd(realized) * rate),
+            sat_sold=w["amount_sat"],
+            usd_sold_micro=w["cost_micro"],
+            trades=1,
+        )
+    for d in deposits:
+        acc.add(d["created_at"], usd_deposited_micro=d["amount_usd_micro"], rial_deposited=d["amount_rial"])
+    return unmatched
+
+
+def _write(cur, acc: _Accumulator, replace: bool) -> None:
+    if replace:
+        cur.execute("DELETE FROM pnl_rollups")
+    cur.executemany(
+        f"""
+        INSERT INTO pnl_rollups(calendar, period, bucket, {', '.join(COLUMNS)})
+        VALUES(?, ?, ?, {', '.join('?' for _ in COLUMNS)})
+        ON CONFLICT(calendar, period, bucket) DO UPDATE SET
+        {', '.join(f'{c} = {c} + excluded.{c}' for c in COLUMNS)}
+        """,
+        [(*key, *(row[c] for c in COLUMNS)) for key, row in acc.rows.items()],
+    )
+
+
+def _trades(cur, table: str, ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    sql = f"SELECT id, created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro, wallet_id FROM {table}"
+    if ids is not None:
+        sql += f" WHERE id IN ({','.join('?' * len(ids))})"
+    cur.execute(sql + " ORDER BY created_at ASC, id ASC", ids or [])
+    return [trade_row(r) for r in cur.fetchall()]
+
+
+def _deposits(cur, ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    sql = "SELECT id, created_at, amount_usd, price_toman_per_usd, amount_toman, amount_usd_micro, amount_rial FROM usd_deposits"
+    if ids is not None:
+        sql += f" WHERE id IN ({','.join('?' * len(ids))})"
+    cur.execute(sql, ids or [])
+    return [deposit_row(r) for r in cur.fetchall()]
+
+
+def _save_state(cur, head: int, book: FifoBook, last_purchase: str, last_withdrawal: str, unmatched: float) -> None:
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO rollup_state(id, change_version, last_purchase_at, last_withdrawal_at, unmatched_btc, lots, updated_at)
+        VALUES(1, ?, ?, ?, ?, ?, ?)
+        """,
+        (head, last_purchase, last_withdrawal, unmatched, json.dumps(list(book.lots)), datetime.utcnow().isoformat(timespec="seconds")),
+    )
+
+
+def _rebuild(cur, head: int) -> Dict[str, Any]:
+    purchases, withdrawals = _trades(cur, "purchases"), _trades(cur, "withdrawals")
+    book, acc = FifoBook(), _Accumulator()
+    unmatched = _apply_trades(cur, book, acc, purchases, withdrawals, _deposits(cur))
+    _write(cur, acc, replace=True)
+    _save_state(
+        cur, head, book,
+        purchases[-1]["created_at"] if purchases else "",
+        withdrawals[-1]["created_at"] if withdrawals else "",
+        unmatched,
+    )
+    return {"rebuilt": True, "buckets": len(acc.rows)}
+
+
+def refresh_rollups(conn=None, force_full: bool = False) -> Dict[str, Any]:
+    """Bring pnl_rollups up to date with the ledger (incrementally when only new trades were appended)."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        head = cur.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+        state = cur.execute("SELECT * FROM rollup_state WHERE id = 1").fetchone()
+        if force_full or state is None:
+            result = _rebuild(cur, head)
+            conn.commit()
+            return result
+        if state["change_version"] >= head:
+            conn.rollback()
+            return {"rebuilt": False, "buckets": 0}
+
+        cur.execute(
+            f"SELECT table_name, row_id, op FROM change_log WHERE version > ? AND table_name IN ({','.join('?' * (len(LEDGER_TABLES) + 1))})",
+            (state["change_version"], RESET_MARKER, *LEDGER_TABLES),
+        )
+        inserted: Dict[str, List[int]] = {table: [] for table in LEDGER_TABLES}
+        for row in cur.fetchall():
+            if row["table_name"] == RESET_MARKER or row["op"] != "insert":
+                result = _rebuild(cur, head)
+                conn.commit()
+                return result
+            inserted[row["table_name"]].append(int(row["row_id"]))
+
+        purchases = _trades(cur, "purchases", inserted["purchases"]) if inserted["purchases"] else []
+        withdrawals = _trades(cur, "withdrawals", inserted["withdrawals"]) if inserted["withdrawals"] else []
+        deposits = _deposits(cur, inserted["usd_deposits"]) if inserted["usd_deposits"] else []
+        appended = (
+            len(purchases) == len(inserted["purchases"])
+            and len(withdrawals) == len(inserted["withdrawals"])
+            and len(deposits) == len(inserted["usd_deposits"])
+            and all(p["created_at"] >= state["last_purchase_at"] for p in purchases)
+            and all(w["created_at"] >= state["last_withdrawal_at"] for w in withdrawals)
+            # fifo_pnl would match an earlier short withdrawal against a new purchase
+            and not (purchases and state["unmatched_btc"] > 0)
+        )
+        if not appended:
+            result = _rebuild(cur, head)
+            conn.commit()
+            return result
+
+        book, acc = FifoBook(), _Accumulator()
+        book.restore(json.loads(state["lots"] or "[]"))
+        unmatched = state["unmatched_btc"] + _apply_trades(cur, book, acc, purchases, withdrawals, deposits)
+        _write(cur, acc, replace=False)
+        _save_state(
+            cur, head, book,
+            purchases[-1]["created_at"] if purchases else state["last_purchase_at"],
+            withdrawals[-1]["created_at"] if withdrawals else state["last_withdrawal_at"],
+            unmatched,
+        )
+        conn.commit()
+        return {"rebuilt": False, "buckets": len(acc.rows)}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def refresh_rollups_quietly() -> None:
+    """refresh_rollups right after a ledger write; on failure the pnl_rollups job catches up."""
+    try:
+        refresh_rollups()
+    except Exception:
+        logger.exception("[rollups] refresh after ledger write failed")
+
+
+def pnl_report(calendar: str = "jalali", period: str = "month", start: Optional[str] = None, end: Optional[str] = None, conn=None) -> Dict[str, Any]:
+    """Stored rollup rows of one calendar/period in [start, end] (bucket keys, inclusive), oldest first.
+
+    Rows and totals are summed as integers and converted to BTC / USD / Toman only here.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT bucket, {', '.join(COLUMNS)} FROM pnl_rollups
+            WHERE calendar = ? AND period = ? AND bucket >= ? AND bucket <= ?
+            ORDER BY bucket
+            """,
+            (calendar, period, start or "", end or "9999-99"),
+        )
+        stored = cur.fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    sums = dict.fromkeys(COLUMNS, 0)
+    rows = []
+    for r in stored:
+        row = {"bucket": r["bucket"]}
+        if calendar == "jalali" and period == "month":
+            row["label"] = month_label(r["bucket"])
+        for column, (metric, convert) in COLUMNS.items():
+            row[metric] = convert(r[column])
+            sums[column] += r[column]
+        rows.append(row)
+    totals = {metric: convert(sums[column]) for column, (metric, convert) in COLUMNS.items()}
+    return {"calendar": calendar, "period": period, "rows": rows, "totals": totals}
@@ -2,25 +2,47 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 import json
+import urllib.parse
 import urllib.request
 import requests
 from functools import wraps
 import time
 
 from db import get_db_connection, get_db_context
-from price_fetcher import get_price_info, get_current_usdt_price, get_current_btc_price, force_price_update
+from metrics import track_outbound
+import money
+from dashboard_data import filter_sql, in_filter, ledger_filter, load_dashboard_data, roi
+from ledger import dashboard_data_as_of, ledger_as_of, row_history
+from changes import changes_since, CHANGES_PAGE_SIZE
+from evaluation import recent_events
+from fx import rates_at, toman_at_trade, toman_per_usd
+from indicators import get_indicators
+from nav import PERIODS as NAV_PERIODS, TOTAL_WALLET_ID, equity_curve
+from projection import MAX_PATHS, MODELS as PROJECTION_MODELS, project_goals
+from costbasis import cost_basis, set_wallet_method
+from lots import COST_BASIS_METHODS
+from whatif import run_scenarios, withdrawal_grid
+from search import search as search_ledger
+from rollups import CALENDARS, PERIODS as ROLLUP_PERIODS, pnl_report, refresh_rollups_quietly
+from alerts import OUTBOX_STATUSES, create_alert, list_alerts, list_outbox, mark_outbox, validate_alert
+from db import LEDGER_EVENT_TABLES, SYNCED_TABLES
+from price_fetcher import get_price_info, get_current_usdt_price, get_current_btc_price, force_price_update, get_source_health
 
 api_bp = Blueprint("api_bp", __name__, url_prefix="/api")
 
 # Simple in-memory cache for API responses
 _api_cache: Dict[str, Dict[str, Any]] = {}
 CACHE_DURATION = 30  # seconds
+WALLET_BALANCE_TTL = 60  # seconds; the wallet_balances job refreshes the entry just before it expires
 
 def cached_response(cache_key: str, duration: int = CACHE_DURATION):
     """Decorator for caching API responses."""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            # Filtered requests (e.g. ?wallet_id=) are not cached under the shared key
+            if request.args:
+                return func(*args, **kwargs)
             now = time.time()
             if cache_key in _api_cache:
                 cached_data, timestamp = _api_cache[cache_key]
@@ -49,51 +71,63 @@ def handle_api_errors(func):
     return wrapper
 
 
+def _read_wallet_addresses(cur) -> Dict[str, str]:
+    cur.execute("""
+        SELECT key, value FROM settings 
+        WHERE key IN ('btc_wallet_address', 'usdt_wallet_address')
+    """)
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def _wallet_balance_payload(settings: Dict[str, str], max_age: float = WALLET_BALANCE_TTL) -> Dict[str, Any]:
+    """On-chain balances for the configured addresses (shares the /wallet_balance cache entry)."""
+    now = time.time()
+    cached = _api_cache.get("wallet_balance")
+    if cached and now - cached[1] < max_age:
+        return cached[0]
+
+    btc_address = settings.get('btc_wallet_address')
+    usdt_address = settings.get('usdt_wallet_address')
+    
+    # If no addresses are configured
+    if not btc_address and not usdt_address:
+        return {
+            "btc_balance": 0,
+            "usdt_balance": 0,
+            "error": "آدرس کیف پول‌ها تنظیم نشده است"
+        }
+    
+    btc_balance = _fetch_btc_balance(btc_address) if btc_address else 0
+    usdt_balance = _fetch_usdt_balance(usdt_address) if usdt_address else 0
+    
+    payload = {
+        "btc_balance": btc_balance,
+        "usdt_balance": usdt_balance,
+        "btc_address": btc_address,
+        "usdt_address": usdt_address,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    _api_cache["wallet_balance"] = (payload, now)
+    return payload
+
+
 @api_bp.get("/wallet_balance")
-@cached_response("wallet_balance", 60)  # Cache for 1 minute
+@cached_response("wallet_balance", WALLET_BALANCE_TTL)  # Cache for 1 minute
 @handle_api_errors
 def get_wallet_balance():
     """Get wallet balances for BTC and USDT addresses."""
     with get_db_context() as conn:
-        cur = conn.cursor()
-        
-        # Get wallet addresses in a single query
-        cur.execute("""
-            SELECT key, value FROM settings 
-            WHERE key IN ('btc_wallet_address', 'usdt_wallet_address')
-        """)
-        settings = {row[0]: row[1] for row in cur.fetchall()}
-        
-        btc_address = settings.get('btc_wallet_address')
-        usdt_address = settings.get('usdt_wallet_address')
-        
-        # If no addresses are configured
-        if not btc_address and not usdt_address:
-            return jsonify({
-                "btc_balance": 0,
-                "usdt_balance": 0,
-                "error": "آدرس کیف پول‌ها تنظیم نشده است"
-            })
-        
-        # Fetch balances concurrently
-        btc_balance = _fetch_btc_balance(btc_address) if btc_address else 0
-        usdt_balance = _fetch_usdt_balance(usdt_address) if usdt_address else 0
-        
-        return jsonify({
-            "btc_balance": btc_balance,
-            "usdt_balance": usdt_balance,
-            "btc_address": btc_address,
-            "usdt_address": usdt_address,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        settings = _read_wallet_addresses(conn.cursor())
+    return jsonify(_wallet_balance_payload(settings))
 
 def _fetch_btc_balance(address: str) -> float:
     """Fetch BTC balance from BlockCypher API."""
     try:
-        response = requests.get(
-            f'https://api.blockcypher.com/v1/btc/main/addrs/{address}/balance',
-            timeout=10
-        )
+        with track_outbound("blockcypher"):
+            response = requests.get(
+                f'https://api.blockcypher.com/v1/btc/main/addrs/{address}/balance',
+                timeout=10
+            )
         if response.status_code == 200:
             data = response.json()
             return data.get('balance', 0) / 100000000  # Convert satoshi to BTC
@@ -104,10 +138,11 @@ def _fetch_btc_balance(address: str) -> float:
 def _fetch_usdt_balance(address: str) -> float:
     """Fetch USDT balance from Covalent API."""
     try:
-        response = requests.get(
-            f'https://api.covalenthq.com/v1/1/address/{address}/balances_v2/?key=ckey_demo',
-            timeout=10
-        )
+        with track_outbound("covalent"):
+            response = requests.get(
+                f'https://api.covalenthq.com/v1/1/address/{address}/balances_v2/?key=ckey_demo',
+                timeout=10
+            )
         if response.status_code == 200:
             data = response.json()
             if data.get('data') and data['data'].get('items'):
@@ -119,21 +154,16 @@ def _fetch_usdt_balance(address: str) -> float:
     return 0.0
 
 
-@api_bp.get("/price")
-@cached_response("price_data", 30)  # Cache for 30 seconds
-@handle_api_errors
-def get_prices():
-    """Get current cryptocurrency prices from simplified fetcher."""
+def _price_payload(price_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Price snapshot in the shape served by /api/price."""
     try:
-        # Get prices from simplified fetcher
-        price_info = get_price_info()
         usdt_toman = price_info.get("usdt_price", 60000)
         btc_usd = price_info.get("btc_price", 50000)
         
         # Calculate BTC to Toman (BTC_USD * USDT_Toman)
         btc_toman = btc_usd * usdt_toman if btc_usd and usdt_toman else 0
         
-        return jsonify({
+        return {
             "btc_usd": btc_usd,
             "usdt_toman": usdt_toman,
             "btc_toman": btc_toman,
@@ -142,10 +172,10 @@ def get_prices():
             "source": price_info.get("source", "unknown"),
             "updated_at": price_info.get("updated_at"),
             "cache_valid": price_info.get("cache_valid", False)
-        })
+        }
     except Exception as e:
         # Fallback prices
-        return jsonify({
+        return {
             "btc_usd": 50000,
             "usdt_toman": 60000,
             "btc_toman": 3000000000,
@@ -153,7 +183,15 @@ def get_prices():
             "timestamp": datetime.utcnow().isoformat(),
             "source": "fallback",
             "error": str(e)
-        })
+        }
+
+
+@api_bp.get("/price")
+@cached_response("price_data", 30)  # Cache for 30 seconds
+@handle_api_errors
+def get_prices():
+    """Get current cryptocurrency prices from simplified fetcher."""
+    return jsonify(_price_payload(get_price_info()))
 
 @api_bp.get("/usdt-price")
 @cached_response("usdt_price", 15)  # Cache for 15 seconds
@@ -199,8 +237,9 @@ def get_btc_price():
 @cached_response("api_health", 30)  # Cache for 30 seconds
 @handle_api_errors
 def get_api_health_status():
-	"""Get health status of price fetcher."""
+	"""Get health status of price fetcher and of every upstream price source."""
 	price_info = get_price_info()
+	health = get_source_health()
 	
 	return jsonify({
 		"usdt_available": price_info.get("usdt_price") is not None,
@@ -208,6 +247,9 @@ def get_api_health_status():
 		"source": price_info.get("source", "unknown"),
 		"last_error": price_info.get("last_error"),
 		"cache_valid": price_info.get("cache_valid", False),
+		"apis": health["apis"],
+		"best_api": health["best"].get("usdt"),
+		"best_btc_api": health["best"].get("btc"),
 		"timestamp": datetime.utcnow().isoformat()
 	})
 
@@ -237,45 +279,80 @@ def force_update_prices():
 
 
 
-def _get_usd_to_toman(conn) -> float:
-    """Get USD to Toman rate from simplified fetcher, fallback to settings."""
-    # First try to get from simplified fetcher
-    usdt_price = get_current_usdt_price()
-    if usdt_price and usdt_price > 0:
-        return usdt_price * 10  # Convert USDT to USD rate
-    
-    # Fallback to database settings
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key='usd_to_toman'")
-    row = cur.fetchone()
-    return float(row[0]) if row else 60000.0
+def _get_usd_to_toman(conn, settings: Optional[Dict[str, str]] = None) -> float:
+    """Toman per USD (fx.toman_per_usd): the USDT rate, else the usd_to_toman setting."""
+    return toman_per_usd(conn, settings)
+
+
+def _trade_json(t) -> Dict[str, Any]:
+    """Integer ledger amounts (sat / micro-USD) as the API's BTC / USD numbers."""
+    return {
+        "id": t["id"],
+        "created_at": t["created_at"],
+        "amount_btc": money.btc(t["amount_sat"]),
+        "price_usd_per_btc": money.usd(t["price_micro"]),
+        "amount_usd": money.usd(t["cost_micro"]),
+    }
+
+
+def _with_toman_at_trade(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add the USDT/Toman rate at each trade's own time and its Toman value (fx.py)."""
+    current = toman_per_usd()
+    for item, rate in zip(items, rates_at(i["created_at"] for i in items)):
+        rate = rate or current
+        item["usdt_toman_at_trade"] = rate
+        item["amount_toman_at_trade"] = item["amount_usd"] * rate if rate else None
+    return items
+
+
+def _parse_trade(payload: Dict[str, Any]):
+    """(amount_sat, price_micro, cost_micro) from a JSON body, or an error response."""
+    try:
+        amount_sat, price_micro, cost = money.trade_values(payload.get("amount_btc", 0), payload.get("price_usd_per_btc", 0))
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "invalid payload"}), 400)
+    if amount_sat <= 0 or price_micro <= 0:
+        return None, (jsonify({"error": "amount_btc and price_usd_per_btc must be > 0"}), 400)
+    return (amount_sat, price_micro, cost), None
+
+
+def _request_filter() -> Dict[str, Optional[int]]:
+    """?wallet_id= / ?from= / ?to= of list and summary endpoints (ValueError for bad dates)."""
+    return ledger_filter(request.args.get("wallet_id", type=int), request.args.get("from"), request.args.get("to"))
+
+
+def _trades_as_of(table: str, filters: Dict[str, Optional[int]]):
+    """Purchases/withdrawals list as recorded at ?as_of= (rebuilt from the ledger event log)."""
+    try:
+        ledger = ledger_as_of(request.args["as_of"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = sorted((t for t in ledger[table] if in_filter(filters, t)), key=lambda t: t["id"], reverse=True)
+    return jsonify(_with_toman_at_trade([_trade_json(t) for t in rows]))
 
 
 @api_bp.get("/purchases")
 @cached_response("purchases_list", 10)  # Cache for 10 seconds
 @handle_api_errors
 def list_purchases():
-    """Get list of all purchases."""
+    """Get list of all purchases (?wallet_id= / ?from= / ?to= filters)."""
+    try:
+        filters = _request_filter()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get("as_of"):
+        return _trades_as_of("purchases", filters)
+    where, params = filter_sql(filters)
     with get_db_context() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, created_at, amount_btc, price_usd_per_btc 
+        cur.execute(f"""
+            SELECT id, created_at, amount_sat, price_micro, cost_micro 
             FROM purchases 
+            WHERE 1{where}
             ORDER BY id DESC
-        """)
+        """, params)
         rows = cur.fetchall()
-        
-        purchases = []
-        for r in rows:
-            amount_usd = float(r["amount_btc"]) * float(r["price_usd_per_btc"])
-            purchases.append({
-                "id": r["id"],
-                "created_at": r["created_at"],
-                "amount_btc": float(r["amount_btc"]),
-                "price_usd_per_btc": float(r["price_usd_per_btc"]),
-                "amount_usd": amount_usd,
-            })
-        return jsonify(purchases)
+        return jsonify(_with_toman_at_trade([_trade_json(r) for r in rows]))
 
 
 @api_bp.post("/purchases")
@@ -283,36 +360,25 @@ def list_purchases():
 def create_purchase():
     """Create a new purchase record."""
     payload = request.get_json(silent=True) or {}
-    
-    try:
-        amount_btc = float(payload.get("amount_btc", 0))
-        price_usd_per_btc = float(payload.get("price_usd_per_btc", 0))
-    except (TypeError, ValueError):
-        return jsonify({"error": "invalid payload"}), 400
-
-    if amount_btc <= 0 or price_usd_per_btc <= 0:
-        return jsonify({"error": "amount_btc and price_usd_per_btc must be > 0"}), 400
+    values, error = _parse_trade(payload)
+    if error:
+        return error
 
     with get_db_context() as conn:
         cur = conn.cursor()
         created_at = datetime.utcnow().isoformat(timespec="seconds")
         cur.execute(
-            "INSERT INTO purchases(created_at, amount_btc, price_usd_per_btc) VALUES(?,?,?)",
-            (created_at, amount_btc, price_usd_per_btc),
+            "INSERT INTO purchases(created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro) VALUES(?,?,?,?,?,?)",
+            (created_at, money.btc(values[0]), money.usd(values[1]), *values),
         )
         new_id = cur.lastrowid
         conn.commit()
         
         # Clear cache
         _api_cache.pop("purchases_list", None)
+        refresh_rollups_quietly()
         
-        return jsonify({
-            "id": new_id,
-            "created_at": created_at,
-            "amount_btc": amount_btc,
-            "price_usd_per_btc": price_usd_per_btc,
-            "amount_usd": amount_btc * price_usd_per_btc,
-        }), 201
+        return jsonify(_trade_json({"id": new_id, "created_at": created_at, "amount_sat": values[0], "price_micro": values[1], "cost_micro": values[2]})), 201
 
 
 @api_bp.delete("/purchases/<int:purchase_id>")
@@ -325,15 +391,21 @@ def delete_purchase(purchase_id: int):
 	conn.close()
 	if deleted == 0:
 		return jsonify({"error": "not found"}), 404
+	refresh_rollups_quietly()
 	return jsonify({"ok": True})
 
 
 @api_bp.get("/totals")
 def totals():
+	try:
+		filters = _request_filter()
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
+	where, params = filter_sql(filters)
 	conn = get_db_connection()
 	cur = conn.cursor()
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM purchases")
-	total_usd = float(cur.fetchone()[0] or 0)
+	cur.execute(f"SELECT COALESCE(SUM(cost_micro), 0) FROM purchases WHERE 1{where}", params)
+	total_usd = money.usd(cur.fetchone()[0] or 0)
 	usd_to_toman = _get_usd_to_toman(conn)
 	total_toman = total_usd * usd_to_toman
 	conn.close()
@@ -359,9 +431,10 @@ def set_rate():
 		return jsonify({"error": "usd_to_toman must be > 0"}), 400
 	conn = get_db_connection()
 	cur = conn.cursor()
+	# Stored in Rial per USD, like the rates written before (fx.toman_per_usd converts it back)
 	cur.execute(
 		"INSERT INTO settings(key, value) VALUES('usd_to_toman', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-		(str(new_rate),),
+		(str(money.to_rial(new_rate)),),
 	)
 	conn.commit()
 	conn.close()
@@ -393,8 +466,9 @@ def _fetch_json(url: str):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36",
         "Accept": "application/json",
     })
-    with urllib.request.urlopen(req, timeout=6) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    with track_outbound(urllib.parse.urlsplit(url).hostname or "unknown"):
+        with urllib.request.urlopen(req, timeout=6) as resp:
+            return json.loads(resp.read().decode("utf-8"))
 
 
 @api_bp.get("/price/btcusd")
@@ -456,53 +530,40 @@ def add_cors_headers(resp):
 
 @api_bp.get("/withdrawals")
 def list_withdrawals():
+    try:
+        filters = _request_filter()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get("as_of"):
+        return _trades_as_of("withdrawals", filters)
+    where, params = filter_sql(filters)
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY id DESC")
+    cur.execute(f"SELECT id, created_at, amount_sat, price_micro, cost_micro FROM withdrawals WHERE 1{where} ORDER BY id DESC", params)
     rows = cur.fetchall()
     conn.close()
-    withdrawals = []
-    for r in rows:
-        amount_usd = float(r["amount_btc"]) * float(r["price_usd_per_btc"])
-        withdrawals.append({
-            "id": r["id"],
-            "created_at": r["created_at"],
-            "amount_btc": float(r["amount_btc"]),
-            "price_usd_per_btc": float(r["price_usd_per_btc"]),
-            "amount_usd": amount_usd,
-        })
-    return jsonify(withdrawals)
+    return jsonify(_with_toman_at_trade([_trade_json(r) for r in rows]))
 
 
 @api_bp.post("/withdrawals")
 def create_withdrawal():
     payload = request.get_json(silent=True) or {}
-    try:
-        amount_btc = float(payload.get("amount_btc", 0))
-        price_usd_per_btc = float(payload.get("price_usd_per_btc", 0))
-    except (TypeError, ValueError):
-        return jsonify({"error": "invalid payload"}), 400
-
-    if amount_btc <= 0 or price_usd_per_btc <= 0:
-        return jsonify({"error": "amount_btc and price_usd_per_btc must be > 0"}), 400
+    values, error = _parse_trade(payload)
+    if error:
+        return error
 
     conn = get_db_connection()
     cur = conn.cursor()
     created_at = datetime.utcnow().isoformat(timespec="seconds")
     cur.execute(
-        "INSERT INTO withdrawals(created_at, amount_btc, price_usd_per_btc) VALUES(?,?,?)",
-        (created_at, amount_btc, price_usd_per_btc),
+        "INSERT INTO withdrawals(created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro) VALUES(?,?,?,?,?,?)",
+        (created_at, money.btc(values[0]), money.usd(values[1]), *values),
     )
     new_id = cur.lastrowid
     conn.commit()
     conn.close()
-    return jsonify({
-        "id": new_id,
-        "created_at": created_at,
-        "amount_btc": amount_btc,
-        "price_usd_per_btc": price_usd_per_btc,
-        "amount_usd": amount_btc * price_usd_per_btc,
-    }), 201
+    refresh_rollups_quietly()
+    return jsonify(_trade_json({"id": new_id, "created_at": created_at, "amount_sat": values[0], "price_micro": values[1], "cost_micro": values[2]})), 201
 
 
 @api_bp.delete("/withdrawals/<int:withdrawal_id>")
@@ -515,34 +576,406 @@ def delete_withdrawal(withdrawal_id: int):
     conn.close()
     if deleted == 0:
         return jsonify({"error": "not found"}), 404
+    refresh_rollups_quietly()
     return jsonify({"ok": True})
 
 
 @api_bp.get("/summary")
 def summary():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # Purchases totals
-    cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0), COALESCE(SUM(amount_btc), 0) FROM purchases")
-    row_p = cur.fetchone()
-    total_usd = float(row_p[0] or 0)
-    total_btc = float(row_p[1] or 0)
-    # Withdrawals totals
-    cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0), COALESCE(SUM(amount_btc), 0) FROM withdrawals")
-    row_w = cur.fetchone()
-    total_withdraw_usd = float(row_w[0] or 0)
-    total_withdraw_btc = float(row_w[1] or 0)
-    # Settings
-    usd_to_toman = _get_usd_to_toman(conn)
-    conn.close()
+    """Ledger totals; `?as_of=YYYY-MM-DD[THH:MM:SS]` gives them as recorded at that (UTC) time.
+
+    `?wallet_id=` and `?from=` / `?to=` limit the totals to one wallet and/or a date range.
+    All *_toman amounts are Toman: at `usd_to_toman` (Toman per USD now) or at each trade's own
+    rate (fx.py).
+    """
+    as_of = request.args.get("as_of")
+    try:
+        filters = _request_filter()
+        if as_of:
+            data = dashboard_data_as_of(as_of, filters=filters)
+        else:
+            data = load_dashboard_data(include_deposits=False, filters=filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    totals = data["totals"]
+    usd_to_toman = _get_usd_to_toman(None, data["settings"])
+    total_usd = totals["purchased_usd"]
+    total_withdraw_usd = totals["withdrawn_usd"]
+    extra = {"current_btc_balance": totals["current_btc_balance"], "ledger": data["ledger"]} if as_of else {}
+    if any(v is not None for v in filters.values()):
+        extra["filters"] = filters
+    # Each trade at the rate of its own time (current rate before the first known one)
+    deposit_toman = toman_at_trade(data["purchases"], usd_to_toman)
+    withdraw_toman = toman_at_trade(data["withdrawals"], usd_to_toman)
     return jsonify({
+        **extra,
         "total_deposit_usd": total_usd,
-        "total_deposit_btc": total_btc,
+        "total_deposit_btc": totals["purchased_btc"],
         "total_withdraw_usd": total_withdraw_usd,
-        "total_withdraw_btc": total_withdraw_btc,
+        "total_withdraw_btc": totals["withdrawn_btc"],
         "usd_to_toman": usd_to_toman,
         "total_deposit_toman": total_usd * usd_to_toman,
         "total_withdraw_toman": total_withdraw_usd * usd_to_toman,
+        "total_deposit_toman_at_trade": sum(v for v in deposit_toman if v is not None),
+        "total_withdraw_toman_at_trade": sum(v for v in withdraw_toman if v is not None),
         "net_invested_usd": max(0.0, total_usd - total_withdraw_usd),
     })
 
+
+DASHBOARD_SECTIONS = ("prices", "summary", "balances", "roi", "indicators", "cost_basis")
+
+
+def _summary_payload(data: Dict[str, Any], usd_to_toman: float) -> Dict[str, Any]:
+    totals = data["totals"]
+    return {
+        "total_deposit_usd": totals["purchased_usd"],
+        "total_deposit_btc": totals["purchased_btc"],
+        "total_withdraw_usd": totals["withdrawn_usd"],
+        "total_withdraw_btc": totals["withdrawn_btc"],
+        "total_usd_deposits": totals["usd_deposits"],
+        "total_usd_deposits_toman": totals["usd_deposits_toman"],
+        "current_btc_balance": totals["current_btc_balance"],
+        "net_invested_usd": totals["net_invested_usd"] + totals["usd_deposits"],
+        "purchases_count": totals["purchases_count"],
+        "withdrawals_count": totals["withdrawals_count"],
+        "inception_days": data["inception_days"],
+        "usd_to_toman": usd_to_toman,
+        "total_deposit_toman": totals["purchased_usd"] * usd_to_toman,
+        "total_withdraw_toman": totals["withdrawn_usd"] * usd_to_toman,
+    }
+
+
+@api_bp.get("/dashboard")
+@handle_api_errors
+def dashboard():
+    """Prices, ledger summary, on-chain balances and ROI in one read-consistent response.
+
+    `?fields=prices,summary` limits the response to the listed sections; `?wallet_id=` / `?from=` /
+    `?to=` filter the ledger behind summary and roi like /api/summary.
+    """
+    try:
+        filters = _request_filter()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fields_arg = request.args.get("fields")
+    if fields_arg:
+        fields = [f.strip() for f in fields_arg.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({"error": f"unknown fields: {', '.join(unknown)}", "allowed": list(DASHBOARD_SECTIONS)}), 400
+    else:
+        fields = list(DASHBOARD_SECTIONS)
+
+    # One price snapshot for every section
+    price_info = get_price_info()
+    result: Dict[str, Any] = {
+        "price_version": price_info.get("version", 0),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    if "prices" in fields:
+        result["prices"] = _price_payload(price_info)
+
+    if {"summary", "roi", "balances"} & set(fields):
+        # The whole ledger and settings come from one read transaction
+        data = load_dashboard_data(filters=filters)
+        summary_data = _summary_payload(data, _get_usd_to_toman(None, data["settings"]))
+        if "summary" in fields:
+            result["summary"] = summary_data
+        if "roi" in fields:
+            btc_price = float(price_info.get("btc_price") or 50000.0)
+            result["roi"] = {"btc_price_usd": btc_price, **roi(data, btc_price, summary_data["net_invested_usd"])}
+        if "balances" in fields:
+            # Upstream balance calls run after the read transaction is closed
+            result["balances"] = _wallet_balance_payload(data["settings"])
+    if "indicators" in fields:
+        result["indicators"] = get_indicators()
+    if "cost_basis" in fields:
+        # Every method at once (cached per data_version), so switching methods needs no new request
+        result["cost_basis"] = cost_basis(price_info.get("btc_price"))
+
+    return jsonify(result)
+
+
+@api_bp.get("/changes")
+@handle_api_errors
+def list_changes():
+    """Ledger changes after `?since=<version>`: upserts (columns + value arrays) and deleted ids.
+
+    `?tables=purchases,withdrawals` limits the tables, `?limit=` the number of rows per page
+    (keep calling with the returned `version` while `has_more` is true).
+    """
+    since = request.args.get("since", 0, type=int)
+    limit = max(1, min(request.args.get("limit", CHANGES_PAGE_SIZE, type=int), CHANGES_PAGE_SIZE))
+    tables_arg = request.args.get("tables")
+    tables = None
+    if tables_arg:
+        tables = [t.strip() for t in tables_arg.split(",") if t.strip()]
+        unknown = [t for t in tables if t not in SYNCED_TABLES]
+        if unknown or not tables:
+            return jsonify({"error": f"unknown tables: {', '.join(unknown)}", "allowed": list(SYNCED_TABLES)}), 400
+    return jsonify(changes_since(since, tables, limit))
+
+
+@api_bp.get("/search")
+@handle_api_errors
+def search():
+    """Full-text search: `?q=` over trade notes, wallet names/descriptions and goal names, best match first.
+
+    Filters: `?kinds=purchases,withdrawals,wallets,portfolio_goals`, `?from=` / `?to=` (dates),
+    `?min_btc=` / `?max_btc=` / `?min_usd=` / `?max_usd=` (trades only); paging with `?page=` and `?per_page=`.
+    """
+    args = request.args
+    kinds = [k.strip() for k in args.get("kinds", "").split(",") if k.strip()] or None
+    try:
+        result = search_ledger(
+            args.get("q", ""),
+            kinds=kinds,
+            date_from=args.get("from"),
+            date_to=args.get("to"),
+            min_btc=args.get("min_btc", type=float),
+            max_btc=args.get("max_btc", type=float),
+            min_usd=args.get("min_usd", type=float),
+            max_usd=args.get("max_usd", type=float),
+            page=args.get("page", 1, type=int),
+            per_page=args.get("per_page", 20, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+
+@api_bp.get("/ledger/<table>/<int:row_id>/history")
+@handle_api_errors
+def ledger_row_history(table: str, row_id: int):
+    """Every recorded version (create / correct / delete) of one purchases, withdrawals or usd_deposits row."""
+    if table not in LEDGER_EVENT_TABLES:
+        return jsonify({"error": "unknown table", "allowed": list(LEDGER_EVENT_TABLES)}), 400
+    return jsonify(row_history(table, row_id))
+
+
+@api_bp.get("/threshold_events")
+@handle_api_errors
+def list_threshold_events():
+    """Goal achievements and risk-limit alerts/breaches recorded by the evaluation engine, newest first."""
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    return jsonify(recent_events(limit))
+
+
+@api_bp.get("/alerts")
+@handle_api_errors
+def get_alerts():
+    """Price alerts, newest first (`?active=1` for the ones still armed)."""
+    with get_db_context() as conn:
+        return jsonify(list_alerts(conn, active_only=request.args.get("active") == "1"))
+
+
+@api_bp.post("/alerts")
+@handle_api_errors
+def create_price_alert():
+    """Create an alert: {symbol: btc_usd|usdt_toman, kind: above|below|move_up|move_down, threshold, window_seconds?, note?}.
+
+    For move_* kinds `threshold` is a percentage and `window_seconds` the look-back window.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        fields = validate_alert(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with get_db_context() as conn:
+        return jsonify(create_alert(fields, conn)), 201
+
+
+@api_bp.delete("/alerts/<int:alert_id>")
+def delete_price_alert(alert_id: int):
+	conn = get_db_connection()
+	cur = conn.cursor()
+	cur.execute("DELETE FROM price_alerts WHERE id = ?", (alert_id,))
+	deleted = cur.rowcount
+	conn.commit()
+	conn.close()
+	if deleted == 0:
+		return jsonify({"error": "not found"}), 404
+	return jsonify({"ok": True})
+
+
+@api_bp.get("/alerts/outbox")
+@handle_api_errors
+def get_alert_outbox():
+    """Fired alerts waiting for delivery (`?status=pending|sent|failed|all`, oldest pending first)."""
+    status = request.args.get("status", "pending")
+    if status != "all" and status not in OUTBOX_STATUSES:
+        return jsonify({"error": f"status must be one of {', '.join(OUTBOX_STATUSES)}, all"}), 400
+    limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+    with get_db_context() as conn:
+        return jsonify(list_outbox(conn, None if status == "all" else status, limit))
+
+
+@api_bp.post("/alerts/outbox/<int:outbox_id>/ack")
+@handle_api_errors
+def ack_alert_outbox(outbox_id: int):
+    """Report a delivery attempt: {"delivered": true} or {"delivered": false, "error": "..."}."""
+    payload = request.get_json(silent=True) or {}
+    with get_db_context() as conn:
+        if not mark_outbox(conn, outbox_id, bool(payload.get("delivered", True)), payload.get("error")):
+            return jsonify({"error": "not found"}), 404
+    return jsonify({"ok": True})
+
+
+@api_bp.get("/indicators")
+@handle_api_errors
+def indicators():
+    """SMA/EMA, realized volatility and drawdown of the BTC price and the portfolio value.
+
+    Values come from the engine's last checkpoint (updated every bar), never from raw history.
+    """
+    return jsonify(get_indicators())
+
+
+@api_bp.get("/equity-curve")
+@handle_api_errors
+def get_equity_curve():
+    """Stored NAV points: `?period=day|hour`, `?wallet_id=` (0 = whole portfolio, default),
+    `?from=` / `?to=` as YYYY-MM-DD (or YYYY-MM-DDTHH for hourly points), `?limit=` latest points.
+    """
+    period = request.args.get("period", "day")
+    if period not in NAV_PERIODS:
+        return jsonify({"error": f"period must be one of {', '.join(NAV_PERIODS)}"}), 400
+    start, end = request.args.get("from"), request.args.get("to")
+    for value in (start, end):
+        if value:
+            try:
+                datetime.fromisoformat(value if len(value) != 13 else value + ":00")
+            except ValueError:
+                return jsonify({"error": f"invalid date: {value}"}), 400
+    wallet_id = request.args.get("wallet_id", TOTAL_WALLET_ID, type=int)
+    limit = max(1, min(request.args.get("limit", 1000, type=int), 5000))
+    return jsonify(equity_curve(period, wallet_id, start, end, limit))
+
+
+def _projection_options() -> Dict[str, Any]:
+    """Monte Carlo options from the query string (ValueError on bad input)."""
+    args = request.args
+    model = args.get("model", "gbm")
+    if model not in PROJECTION_MODELS:
+        raise ValueError(f"model must be one of {', '.join(PROJECTION_MODELS)}")
+    paths = int(args.get("paths", 10000))
+    if not 100 <= paths <= MAX_PATHS:
+        raise ValueError(f"paths must be between 100 and {MAX_PATHS}")
+    buy_usd = float(args.get("buy_usd", 0))
+    buy_every_days = int(args.get("buy_every_days", 0))
+    if buy_usd < 0 or buy_every_days < 0:
+        raise ValueError("buy_usd and buy_every_days must be >= 0")
+    volatility = args.get("volatility")
+    seed = args.get("seed")
+    return {
+        "model": model,
+        "paths": paths,
+        "buy_usd": buy_usd,
+        "buy_every_days": buy_every_days,
+        # percentages in the query string, fractions in the simulator
+        "drift": float(args.get("drift", 0)) / 100,
+        "volatility": float(volatility) / 100 if volatility else None,
+        "seed": int(seed) if seed else None,
+    }
+
+
+@api_bp.get("/goals/projection")
+@handle_api_errors
+def goals_projection():
+    """Monte Carlo projection of every goal (or `?ids=1,2`).
+
+    `?model=gbm|bootstrap`, `?paths=`, `?buy_usd=&buy_every_days=` (recurring buy plan),
+    `?drift=` / `?volatility=` annual %, `?seed=`.
+    """
+    try:
+        options = _projection_options()
+        ids = [int(i) for i in request.args["ids"].split(",") if i.strip()] if request.args.get("ids") else None
+        results = project_goals(ids, **options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(results)
+
+
+@api_bp.get("/goals/<int:goal_id>/projection")
+@handle_api_errors
+def goal_projection(goal_id: int):
+    """Monte Carlo projection of one goal (same options as /goals/projection)."""
+    try:
+        options = _projection_options()
+        results = project_goals([goal_id], **options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not results:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(results[0])
+
+
+@api_bp.get("/reports/pnl")
+@handle_api_errors
+def pnl_rollup_report():
+    """Realized P&L, volumes and USD deposits per period from the stored rollups.
+
+    `?calendar=jalali|gregorian` (default jalali), `?period=month|year`,
+    `?from=` / `?to=` bucket keys (e.g. 1405-01 or 2026-03 for months, 1405 for years).
+    """
+    calendar = request.args.get("calendar", "jalali")
+    period = request.args.get("period", "month")
+    if calendar not in CALENDARS or period not in ROLLUP_PERIODS:
+        return jsonify({"error": f"calendar must be one of {', '.join(CALENDARS)} and period one of {', '.join(ROLLUP_PERIODS)}"}), 400
+    return jsonify(pnl_report(calendar, period, request.args.get("from"), request.args.get("to")))
+
+
+@api_bp.get("/cost-basis")
+@handle_api_errors
+def get_cost_basis():
+    """FIFO, LIFO, HIFO and average-cost P&L side by side.
+
+    `?wallet_id=` for one wallet (default: whole portfolio), `?method=` to override the selected method.
+    """
+    try:
+        return jsonify(cost_basis(get_current_btc_price(), request.args.get("method"), request.args.get("wallet_id", type=int)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api_bp.post("/wallets/<int:wallet_id>/cost-basis-method")
+@handle_api_errors
+def update_wallet_cost_basis_method(wallet_id: int):
+    """Set a wallet's default cost-basis method: {"method": "fifo|lifo|hifo|average"}."""
+    payload = request.get_json(silent=True) or {}
+    try:
+        updated = set_wallet_method(wallet_id, str(payload.get("method", "")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not updated:
+        return jsonify({"error": "not found"}), 404
+    return jsonify({"ok": True, "wallet_id": wallet_id, "method": payload["method"]})
+
+
+@api_bp.post("/what-if")
+@handle_api_errors
+def what_if():
+    """Preview hypothetical trades against the current open lots (nothing is written).
+
+    Body: {"method": "fifo|lifo|hifo|average" (default: the wallet's / fifo), "wallet_id"?,
+    "scenarios": [{"trades": [{"side": "sell", "amount_btc": 0.1, "price_usd": 70000}], "mark_price_usd"?}],
+    "grid": {"amounts_btc": [...], "prices_usd": [...]}}  (one withdrawal per cell, for heat maps)
+    """
+    payload = request.get_json(silent=True) or {}
+    wallet_id = payload.get("wallet_id")
+    try:
+        wallet_id = int(wallet_id) if wallet_id is not None else None
+        method = payload.get("method") or cost_basis(None, wallet_id=wallet_id)["selected"]
+        if method not in COST_BASIS_METHODS:
+            raise ValueError(f"method must be one of {', '.join(COST_BASIS_METHODS)}")
+        if not payload.get("scenarios") and not payload.get("grid"):
+            raise ValueError("scenarios or grid required")
+        result: Dict[str, Any] = {"method": method, "wallet_id": wallet_id}
+        if payload.get("scenarios"):
+            result["scenarios"] = run_scenarios(method, wallet_id, list(payload["scenarios"]), get_current_btc_price())
+        if payload.get("grid"):
+            grid = payload["grid"]
+            result["grid"] = withdrawal_grid(method, wallet_id, list(grid.get("amounts_btc") or []), list(grid.get("prices_usd") or []))
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
@@ -14,8 +14,8 @@ def _is_logged_in() -> bool:
 
 @auth_bp.before_app_request
 def enforce_login():  # type: ignore[override]
-    # Allow static, auth, and health routes without login
-    if request.endpoint in ("auth_bp.login", "auth_bp.login_post", "auth_bp.logout", "panel_bp.healthz"):
+    # Allow static, auth, and health routes without login (/metrics checks its own token)
+    if request.endpoint in ("auth_bp.login", "auth_bp.login_post", "auth_bp.logout", "panel_bp.healthz", "metrics", "assets", "service_worker"):
         return None
     if request.endpoint and request.endpoint.startswith("static"):
         return None
@@ -1,14 +1,26 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from datetime import datetime
 from typing import Dict, List, Tuple, Any
 import requests
 from functools import lru_cache
 
-from db import get_db_connection, get_db_context
-from price_fetcher import get_current_usdt_price, get_current_btc_price
+from db import get_db_connection, record_reset
+from price_fetcher import get_current_btc_price
+from metrics import track_outbound
+from dashboard_data import load_dashboard_data, latest, transactions, roi
+from render_cache import render_page
+from scheduler import scheduler
+from evaluation import evaluate
+from fx import toman_at_trade, toman_per_usd
+from rollups import refresh_rollups_quietly
+from lots import COST_BASIS_METHODS
+from money import btc, to_micro, to_rial, trade_values, usd
 
 panel_bp = Blueprint("panel_bp", __name__)
 
+# Pages that embed a live BTC price fetched at render time are only cached briefly
+LIVE_PRICE_TTL = 30
+
 
 def _to_float(txt: str) -> float:
 	"""Parse user input numbers with Persian digits and separators to float."""
@@ -66,26 +78,9 @@ def _sanitize_string(text: str) -> str:
 		text = text.replace(char, '')
 	return text.strip()
 
-@lru_cache(maxsize=1)
-def _get_usd_to_toman_cached() -> float:
-    """Get USD to Toman rate with caching."""
-    # Get USDT price and convert to USD rate
-    usdt_price = get_current_usdt_price()
-    if usdt_price and usdt_price > 0:
-        # Convert USDT price to USD rate (USDT price is in Toman, USD rate should be in IRT)
-        # So we multiply by 10 to convert from Toman to IRT
-        return usdt_price * 10
-    
-    # Fallback to database settings
-    with get_db_context() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key='usd_to_toman'")
-        row = cur.fetchone()
-        return float(row[0]) if row else 600000.0
-
 def _get_usd_to_toman(conn) -> float:
-    """Get USD to Toman rate from USDT price (divide by 10)"""
-    return _get_usd_to_toman_cached()
+    """Toman per USD (fx.toman_per_usd): the USDT rate, else the usd_to_toman setting."""
+    return toman_per_usd(conn)
 
 @lru_cache(maxsize=1)
 def _get_current_btc_price() -> float:
@@ -93,195 +88,52 @@ def _get_current_btc_price() -> float:
     btc_price = get_current_btc_price()
     return btc_price if btc_price else 50000.0  # Default fallback
 
-def _calculate_roi_optimized(purchases: List[Tuple], withdrawals: List[Tuple], current_btc_price: float) -> Tuple[float, float]:
-    """Optimized ROI calculation using FIFO method."""
-    if not purchases:
-        return 0.0, 0.0
-    
-    # Convert to lists for easier manipulation
-    purchase_queue = [(p[0], p[1], float(p[2]), float(p[3])) for p in purchases]
-    withdrawal_queue = [(w[0], w[1], float(w[2]), float(w[3])) for w in withdrawals]
-    
-    closed_trades_profit = 0.0
-    open_trades_cost = 0.0
-    open_trades_value = 0.0
-    
-    # Process withdrawals (closed trades)
-    for withdrawal in withdrawal_queue:
-        remaining_withdrawal = withdrawal[2]
-        withdrawal_price = withdrawal[3]
-        
-        while remaining_withdrawal > 1e-12 and purchase_queue:
-            purchase = purchase_queue[0]
-            purchase_amount = purchase[2]
-            purchase_price = purchase[3]
-            
-            # Amount traded in this transaction
-            trade_amount = min(remaining_withdrawal, purchase_amount)
-            
-            # Calculate profit/loss for this trade
-            buy_cost = trade_amount * purchase_price
-            sell_value = trade_amount * withdrawal_price
-            trade_profit = sell_value - buy_cost
-            closed_trades_profit += trade_profit
-            
-            # Update remaining amounts
-            remaining_withdrawal -= trade_amount
-            purchase_queue[0] = (purchase[0], purchase[1], purchase[2] - trade_amount, purchase[3])
-            
-            # Remove fully consumed purchase
-            if purchase_queue[0][2] <= 1e-12:
-                purchase_queue.pop(0)
-    
-    # Calculate open trades (remaining purchases)
-    for purchase in purchase_queue:
-        purchase_amount = purchase[2]
-        purchase_price = purchase[3]
-        open_trades_cost += purchase_amount * purchase_price
-        open_trades_value += purchase_amount * current_btc_price
-    
-    open_trades_profit = open_trades_value - open_trades_cost
-    total_profit_loss = closed_trades_profit + open_trades_profit
-    
-    return total_profit_loss, open_trades_value
-
-@panel_bp.get("/panel")
-def panel_index():
-	conn = get_db_connection()
-	cur = conn.cursor()
-	
-	# دریافت آخرین تراکنش‌ها
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM purchases ORDER BY id DESC LIMIT 5")
-	purchases = cur.fetchall()
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY id DESC LIMIT 5")
-	withdrawals = cur.fetchall()
-	
-	# محاسبه آمار کلی BTC
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM purchases")
-	total_purchased_usd = float(cur.fetchone()[0] or 0)
-	cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM purchases")
-	total_purchased_btc = float(cur.fetchone()[0] or 0)
-	
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM withdrawals")
-	total_withdrawn_usd = float(cur.fetchone()[0] or 0)
-	cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM withdrawals")
-	total_withdrawn_btc = float(cur.fetchone()[0] or 0)
-	
-	# محاسبه آمار واریزهای دلاری
-	cur.execute("SELECT COALESCE(SUM(amount_usd), 0) FROM usd_deposits")
-	total_usd_deposits = float(cur.fetchone()[0] or 0)
-	
-	cur.execute("SELECT COALESCE(SUM(amount_toman), 0) FROM usd_deposits")
-	total_usd_toman = float(cur.fetchone()[0] or 0)
-	
-	# محاسبه موجودی فعلی
-	current_btc_balance = total_purchased_btc - total_withdrawn_btc
-	net_invested_usd = total_purchased_usd - total_withdrawn_usd + total_usd_deposits
-	
-	# نرخ تبدیل از async fetcher
-	usd_to_toman = _get_usd_to_toman(conn)
-	
-	# محاسبه ROI دقیق با در نظر گیری معاملات بسته و باز
-	roi_percentage = 0
-	profit_loss_usd = 0
-	
-	# دریافت قیمت فعلی BTC از API
-	current_btc_price = 50000  # Default
+def _fetch_live_btc_price() -> float:
+	"""Current BTC/USDT price from Nobitex (3s timeout), falling back to a default."""
+	current_btc_price = 50000.0  # Default
 	try:
-		response = requests.post('https://api.nobitex.ir/market/stats', json={"srcCurrency": "btc", "dstCurrency": "usdt"}, timeout=3)
+		with track_outbound("nobitex"):
+			response = requests.post('https://api.nobitex.ir/market/stats', json={"srcCurrency": "btc", "dstCurrency": "usdt"}, timeout=3)
 		if response.status_code == 200:
 			data = response.json()["stats"]["btc-usdt"]
 			current_btc_price = float(data["latest"])
 	except Exception:
 		pass
+	return current_btc_price
+
+@panel_bp.get("/panel")
+def panel_index():
+	return render_page("panel.html", _panel_context, ttl=LIVE_PRICE_TTL)
+
+
+def _panel_context():
+	data = load_dashboard_data()
+	totals = data["totals"]
 	
-	# محاسبه سود/زیان از معاملات بسته (FIFO)
-	closed_trades_profit = 0
-	purchases_list = []
-	withdrawals_list = []
-	
-	# دریافت تمام خریدها و برداشت‌ها
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM purchases ORDER BY created_at ASC")
-	purchases_list = cur.fetchall()
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY created_at ASC")
-	withdrawals_list = cur.fetchall()
-	
-	# محاسبه معاملات بسته با FIFO
-	purchase_queue = [(p[0], p[1], float(p[2]), float(p[3])) for p in purchases_list]
-	withdrawal_queue = [(w[0], w[1], float(w[2]), float(w[3])) for w in withdrawals_list]
-	
-	for withdrawal in withdrawal_queue:
-		remaining_withdrawal = withdrawal[2]
-		withdrawal_price = withdrawal[3]
-		
-		while remaining_withdrawal > 1e-12 and purchase_queue:
-			purchase = purchase_queue[0]
-			purchase_amount = purchase[2]
-			purchase_price = purchase[3]
-			
-			# مقدار معامله شده
-			trade_amount = min(remaining_withdrawal, purchase_amount)
-			
-			# محاسبه سود/زیان این معامله
-			buy_cost = trade_amount * purchase_price
-			sell_value = trade_amount * withdrawal_price
-			trade_profit = sell_value - buy_cost
-			closed_trades_profit += trade_profit
-			
-			# کاهش از صف‌ها
-			remaining_withdrawal -= trade_amount
-			purchase_queue[0] = (purchase[0], purchase[1], purchase[2] - trade_amount, purchase[3])
-			
-			# اگر خرید تمام شد، از صف حذف کن
-			if purchase_queue[0][2] <= 1e-12:
-				purchase_queue.pop(0)
-	
-	# محاسبه ارزش معاملات باز (موجودی فعلی)
-	open_trades_value = 0
-	open_trades_cost = 0
-	for purchase in purchase_queue:
-		open_trades_cost += purchase[2] * purchase[3]
-		open_trades_value += purchase[2] * current_btc_price
-	
-	open_trades_profit = open_trades_value - open_trades_cost
-	
-	# محاسبه کل سود/زیان
-	total_profit_loss = closed_trades_profit + open_trades_profit
-	
-	# محاسبه ROI
-	if net_invested_usd > 0:
-		roi_percentage = (total_profit_loss / net_invested_usd) * 100
-		profit_loss_usd = total_profit_loss
-	
-	# تاریخ شروع سرمایه‌گذاری
-	cur.execute("SELECT MIN(created_at) FROM purchases")
-	row_first = cur.fetchone()
-	inception_days = 0
-	try:
-		first_str = row_first[0] if row_first and row_first[0] else None
-		if first_str:
-			dt0 = datetime.fromisoformat(first_str)
-			inception_days = max(0, (datetime.utcnow() - dt0).days)
-	except Exception:
-		inception_days = 0
+	# محاسبه موجودی فعلی
+	net_invested_usd = totals["net_invested_usd"] + totals["usd_deposits"]
 	
-	conn.close()
-
-	return render_template(
-		"panel.html",
-		purchases=purchases,
-		withdrawals=withdrawals,
-		total_purchased_usd=total_purchased_usd,
-		total_purchased_btc=total_purchased_btc,
-		total_withdrawn_usd=total_withdrawn_usd,
-		total_withdrawn_btc=total_withdrawn_btc,
-		total_usd_deposits=total_usd_deposits,
-		total_usd_toman=total_usd_toman,
-		current_btc_balance=current_btc_balance,
+	# نرخ تبدیل از async fetcher
+	usd_to_toman = _get_usd_to_toman(None)
+	
+	# محاسبه ROI دقیق با در نظر گیری معاملات بسته و باز (FIFO)
+	result = roi(data, _fetch_live_btc_price(), net_invested_usd)
+	roi_percentage = result["roi_percentage"]
+
+	return dict(
+		purchases=latest(data["purchases"], 5),
+		withdrawals=latest(data["withdrawals"], 5),
+		total_purchased_usd=totals["purchased_usd"],
+		total_purchased_btc=totals["purchased_btc"],
+		total_withdrawn_usd=totals["withdrawn_usd"],
+		total_withdrawn_btc=totals["withdrawn_btc"],
+		total_usd_deposits=totals["usd_deposits"],
+		total_usd_toman=totals["usd_deposits_toman"],
+		current_btc_balance=totals["current_btc_balance"],
 		net_invested_usd=net_invested_usd,
 		usd_to_toman=usd_to_toman,
 		roi_percentage=roi_percentage,
-		inception_days=inception_days,
+		inception_days=data["inception_days"],
 	)
 
 
@@ -301,12 +153,19 @@ def panel_add():
 			flash("مقادیر باید بزرگ‌تر از صفر باشند.", "error")
 			return redirect(url_for("panel_bp.deposits_page"))
 
+		amount_sat, price_micro, cost_micro = trade_values(amount_btc, price_usd_per_btc)
+		if amount_sat <= 0 or price_micro <= 0:
+			flash("مقدار کمتر از یک ساتوشی است.", "error")
+			return redirect(url_for("panel_bp.deposits_page"))
+
 		conn = get_db_connection()
 		cur = conn.cursor()
-		cur.execute("INSERT INTO purchases(created_at, amount_btc, price_usd_per_btc, wallet_id, notes) VALUES(?,?,?,?,?)", 
-			(datetime.utcnow().isoformat(timespec="seconds"), amount_btc, price_usd_per_btc, wallet_id, notes))
+		cur.execute(
+			"INSERT INTO purchases(created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro, wallet_id, notes) VALUES(?,?,?,?,?,?,?,?)",
+			(datetime.utcnow().isoformat(timespec="seconds"), btc(amount_sat), usd(price_micro), amount_sat, price_micro, cost_micro, wallet_id, notes))
 		conn.commit()
 		conn.close()
+		refresh_rollups_quietly()
 		flash("خرید با موفقیت ثبت شد.", "success")
 		return redirect(url_for("panel_bp.deposits_page"))
 	except Exception as e:
@@ -331,12 +190,19 @@ def panel_withdraw():
 			flash("مقادیر باید بزرگ‌تر از صفر باشند.", "error")
 			return redirect(url_for("panel_bp.withdrawals_page"))
 
+		amount_sat, price_micro, cost_micro = trade_values(amount_btc, price_usd_per_btc)
+		if amount_sat <= 0 or price_micro <= 0:
+			flash("مقدار کمتر از یک ساتوشی است.", "error")
+			return redirect(url_for("panel_bp.withdrawals_page"))
+
 		conn = get_db_connection()
 		cur = conn.cursor()
-		cur.execute("INSERT INTO withdrawals(created_at, amount_btc, price_usd_per_btc, wallet_id, notes) VALUES(?,?,?,?,?)", 
-			(datetime.utcnow().isoformat(timespec="seconds"), amount_btc, price_usd_per_btc, wallet_id, notes))
+		cur.execute(
+			"INSERT INTO withdrawals(created_at, amount_btc, price_usd_per_btc, amount_sat, price_micro, cost_micro, wallet_id, notes) VALUES(?,?,?,?,?,?,?,?)",
+			(datetime.utcnow().isoformat(timespec="seconds"), btc(amount_sat), usd(price_micro), amount_sat, price_micro, cost_micro, wallet_id, notes))
 		conn.commit()
 		conn.close()
+		refresh_rollups_quietly()
 		flash("برداشت با موفقیت ثبت شد.", "success")
 		return redirect(url_for("panel_bp.withdrawals_page"))
 	except Exception as e:
@@ -363,10 +229,12 @@ def panel_usd_deposit():
 
 		conn = get_db_connection()
 		cur = conn.cursor()
-		cur.execute("INSERT INTO usd_deposits(created_at, amount_usd, price_toman_per_usd, amount_toman) VALUES(?,?,?,?)", 
-			(datetime.utcnow().isoformat(timespec="seconds"), amount_usd, price_toman_per_usd, amount_toman))
+		cur.execute(
+			"INSERT INTO usd_deposits(created_at, amount_usd, price_toman_per_usd, amount_toman, amount_usd_micro, amount_rial) VALUES(?,?,?,?,?,?)",
+			(datetime.utcnow().isoformat(timespec="seconds"), amount_usd, price_toman_per_usd, amount_toman, to_micro(amount_usd), to_rial(amount_toman)))
 		conn.commit()
 		conn.close()
+		refresh_rollups_quietly()
 		flash(f"واریز دلاری {amount_usd:,.0f} دلار ({amount_toman:,.0f} تومان) با موفقیت ثبت شد.", "success")
 		return redirect(url_for("panel_bp.deposits_page"))
 	except Exception as e:
@@ -382,6 +250,9 @@ def panel_create_wallet():
 		description = request.form.get("description", "").strip()
 		wallet_type = request.form.get("wallet_type", "main")
 		color = request.form.get("color", "#3b82f6")
+		cost_basis_method = request.form.get("cost_basis_method", "fifo")
+		if cost_basis_method not in COST_BASIS_METHODS:
+			cost_basis_method = "fifo"
 		
 		if not name:
 			flash("نام کیف پول الزامی است.", "error")
@@ -390,8 +261,8 @@ def panel_create_wallet():
 		conn = get_db_connection()
 		cur = conn.cursor()
 		cur.execute(
-			"INSERT INTO wallets(name, description, wallet_type, color, created_at) VALUES(?, ?, ?, ?, ?)",
-			(name, description, wallet_type, color, datetime.utcnow().isoformat(timespec="seconds"))
+			"INSERT INTO wallets(name, description, wallet_type, color, cost_basis_method, created_at) VALUES(?, ?, ?, ?, ?, ?)",
+			(name, description, wallet_type, color, cost_basis_method, datetime.utcnow().isoformat(timespec="seconds"))
 		)
 		conn.commit()
 		conn.close()
@@ -403,6 +274,14 @@ def panel_create_wallet():
 		return redirect(url_for("panel_bp.portfolio_page"))
 
 
+def _evaluate_quietly() -> None:
+	"""نتیجه اولیه هدف/محدودیت تازه؛ اگر نشد، کار goal_risk زمان‌بند آن را حساب می‌کند"""
+	try:
+		evaluate()
+	except Exception as e:
+		print("[evaluate] error:", e)
+
+
 @panel_bp.post("/panel/create_goal")
 def panel_create_goal():
 	try:
@@ -424,6 +303,7 @@ def panel_create_goal():
 		)
 		conn.commit()
 		conn.close()
+		_evaluate_quietly()
 		flash(f"هدف '{goal_name}' با موفقیت ایجاد شد.", "success")
 		return redirect(url_for("panel_bp.portfolio_page"))
 	except Exception as e:
@@ -452,6 +332,7 @@ def panel_create_risk_limit():
 		)
 		conn.commit()
 		conn.close()
+		_evaluate_quietly()
 		flash("محدودیت ریسک با موفقیت ایجاد شد.", "success")
 		return redirect(url_for("panel_bp.portfolio_page"))
 	except Exception as e:
@@ -502,6 +383,21 @@ def home():
 def healthz():
 	return "ok", 200
 
+@panel_bp.get("/admin/jobs")
+def admin_jobs():
+	"""وضعیت کارهای پس‌زمینه (از پروسه‌ای که زمان‌بند را اجرا می‌کند)"""
+	return jsonify(scheduler.status())
+
+@panel_bp.post("/admin/jobs/<name>/run")
+def admin_run_job(name: str):
+	"""اجرای فوری یک کار"""
+	if name not in scheduler.jobs:
+		return jsonify({"error": "unknown job"}), 404
+	if not scheduler.run_now(name):
+		status = scheduler.status()
+		return jsonify({"error": "job is running or owned by another process", "owner_pid": status.get("owner_pid")}), 409
+	return jsonify({"ok": True, "job": name}), 202
+
 @panel_bp.post("/reset_system")
 def panel_reset_system():
     """ریست کامل سیستم - حذف تمام داده‌ها"""
@@ -530,7 +426,10 @@ def panel_reset_system():
         # حذف تمام جداول
         tables = [
             'purchases', 'withdrawals', 'usd_deposits', 
-            'wallets', 'portfolio_goals', 'risk_limits', 'settings'
+            'wallets', 'portfolio_goals', 'risk_limits', 'settings',
+            'threshold_events', 'price_alerts', 'alert_outbox',
+            'nav_snapshots', 'nav_state', 'pnl_rollups', 'rollup_state',
+            'search_index'
         ]
         
         for table in tables:
@@ -540,6 +439,12 @@ def panel_reset_system():
             except Exception as e:
                 print(f"Error dropping table {table}: {e}")
         
+        # DROP does not fire delete triggers; tell sync clients to start over
+        try:
+            record_reset(cur)
+        except Exception as e:
+            print(f"Error recording reset in change_log: {e}")
+        
         conn.commit()
         conn.close()
         
@@ -557,14 +462,16 @@ def panel_reset_system():
 
 @panel_bp.get("/settings")
 def settings_page():
+	return render_page("settings.html", _settings_context)
+
+
+def _settings_context():
 	# Load current settings
 	conn = get_db_connection()
 	cur = conn.cursor()
 	
 	# نرخ تبدیل
-	cur.execute("SELECT value FROM settings WHERE key='usd_to_toman'")
-	row = cur.fetchone()
-	usd_to_toman = float(row[0]) if row else 60000.0
+	usd_to_toman = _get_usd_to_toman(conn)
 	
 	# آدرس کیف پول بیت‌کوین
 	cur.execute("SELECT value FROM settings WHERE key='btc_wallet_address'")
@@ -577,7 +484,7 @@ def settings_page():
 	usdt_wallet_address = row[0] if row else ""
 	
 	conn.close()
-	return render_template("settings.html", 
+	return dict(
 		usd_to_toman=usd_to_toman,
 		btc_wallet_address=btc_wallet_address,
 		usdt_wallet_address=usdt_wallet_address)
@@ -586,368 +493,212 @@ def settings_page():
 @panel_bp.get("/portfolio")
 def portfolio_page():
 	try:
-		conn = get_db_connection()
-		cur = conn.cursor()
-		
-		# دریافت کیف پول‌ها
-		cur.execute("SELECT id, name, description, wallet_type, color, is_active FROM wallets ORDER BY id")
-		wallets_rows = cur.fetchall()
-		wallets = [
-			{
-				"id": r["id"],
-				"name": r["name"],
-				"description": r["description"],
-				"wallet_type": r["wallet_type"],
-				"color": r["color"],
-				"is_active": bool(r["is_active"])
-			}
-			for r in wallets_rows
-		]
-	
-		# محاسبه موجودی هر کیف پول
-		wallet_balances = {}
-		for wallet in wallets:
-			wallet_id = wallet["id"]
-			
-			# محاسبه موجودی BTC
-			cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM purchases WHERE wallet_id = ?", (wallet_id,))
-			total_btc = float(cur.fetchone()[0] or 0)
-			cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM withdrawals WHERE wallet_id = ?", (wallet_id,))
-			withdrawn_btc = float(cur.fetchone()[0] or 0)
-			current_btc = total_btc - withdrawn_btc
-			
-			# محاسبه ارزش USD
-			cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM purchases WHERE wallet_id = ?", (wallet_id,))
-			total_invested_usd = float(cur.fetchone()[0] or 0)
-			cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM withdrawals WHERE wallet_id = ?", (wallet_id,))
-			total_withdrawn_usd = float(cur.fetchone()[0] or 0)
-			net_invested_usd = total_invested_usd - total_withdrawn_usd
-			
-			wallet_balances[wallet_id] = {
-				"btc_balance": current_btc,
-				"invested_usd": net_invested_usd,
-				"total_purchased_usd": total_invested_usd,
-				"total_withdrawn_usd": total_withdrawn_usd
-			}
-	
-		# دریافت اهداف پورتفولیو
-		cur.execute("""
-			SELECT pg.id, pg.wallet_id, pg.goal_name, pg.goal_type, pg.target_value, 
-			       pg.current_value, pg.target_date, pg.is_achieved, w.name as wallet_name
-			FROM portfolio_goals pg
-			LEFT JOIN wallets w ON pg.wallet_id = w.id
-			ORDER BY pg.created_at DESC
-		""")
-		goals_rows = cur.fetchall()
-		goals = [
-			{
-				"id": r["id"],
-				"wallet_id": r["wallet_id"],
-				"goal_name": r["goal_name"],
-				"goal_type": r["goal_type"],
-				"target_value": float(r["target_value"]),
-				"current_value": float(r["current_value"]),
-				"target_date": r["target_date"],
-				"is_achieved": bool(r["is_achieved"]),
-				"wallet_name": r["wallet_name"]
-			}
-			for r in goals_rows
-		]
-		
-		# دریافت محدودیت‌های ریسک
-		cur.execute("""
-			SELECT rl.id, rl.wallet_id, rl.limit_type, rl.limit_value, 
-			       rl.alert_threshold, rl.is_active, w.name as wallet_name
-			FROM risk_limits rl
-			LEFT JOIN wallets w ON rl.wallet_id = w.id
-			WHERE rl.is_active = 1
-			ORDER BY rl.created_at DESC
-		""")
-		limits_rows = cur.fetchall()
-		risk_limits = [
-			{
-				"id": r["id"],
-				"wallet_id": r["wallet_id"],
-				"limit_type": r["limit_type"],
-				"limit_value": float(r["limit_value"]),
-				"alert_threshold": float(r["alert_threshold"]),
-				"is_active": bool(r["is_active"]),
-				"wallet_name": r["wallet_name"]
-			}
-			for r in limits_rows
-		]
-		
-		# نرخ تبدیل
-		cur.execute("SELECT value FROM settings WHERE key='usd_to_toman'")
-		row = cur.fetchone()
-		usd_to_toman = float(row[0]) if row else 60000.0
-		
-		conn.close()
-		return render_template("portfolio.html", 
-			wallets=wallets, 
-			wallet_balances=wallet_balances,
-			goals=goals,
-			risk_limits=risk_limits,
-			usd_to_toman=usd_to_toman)
+		# نتایج ارزیابی اهداف/ریسک بعد از هر تغییر قیمت عوض می‌شوند ولی data_version را بالا نمی‌برند
+		return render_page("portfolio.html", _portfolio_context, ttl=LIVE_PRICE_TTL)
 	except Exception as e:
 		print(f"[portfolio_page] error: {e}")
 		flash("خطا در بارگذاری صفحه پورتفولیو", "error")
 		return redirect(url_for("panel_bp.panel_index"))
 
 
-
-@panel_bp.get("/deposits")
-def deposits_page():
+def _portfolio_context():
 	conn = get_db_connection()
 	cur = conn.cursor()
 	
-	# محاسبه واریزهای BTC
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM purchases")
-	total_btc_usd = cur.fetchone()[0] or 0
-	
-	# محاسبه واریزهای دلاری
-	cur.execute("SELECT COALESCE(SUM(amount_usd), 0) FROM usd_deposits")
-	total_usd_deposits = cur.fetchone()[0] or 0
-	
-	cur.execute("SELECT COALESCE(SUM(amount_toman), 0) FROM usd_deposits")
-	total_usd_toman = cur.fetchone()[0] or 0
+	# دریافت کیف پول‌ها
+	cur.execute("SELECT id, name, description, wallet_type, color, is_active, cost_basis_method FROM wallets ORDER BY id")
+	wallets_rows = cur.fetchall()
+	wallets = [
+		{
+			"id": r["id"],
+			"name": r["name"],
+			"description": r["description"],
+			"wallet_type": r["wallet_type"],
+			"color": r["color"],
+			"is_active": bool(r["is_active"]),
+			"cost_basis_method": r["cost_basis_method"] or "fifo",
+		}
+		for r in wallets_rows
+	]
 	
-	# کل واریزها
-	total_usd = total_btc_usd + total_usd_deposits
+	# محاسبه موجودی هر کیف پول (یک عبور روی دفتر کل به جای چهار کوئری برای هر کیف پول)
+	wallet_totals = load_dashboard_data(conn, include_deposits=False)["wallet_totals"]
+	empty = {"purchased_btc": 0.0, "purchased_usd": 0.0, "withdrawn_btc": 0.0, "withdrawn_usd": 0.0}
+	wallet_balances = {}
+	for wallet in wallets:
+		totals = wallet_totals.get(wallet["id"], empty)
+		wallet_balances[wallet["id"]] = {
+			"btc_balance": totals["purchased_btc"] - totals["withdrawn_btc"],
+			"invested_usd": totals["purchased_usd"] - totals["withdrawn_usd"],
+			"total_purchased_usd": totals["purchased_usd"],
+			"total_withdrawn_usd": totals["withdrawn_usd"]
+		}
 	
-	# نرخ تبدیل
-	usd_to_toman = _get_usd_to_toman(conn)
-	total_toman = total_usd * usd_to_toman + total_usd_toman
+	# دریافت اهداف پورتفولیو
+	cur.execute("""
+		SELECT pg.id, pg.wallet_id, pg.goal_name, pg.goal_type, pg.target_value, 
+		       pg.current_value, pg.progress, pg.target_date, pg.is_achieved, pg.evaluated_at, w.name as wallet_name
+		FROM portfolio_goals pg
+		LEFT JOIN wallets w ON pg.wallet_id = w.id
+		ORDER BY pg.created_at DESC
+	""")
+	goals_rows = cur.fetchall()
+	goals = [
+		{
+			"id": r["id"],
+			"wallet_id": r["wallet_id"],
+			"goal_name": r["goal_name"],
+			"goal_type": r["goal_type"],
+			"target_value": float(r["target_value"]),
+			"current_value": float(r["current_value"] or 0),
+			"progress": float(r["progress"] or 0),
+			"target_date": r["target_date"],
+			"is_achieved": bool(r["is_achieved"]),
+			"evaluated_at": r["evaluated_at"],
+			"wallet_name": r["wallet_name"]
+		}
+		for r in goals_rows
+	]
 	
-	# لیست واریزهای دلاری
-	cur.execute("SELECT id, created_at, amount_usd, price_toman_per_usd, amount_toman FROM usd_deposits ORDER BY id DESC")
-	usd_deposits_rows = cur.fetchall()
-	usd_deposits = [
+	# دریافت محدودیت‌های ریسک
+	cur.execute("""
+		SELECT rl.id, rl.wallet_id, rl.limit_type, rl.limit_value, 
+		       rl.alert_threshold, rl.is_active, rl.current_value, rl.utilization, rl.state,
+		       rl.evaluated_at, w.name as wallet_name
+		FROM risk_limits rl
+		LEFT JOIN wallets w ON rl.wallet_id = w.id
+		WHERE rl.is_active = 1
+		ORDER BY rl.created_at DESC
+	""")
+	limits_rows = cur.fetchall()
+	risk_limits = [
 		{
 			"id": r["id"],
-			"created_at": r["created_at"],
-			"amount_usd": float(r["amount_usd"]),
-			"price_toman_per_usd": float(r["price_toman_per_usd"]),
-			"amount_toman": float(r["amount_toman"]),
+			"wallet_id": r["wallet_id"],
+			"limit_type": r["limit_type"],
+			"limit_value": float(r["limit_value"]),
+			"alert_threshold": float(r["alert_threshold"]),
+			"is_active": bool(r["is_active"]),
+			"current_value": float(r["current_value"] or 0),
+			"utilization": float(r["utilization"] or 0),
+			"state": r["state"] or "ok",
+			"evaluated_at": r["evaluated_at"],
+			"wallet_name": r["wallet_name"]
 		}
-		for r in usd_deposits_rows
+		for r in limits_rows
 	]
 	
+	# نرخ تبدیل
+	usd_to_toman = _get_usd_to_toman(conn)
+	
 	conn.close()
-	return render_template("deposits.html", 
+	return dict(
+		wallets=wallets, 
+		wallet_balances=wallet_balances,
+		goals=goals,
+		risk_limits=risk_limits,
+		usd_to_toman=usd_to_toman)
+
+
+
+@panel_bp.get("/deposits")
+def deposits_page():
+	return render_page("deposits.html", _deposits_context)
+
+
+def _deposits_context():
+	data = load_dashboard_data()
+	totals = data["totals"]
+	
+	# واریزهای BTC و دلاری
+	total_btc_usd = totals["purchased_usd"]
+	total_usd_deposits = totals["usd_deposits"]
+	total_usd_toman = totals["usd_deposits_toman"]
+	
+	# کل واریزها
+	total_usd = total_btc_usd + total_usd_deposits
+	
+	# نرخ تبدیل (تومان برای هر دلار، مثل مبلغ تومانی واریزهای دلاری)
+	usd_to_toman = _get_usd_to_toman(None)
+	total_toman = total_usd * usd_to_toman + total_usd_toman
+	# هر خرید با نرخ تتر زمان خودش (fx.py) + واریزهای دلاری با نرخ ثبت‌شده خودشان
+	purchases_toman = toman_at_trade(data["purchases"], usd_to_toman)
+	total_toman_at_trade = sum(v for v in purchases_toman if v is not None) + total_usd_toman
+	
+	return dict(
 		total_usd=total_usd, 
 		total_btc_usd=total_btc_usd,
 		total_usd_deposits=total_usd_deposits,
 		total_usd_toman=total_usd_toman,
 		usd_to_toman=usd_to_toman, 
 		total_toman=total_toman,
-		usd_deposits=usd_deposits)
+		total_toman_at_trade=total_toman_at_trade,
+		usd_deposits=data["usd_deposits"])
 
 
 @panel_bp.get("/withdrawals")
 def withdrawals_page():
-	conn = get_db_connection()
-	cur = conn.cursor()
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY id DESC")
-	rows = cur.fetchall()
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM withdrawals")
-	total_withdraw_usd = cur.fetchone()[0] or 0
-	cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM withdrawals")
-	total_withdraw_btc = float(cur.fetchone()[0] or 0)
-	usd_to_toman = _get_usd_to_toman(conn)
-	conn.close()
+	return render_page("withdrawals.html", _withdrawals_context)
+
+
+def _withdrawals_context():
+	data = load_dashboard_data(include_deposits=False)
+	totals = data["totals"]
+	usd_to_toman = _get_usd_to_toman(None)
 	
-	# Convert sqlite3.Row to plain dicts for JSON serialization
 	withdrawals = [
 		{
-			"id": int(r["id"]),
-			"created_at": r["created_at"],
-			"amount_btc": float(r["amount_btc"]),
-			"price_usd_per_btc": float(r["price_usd_per_btc"]),
+			"id": w["id"],
+			"created_at": w["created_at"],
+			"amount_btc": w["amount_btc"],
+			"price_usd_per_btc": w["price_usd_per_btc"],
+			"amount_usd": w["amount_usd"],
 		}
-		for r in rows
+		for w in latest(data["withdrawals"])
 	]
 	
-	return render_template("withdrawals.html", withdrawals=withdrawals, total_withdraw_usd=total_withdraw_usd, total_withdraw_btc=total_withdraw_btc, total_withdraw_toman=total_withdraw_usd * usd_to_toman, usd_to_toman=usd_to_toman)
+	return dict(withdrawals=withdrawals, total_withdraw_usd=totals["withdrawn_usd"], total_withdraw_btc=totals["withdrawn_btc"], total_withdraw_toman=totals["withdrawn_usd"] * usd_to_toman, usd_to_toman=usd_to_toman)
 
 
 @panel_bp.get("/balance")
 def balance_page():
-	conn = get_db_connection()
-	cur = conn.cursor()
-	
-	# محاسبه موجودی واقعی (خرید - برداشت)
-	cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM purchases")
-	total_purchased_btc = float(cur.fetchone()[0] or 0)
-	cur.execute("SELECT COALESCE(SUM(amount_btc), 0) FROM withdrawals")
-	total_withdrawn_btc = float(cur.fetchone()[0] or 0)
-	current_btc_balance = total_purchased_btc - total_withdrawn_btc
-	
-	# محاسبه ارزش سرمایه‌گذاری شده
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM purchases")
-	total_invested_usd = float(cur.fetchone()[0] or 0)
-	cur.execute("SELECT COALESCE(SUM(amount_btc * price_usd_per_btc), 0) FROM withdrawals")
-	total_withdrawn_usd = float(cur.fetchone()[0] or 0)
-	net_invested_usd = total_invested_usd - total_withdrawn_usd
+	return render_page("balance.html", _balance_context, ttl=LIVE_PRICE_TTL)
+
+
+def _balance_context():
+	data = load_dashboard_data(include_deposits=False)
+	totals = data["totals"]
+	net_invested_usd = totals["net_invested_usd"]
 	
 	# نرخ تبدیل از async fetcher
-	usd_to_toman = _get_usd_to_toman(conn)
-	
-	# تاریخ آخرین تراکنش
-	cur.execute("SELECT MAX(created_at) FROM (SELECT created_at FROM purchases UNION ALL SELECT created_at FROM withdrawals)")
-	last_transaction_date = cur.fetchone()[0]
+	usd_to_toman = _get_usd_to_toman(None)
 	
-	# تعداد تراکنش‌ها
-	cur.execute("SELECT COUNT(*) FROM purchases")
-	total_purchases_count = cur.fetchone()[0]
-	cur.execute("SELECT COUNT(*) FROM withdrawals")
-	total_withdrawals_count = cur.fetchone()[0]
-	
-	# Fetch purchases and withdrawals for trades calculation
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM purchases ORDER BY id DESC")
-	purchases_rows = cur.fetchall()
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY id ASC")
-	withdrawals_rows = cur.fetchall()
-	
-	# Convert to dicts for JSON serialization
-	purchases = [
-		{
-			"id": int(r["id"]),
-			"created_at": r["created_at"],
-			"amount_btc": float(r["amount_btc"]),
-			"price_usd_per_btc": float(r["price_usd_per_btc"]),
-		}
-		for r in purchases_rows
-	]
-	withdrawals = [
-		{
-			"id": int(r["id"]),
-			"created_at": r["created_at"],
-			"amount_btc": float(r["amount_btc"]),
-			"price_usd_per_btc": float(r["price_usd_per_btc"]),
-		}
-		for r in withdrawals_rows
-	]
-	
-	# Fetch all transactions for transaction list
-	cur.execute("""
-		SELECT id, created_at, amount_btc, price_usd_per_btc, 'purchase' as type 
-		FROM purchases 
-		UNION ALL 
-		SELECT id, created_at, amount_btc, price_usd_per_btc, 'withdrawal' as type 
-		FROM withdrawals 
-		ORDER BY created_at DESC
-	""")
-	transactions = [
-		{
-			"id": r[0],
-			"created_at": r[1],
-			"amount_btc": r[2],
-			"price_usd_per_btc": r[3],
-			"type": r[4]
-		} for r in cur.fetchall()
-	]
+	# ورودی محاسبات FIFO سمت کاربر: خریدها جدیدترین اول، برداشت‌ها به ترتیب id
+	purchases = latest(data["purchases"])
+	withdrawals = sorted(data["withdrawals"], key=lambda w: w["id"])
 	
 	# محاسبه ROI دقیق با در نظر گیری معاملات بسته و باز
 	roi_percentage = 0
 	profit_loss_usd = 0
-	
-	# دریافت قیمت فعلی BTC از API
-	current_btc_price = 50000  # Default
-	try:
-		response = requests.post('https://api.nobitex.ir/market/stats', json={"srcCurrency": "btc", "dstCurrency": "usdt"}, timeout=3)
-		if response.status_code == 200:
-			data = response.json()["stats"]["btc-usdt"]
-			current_btc_price = float(data["latest"])
-	except Exception:
-		pass
-	
-	# محاسبه سود/زیان از معاملات بسته (FIFO)
-	closed_trades_profit = 0
-	purchases_list = []
-	withdrawals_list = []
-	
-	# دریافت تمام خریدها و برداشت‌ها
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM purchases ORDER BY created_at ASC")
-	purchases_list = cur.fetchall()
-	cur.execute("SELECT id, created_at, amount_btc, price_usd_per_btc FROM withdrawals ORDER BY created_at ASC")
-	withdrawals_list = cur.fetchall()
-	
-	# محاسبه معاملات بسته با FIFO
-	purchase_queue = [(p[0], p[1], float(p[2]), float(p[3])) for p in purchases_list]
-	withdrawal_queue = [(w[0], w[1], float(w[2]), float(w[3])) for w in withdrawals_list]
-	
-	for withdrawal in withdrawal_queue:
-		remaining_withdrawal = withdrawal[2]
-		withdrawal_price = withdrawal[3]
-		
-		while remaining_withdrawal > 1e-12 and purchase_queue:
-			purchase = purchase_queue[0]
-			purchase_amount = purchase[2]
-			purchase_price = purchase[3]
-			
-			# مقدار معامله شده
-			trade_amount = min(remaining_withdrawal, purchase_amount)
-			
-			# محاسبه سود/زیان این معامله
-			buy_cost = trade_amount * purchase_price
-			sell_value = trade_amount * withdrawal_price
-			trade_profit = sell_value - buy_cost
-			closed_trades_profit += trade_profit
-			
-			# کاهش از صف‌ها
-			remaining_withdrawal -= trade_amount
-			purchase_queue[0] = (purchase[0], purchase[1], purchase[2] - trade_amount, purchase[3])
-			
-			# اگر خرید تمام شد، از صف حذف کن
-			if purchase_queue[0][2] <= 1e-12:
-				purchase_queue.pop(0)
-	
-	# محاسبه ارزش معاملات باز (موجودی فعلی)
-	open_trades_value = 0
-	open_trades_cost = 0
-	for purchase in purchase_queue:
-		open_trades_cost += purchase[2] * purchase[3]
-		open_trades_value += purchase[2] * current_btc_price
-	
-	open_trades_profit = open_trades_value - open_trades_cost
-	
-	# محاسبه کل سود/زیان
-	total_profit_loss = closed_trades_profit + open_trades_profit
-	
-	# محاسبه ROI
+	result = roi(data, _fetch_live_btc_price(), net_invested_usd)
 	if net_invested_usd > 0:
-		roi_percentage = (total_profit_loss / net_invested_usd) * 100
-		profit_loss_usd = total_profit_loss
-	
-	# تاریخ شروع سرمایه‌گذاری
-	cur.execute("SELECT MIN(created_at) FROM purchases")
-	row_first = cur.fetchone()
-	inception_days = 0
-	try:
-		first_str = row_first[0] if row_first and row_first[0] else None
-		if first_str:
-			dt0 = datetime.fromisoformat(first_str)
-			inception_days = max(0, (datetime.utcnow() - dt0).days)
-	except Exception:
-		inception_days = 0
-	
-	conn.close()
+		roi_percentage = result["roi_percentage"]
+		profit_loss_usd = result["profit_loss_usd"]
 	
-	return render_template("balance.html", 
-		current_btc_balance=current_btc_balance,
-		total_purchased_btc=total_purchased_btc,
-		total_withdrawn_btc=total_withdrawn_btc,
+	return dict(
+		current_btc_balance=totals["current_btc_balance"],
+		total_purchased_btc=totals["purchased_btc"],
+		total_withdrawn_btc=totals["withdrawn_btc"],
 		net_invested_usd=net_invested_usd,
-		total_invested_usd=total_invested_usd,
-		total_withdrawn_usd=total_withdrawn_usd,
+		total_invested_usd=totals["purchased_usd"],
+		total_withdrawn_usd=totals["withdrawn_usd"],
 		usd_to_toman=usd_to_toman,
-		last_transaction_date=last_transaction_date,
-		total_purchases_count=total_purchases_count,
-		total_withdrawals_count=total_withdrawals_count,
+		last_transaction_date=data["last_transaction_at"],
+		total_purchases_count=totals["purchases_count"],
+		total_withdrawals_count=totals["withdrawals_count"],
 		roi_percentage=roi_percentage,
 		profit_loss_usd=profit_loss_usd,
-		inception_days=inception_days,
-		transactions=transactions,
+		inception_days=data["inception_days"],
+		transactions=transactions(data),
 		purchases=purchases,
 		withdrawals=withdrawals)
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+زمان‌بند کارهای پس‌زمینه (داخل پروسه)
+
+- تریگر بازه‌ای (هر N ثانیه) و تریگر شبه-cron ("دقیقه ساعت روز ماه روزهفته")
+- jitter تصادفی برای پخش نشدن همزمان درخواست‌ها
+- timeout برای هر کار، جلوگیری از اجرای همپوشان یک کار، تاریخچه اجراها با مدت زمان
+- فقط یک پروسه در هر میزبان کارها را اجرا می‌کند: قفل فایل (flock / msvcrt)؛ پروسه‌های دیگر
+  در حالت standby می‌مانند و اگر پروسه صاحب قفل از بین برود، یکی از آن‌ها قفل را می‌گیرد
+- وضعیت کارها بعد از هر اجرا در یک فایل JSON نوشته می‌شود تا هر worker بتواند آن را نشان دهد
+  (/admin/jobs)
+
+متغیرهای محیطی:
+- PPLUS_SCHEDULER=0            خاموش کردن کامل زمان‌بند
+- PPLUS_SCHEDULER_LOCK=...     مسیر فایل قفل (پیش‌فرض .scheduler.lock کنار برنامه)
+- PPLUS_SCHEDULER_STATE=...    مسیر فایل وضعیت (پیش‌فرض scheduler_state.json)
+"""
+
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import Counter, Histogram, REGISTRY
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+try:
+    import msvcrt  # type: ignore
+except ImportError:
+    msvcrt = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEDULER_ENABLED = os.environ.get("PPLUS_SCHEDULER", "1") != "0"
+LOCK_FILE = os.environ.get("PPLUS_SCHEDULER_LOCK") or os.path.join(BASE_DIR, ".scheduler.lock")
+STATE_FILE = os.environ.get("PPLUS_SCHEDULER_STATE") or os.path.join(BASE_DIR, "scheduler_state.json")
+# How often a standby process retries the host lock (seconds)
+LOCK_RETRY_INTERVAL = 30
+JOB_HISTORY_SIZE = 20
+DEFAULT_JOB_TIMEOUT = 120
+
+logger = logging.getLogger(__name__)
+
+JOB_DURATION = Histogram(
+    "pplus_job_duration_seconds", "Background job run time.", ("job", "status"),
+    (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0),
+)
+JOB_RUNS_TOTAL = Counter("pplus_job_runs_total", "Background job runs by outcome.", ("job", "status"))
+REGISTRY.extend([JOB_DURATION, JOB_RUNS_TOTAL])
+
+
+# ----------------------------------------------------------------------------
+# Triggers
+# ----------------------------------------------------------------------------
+class IntervalTrigger:
+    """Every `seconds` seconds, measured from the start of the previous run."""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("interval must be positive")
+        self.seconds = float(seconds)
+
+    def next_after(self, now: float) -> float:
+        return now + self.seconds
+
+    def describe(self) -> str:
+        return f"every {int(self.seconds)}s"
+
+
+# (name, low, high) of the five cron fields
+_CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 6))
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> set:
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"bad cron step: {text}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron value out of range: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronTrigger:
+    """Five-field cron expression in server local time: "minute hour day month weekday".
+
+    Supports *, lists (1,15), ranges (1-5) and steps (*/10). Weekday 0 (or 7) is Sunday.
+    As in cron, when both day and weekday are restricted either one matching is enough.
+    """
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        if fields[4] != "*":
+            fields[4] = ",".join("0" if f == "7" else f for f in fields[4].split(","))
+        parsed = [_parse_cron_field(text, low, high) for text, (_, low, high) in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays  # Python: Monday=0, cron: Sunday=0
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, now: float) -> float:
+        dt = datetime.fromtimestamp(now).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 4)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt.timestamp()
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+    def describe(self) -> str:
+        return f"cron {self.expr}"
+
+
+# ----------------------------------------------------------------------------
+# Jobs
+# ----------------------------------------------------------------------------
+class Job:
+    def __init__(self, name: str, func: Callable[[], Any], trigger, jitter: float = 0.0,
+                 timeout: float = DEFAULT_JOB_TIMEOUT, run_at_start: bool = False):
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.jitter = float(jitter)
+        self.timeout = float(timeout)
+        self.run_at_start = run_at_start
+        self.next_run: Optional[float] = None
+        self.running_since: Optional[float] = None
+        self.timed_out = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.history: deque = deque(maxlen=JOB_HISTORY_SIZE)
+
+    def schedule_next(self, now: float) -> None:
+        base = self.trigger.next_after(now)
+        self.next_run = base + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        last = self.history[-1] if self.history else None
+        return {
+            "name": self.name,
+            "trigger": self.trigger.describe(),
+            "jitter": self.jitter,
+            "timeout": self.timeout,
+            "next_run": self.next_run,
+            "running": self.running_since is not None,
+            "running_since": self.running_since,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_status": last["status"] if last else None,
+            "last_run": last,
+            "history": list(self.history),
+        }
+
+
+class _HostLock:
+    """Non-blocking exclusive lock on a file; released by the OS if the process dies."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            f = open(self.path, "a+")
+        except OSError as e:
+            logger.error(f"[scheduler] cannot open lock file {self.path}: {e}")
+            return False
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def owner_pid(self) -> Optional[int]:
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+
+class Scheduler:
+    def __init__(self, lock_file: str = LOCK_FILE, state_file: str = STATE_FILE):
+        self.jobs: Dict[str, Job] = {}
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._host_lock = _HostLock(lock_file)
+        self._thread: Optional[threading.Thread] = None
+        self.owner = False
+
+    def add_job(self, name: str, func: Callable[[], Any], interval: Optional[float] = None,
+                cron: Optional[str] = None, jitter: float = 0.0, timeout: float = DEFAULT_JOB_TIMEOUT,
+                run_at_start: bool = False) -> Job:
+        """Register (or replace) a job. Exactly one of `interval` (seconds) or `cron` is required."""
+        if (interval is None) == (cron is None):
+            raise ValueError("pass exactly one of interval= or cron=")
+        trigger = IntervalTrigger(interval) if interval is not None else CronTrigger(cron)
+        job = Job(name, func, trigger, jitter=jitter, timeout=timeout, run_at_start=run_at_start)
+        with self._lock:
+            self.jobs[name] = job
+            if self.owner:
+                self._initial_schedule(job, time.time())
+        self._wakeup.set()
+        return job
+
+    def _initial_schedule(self, job: Job, now: float) -> None:
+        if job.run_at_start:
+            job.next_run = now + (random.uniform(0, job.jitter) if job.jitter else 0.0)
+        else:
+            job.schedule_next(now)
+
+    # -- lifecycle -------------------------------------------------------------
+    def start(self) -> None:
+        """Start the scheduler thread; it runs jobs only while holding the host lock."""
+        if not SCHEDULER_ENABLED or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._main, name="pplus-scheduler", daemon=True)
+        self._thread.start()
+
+    def _main(self) -> None:
+        while not self._host_lock.acquire():
+            self._wakeup.wait(LOCK_RETRY_INTERVAL)
+            self._wakeup.clear()
+        with self._lock:
+            self.owner = True
+            now = time.time()
+            for job in self.jobs.values():
+                self._initial_schedule(job, now)
+        logger.info(f"[scheduler] running {len(self.jobs)} job(s) in pid {os.getpid()}")
+        self._write_state()
+        while True:
+            try:
+                delay = self._tick()
+            except Exception as e:  # never let the loop die
+                logger.error(f"[scheduler] loop error: {e}")
+                delay = 5.0
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def _tick(self) -> float:
+        """Start every due job; return seconds until the next one is due."""
+        now = time.time()
+        with self._lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.running_since is not None:
+                self._check_timeout(job, now)
+            if job.next_run is None or job.next_run > now:
+                continue
+            # Missed slots (process asleep, long run) collapse into this one run
+            job.schedule_next(now)
+            if job.running_since is not None:
+                job.skipped += 1
+                JOB_RUNS_TOTAL.inc((job.name, "skipped"))
+                logger.warning(f"[scheduler] {job.name} still running, skipping this run")
+                continue
+            self._launch(job)
+        pending = [j.next_run for j in jobs if j.next_run is not None]
+        running = [j.running_since + j.timeout for j in jobs if j.running_since is not None and not j.timed_out]
+        upcoming = min(pending + running, default=now + 60)
+        return max(0.05, min(upcoming - now, 60.0))
+
+    def _check_timeout(self, job: Job, now: float) -> None:
+        # Threads cannot be killed: the run is recorded as timed out and the job stays
+        # blocked (no overlapping run) until the worker thread actually returns.
+        if not job.timed_out and now - job.running_since > job.timeout:
+            job.timed_out = True
+            logger.error(f"[scheduler] {job.name} exceeded its {job.timeout:g}s timeout")
+
+    def _launch(self, job: Job) -> None:
+        job.running_since = time.time()
+        job.timed_out = False
+        threading.Thread(target=self._run_job, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+    def _run_job(self, job: Job) -> None:
+        started = job.running_since or time.time()
+        status, error = "ok", None
+        try:
+            job.func()
+        except Exception as e:
+            status, error = "error", str(e)
+            logger.error(f"[scheduler] {job.name} failed: {e}")
+        duration = time.time() - started
+        if status == "ok" and (job.timed_out or duration > job.timeout):
+            status, error = "timeout", f"took {duration:.1f}s (limit {job.timeout:g}s)"
+        with self._lock:
+            job.runs += 1
+            if status != "ok":
+                job.failures += 1
+            job.history.append({
+                "started_at": started,
+                "duration": round(duration, 3),
+                "status": status,
+                "error": error,
+            })
+            job.running_since = None
+            job.timed_out = False
+        JOB_DURATION.observe(duration, (job.name, status))
+        JOB_RUNS_TOTAL.inc((job.name, status))
+        self._write_state()
+        self._wakeup.set()
+
+    def run_now(self, name: str) -> bool:
+        """Make a job due immediately. Returns False if it is unknown or already running."""
+        with self._lock:
+            job = self.jobs.get(name)
+            if job is None or job.running_since is not None or not self.owner:
+                return False
+            job.next_run = time.time()
+        self._wakeup.set()
+        return True
+
+    # -- state -----------------------------------------------------------------
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs: List[Dict[str, Any]] = [job.snapshot() for job in self.jobs.values()]
+        return {"owner_pid": os.getpid(), "updated_at": time.time(), "jobs": jobs}
+
+    def _write_state(self) -> None:
+        directory = os.path.dirname(self.state_file) or "."
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".scheduler_state.", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logger.warning(f"[scheduler] cannot write state file: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """Job state for the admin endpoint, from whichever process owns the scheduler."""
+        if self.owner:
+            state = self.snapshot()
+        else:
+            try:
+                with open(self.state_file, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {"owner_pid": self._host_lock.owner_pid(), "updated_at": None, "jobs": []}
+        state.update({
+            "enabled": SCHEDULER_ENABLED,
+            "this_pid": os.getpid(),
+            "this_process_owns": self.owner,
+        })
+        return state
+
+
+scheduler = Scheduler()
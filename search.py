@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+جستجوی متنی در دفتر کل و اطلاعات کیف پول‌ها (SQLite FTS5)
+
+search_index یک ردیف برای هر متن جستجوپذیر دارد (یادداشت خرید/برداشت، نام و توضیح کیف پول،
+نام هدف) و با triggerهای db.ensure_db همگام می‌ماند. rowid هر ردیف شناسه ردیف اصلی و نوع آن را
+با هم نگه می‌دارد (db.SEARCH_SOURCES)، پس اتصال نتیجه به جدول اصلی فقط یک جستجوی کلید اصلی است.
+
+متن و پرس‌وجو هر دو با db.PERSIAN_NORMALIZE یکسان‌سازی می‌شوند (ی/ي، ک/ك، نیم‌فاصله، اعراب...)؛ عدد
+پرس‌وجو با هر سه شکل ارقام (لاتین، فارسی، عربی) جستجو می‌شود؛
+هر کلمه پرس‌وجو پیشوند حساب می‌شود و همه کلمات باید وجود داشته باشند. ترتیب نتایج با bm25 است.
+"""
+
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import PERSIAN_NORMALIZE, SEARCH_KIND_BITS, SEARCH_SOURCES, read_transaction
+from money import btc, to_micro, to_sat, usd
+
+MAX_PER_PAGE = 100
+_TRANSLATE = str.maketrans(PERSIAN_NORMALIZE)
+KINDS = tuple(SEARCH_SOURCES)
+_KIND_TABLES = {kind: table for table, (kind, _columns) in SEARCH_SOURCES.items()}
+# Digits are indexed as written; a query number matches its Latin, Persian and Arabic-Indic forms
+_DIGIT_FORMS = [
+    str.maketrans({chr(base + d): str(d) for base in (0x06F0, 0x0660) for d in range(10)}),
+    str.maketrans({str(d): chr(0x06F0 + d) for d in range(10)} | {chr(0x0660 + d): chr(0x06F0 + d) for d in range(10)}),
+    str.maketrans({str(d): chr(0x0660 + d) for d in range(10)} | {chr(0x06F0 + d): chr(0x0660 + d) for d in range(10)}),
+]
+
+
+def normalize(text: str) -> str:
+    return (text or "").translate(_TRANSLATE)
+
+
+def match_query(q: str) -> str:
+    """FTS5 MATCH expression: every word of `q` as a (quoted) prefix term."""
+    words = re.findall(r"\w+", normalize(q))
+    if not words:
+        raise ValueError("q must contain at least one word")
+    terms = []
+    for word in words:
+        forms = sorted({word.translate(t) for t in _DIGIT_FORMS})
+        term = " OR ".join(f'"{f}"*' for f in forms)
+        terms.append(term if len(forms) == 1 else f"({term})")
+    return " ".join(terms)
+
+
+def _day(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value[:10]).strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date (YYYY-MM-DD)")
+
+
+def _result(r) -> Dict[str, Any]:
+    kind = _KIND_TABLES[r["kind"]]
+    item = {
+        "kind": kind,
+        "id": r["row_id"],
+        "score": -r["rank"],  # bm25: lower is better
+        "snippet": r["snippet"],
+        "created_at": r["created_at"],
+        "wallet_id": r["wallet_id"],
+    }
+    if kind in ("purchases", "withdrawals"):
+        item.update(amount_btc=btc(r["amount_sat"]), amount_usd=usd(r["cost_micro"]), notes=r["notes"])
+    elif kind == "wallets":
+        item.update(name=r["name"], description=r["description"])
+    else:
+        item.update(goal_name=r["goal_name"])
+    return item
+
+
+def search(
+    q: str,
+    kinds: Optional[List[str]] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_btc: Optional[float] = None,
+    max_btc: Optional[float] = None,
+    min_usd: Optional[float] = None,
+    max_usd: Optional[float] = None,
+    page: int = 1,
+    per_page: int = 20,
+    conn=None,
+) -> Dict[str, Any]:
+    """Ranked matches across the ledger tables, wallets and goals.
+
+    Amount filters (BTC / USD of a trade) leave only purchases and withdrawals; dates are inclusive
+    days on created_at. Returns {"query", "total", "page", "per_page", "results"}.
+    """
+    kinds = list(kinds or KINDS)
+    unknown = [k for k in kinds if k not in SEARCH_SOURCES]
+    if unknown:
+        raise ValueError(f"kinds must be among {', '.join(KINDS)}")
+    if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+        raise ValueError(f"page must be >= 1 and per_page 1..{MAX_PER_PAGE}")
+
+    mask = (1 << SEARCH_KIND_BITS) - 1
+    where: List[str] = []
+    params: List[Any] = [match_query(q), *(SEARCH_SOURCES[k][0] for k in kinds)]
+    start, end = _day(date_from, "from"), _day(date_to, "to")
+    if start:
+        where.append("created_at >= ?")
+        params.append(start)
+    if end:
+        where.append("created_at < ?")
+        params.append((datetime.fromisoformat(end) + timedelta(days=1)).strftime("%Y-%m-%d"))
+    for column, bound, op, scale in (
+        ("amount_sat", min_btc, ">=", to_sat), ("amount_sat", max_btc, "<=", to_sat),
+        ("cost_micro", min_usd, ">=", to_micro), ("cost_micro", max_usd, "<=", to_micro),
+    ):
+        if bound is not None:
+            where.append(f"{column} {op} ?")
+            params.append(scale(bound))
+
+    def joined(table: str, alias: str) -> str:
+        return f"LEFT JOIN {table} {alias} ON (search_index.rowid & {mask}) = {SEARCH_SOURCES[table][0]} AND {alias}.id = search_index.rowid >> {SEARCH_KIND_BITS}"
+
+    matches = f"""
+        SELECT search_index.rowid >> {SEARCH_KIND_BITS} AS row_id, search_index.rowid & {mask} AS kind, search_index.rank AS rank,
+               snippet(search_index, 0, '[', ']', '…', 12) AS snippet,
+               COALESCE(p.created_at, w.created_at, wl.created_at, g.created_at) AS created_at,
+               COALESCE(p.wallet_id, w.wallet_id, g.wallet_id, wl.id) AS wallet_id,
+               COALESCE(p.amount_sat, w.amount_sat) AS amount_sat,
+               COALESCE(p.cost_micro, w.cost_micro) AS cost_micro,
+               COALESCE(p.notes, w.notes) AS notes,
+               wl.name AS name, wl.description AS description, g.goal_name AS goal_name
+        FROM search_index
+        {joined("purchases", "p")}
+        {joined("withdrawals", "w")}
+        {joined("wallets", "wl")}
+        {joined("portfolio_goals", "g")}
+        WHERE search_index MATCH ? AND (search_index.rowid & {mask}) IN ({', '.join('?' * len(kinds))})
+    """
+    filters = f"WHERE {' AND '.join(where)}" if where else ""
+    with read_transaction(conn) as cur:
+        cur.execute(f"SELECT COUNT(*) FROM ({matches}) {filters}", params)
+        total = cur.fetchone()[0]
+        cur.execute(
+            f"SELECT * FROM ({matches}) {filters} ORDER BY rank, row_id DESC LIMIT ? OFFSET ?",
+            (*params, per_page, (page - 1) * per_page),
+        )
+        rows = cur.fetchall()
+    return {"query": q, "total": total, "page": page, "per_page": per_page, "results": [_result(r) for r in rows]}
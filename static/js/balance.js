@@ -0,0 +1,304 @@
+(function() {
+  const pageData = JSON.parse(document.getElementById('page-data').textContent);
+  const btcAmount = pageData.current_btc_balance;
+  let usdToToman = pageData.usd_to_toman;  // Initial from server
+  const netInvestedUsd = pageData.net_invested_usd;
+
+  // دریافت قیمت‌ها
+  function fetchCurrentPrice() {
+    return fetch('/api/price')
+      .then(response => response.json())
+      .then(data => {
+        // نرخ تبدیل از تنظیمات استفاده می‌شود (usdToToman از سرور)
+        return data.btc_usdt;
+      })
+      .catch(() => 50000);
+  }
+
+  function updateValues(currentPrice) {
+    const usdValue = btcAmount * currentPrice;
+    const tomanValue = usdValue * usdToToman;
+
+    // به‌روزرسانی ارزش فعلی در header
+    document.getElementById('current_usd_value').textContent = '$' + usdValue.toFixed(2);
+    document.getElementById('current_toman_value').textContent = tomanValue.toLocaleString('fa-IR');
+
+    // به‌روزرسانی ارزش فعلی در detail sections
+    document.getElementById('current_usd_value_detail').textContent = '$' + usdValue.toFixed(2);
+    document.getElementById('current_toman_value_detail').textContent = tomanValue.toLocaleString('fa-IR') + ' تومان';
+
+    // محاسبه دقیق سود/زیان با در نظر گیری معاملات بسته و باز
+    const purchases = pageData.purchases;
+    const withdrawals = pageData.withdrawals;
+
+    // محاسبه معاملات بسته با FIFO
+    let closedTradesProfit = 0;
+    let purchaseQueue = purchases.map(p => ({
+      id: p.id,
+      date: p.created_at,
+      amount: parseFloat(p.amount_btc),
+      price: parseFloat(p.price_usd_per_btc)
+    })).sort((a, b) => new Date(a.date) - new Date(b.date));
+
+    let withdrawalQueue = withdrawals.map(w => ({
+      id: w.id,
+      date: w.created_at,
+      amount: parseFloat(w.amount_btc),
+      price: parseFloat(w.price_usd_per_btc)
+    })).sort((a, b) => new Date(a.date) - new Date(b.date));
+
+    // محاسبه معاملات بسته
+    for (let withdrawal of withdrawalQueue) {
+      let remainingWithdrawal = withdrawal.amount;
+
+      while (remainingWithdrawal > 1e-12 && purchaseQueue.length > 0) {
+        let purchase = purchaseQueue[0];
+        let tradeAmount = Math.min(remainingWithdrawal, purchase.amount);
+
+        // محاسبه سود/زیان این معامله
+        let buyCost = tradeAmount * purchase.price;
+        let sellValue = tradeAmount * withdrawal.price;
+        let tradeProfit = sellValue - buyCost;
+        closedTradesProfit += tradeProfit;
+
+        // کاهش از صف‌ها
+        remainingWithdrawal -= tradeAmount;
+        purchase.amount -= tradeAmount;
+
+        // اگر خرید تمام شد، از صف حذف کن
+        if (purchase.amount <= 1e-12) {
+          purchaseQueue.shift();
+        }
+      }
+    }
+
+    // محاسبه ارزش معاملات باز
+    let openTradesValue = 0;
+    let openTradesCost = 0;
+    for (let purchase of purchaseQueue) {
+      openTradesCost += purchase.amount * purchase.price;
+      openTradesValue += purchase.amount * currentPrice;
+    }
+
+    let openTradesProfit = openTradesValue - openTradesCost;
+    let totalProfitLoss = closedTradesProfit + openTradesProfit;
+    let profitLossToman = totalProfitLoss * usdToToman;
+
+    // به‌روزرسانی سود/زیان
+    document.getElementById('profit_loss_value').textContent = '$' + totalProfitLoss.toFixed(2);
+    document.getElementById('profit_loss_value_detail').textContent = '$' + totalProfitLoss.toFixed(2);
+    document.getElementById('profit_loss_toman_detail').textContent = profitLossToman.toLocaleString('fa-IR') + ' تومان';
+
+    // محاسبه و به‌روزرسانی ROI
+    let roiPercentage = 0;
+    if (netInvestedUsd > 0) {
+      roiPercentage = (totalProfitLoss / netInvestedUsd) * 100;
+    }
+    document.getElementById('roi_value_detail').textContent = roiPercentage.toFixed(1) + '%';
+
+    // تغییر رنگ KPI ها بر اساس سود/زیان
+    const profitLossCards = document.querySelectorAll('.kpi-card.positive, .kpi-card.negative');
+    profitLossCards.forEach(card => {
+      card.classList.remove('positive', 'negative');
+      card.classList.add(totalProfitLoss >= 0 ? 'positive' : 'negative');
+    });
+
+    // تغییر رنگ header cards
+    const headerCards = document.querySelectorAll('.balance-card');
+    if (headerCards.length >= 4) {
+      headerCards[3].style.color = totalProfitLoss >= 0 ? '#10b981' : '#ef4444';
+    }
+  }
+
+  // بارگذاری اولیه
+  fetchCurrentPrice().then(updateValues);
+
+  // به‌روزرسانی هر 30 ثانیه
+  setInterval(() => {
+    fetchCurrentPrice().then(updateValues);
+  }, 30000);
+})();
+
+(function(){
+  var pageData = JSON.parse(document.getElementById('page-data').textContent);
+  var purchases = pageData.purchases;
+  var withdrawals = pageData.withdrawals;
+  var openBody = document.getElementById('open_trades_body');
+  var closedBody = document.getElementById('closed_trades_body');
+  var usdToToman = pageData.usd_to_toman;
+  var priceEl = document.getElementById('btc_usd');
+
+  function toNum(x){ return typeof x === 'number' ? x : Number(x); }
+
+  // FIFO match
+  var queue = purchases.map(function(p){
+    return { id:p.id, date:p.created_at, amount: toNum(p.amount_btc), price: toNum(p.price_usd_per_btc) };
+  }).reverse(); // oldest first
+  var closedLots = [];
+  withdrawals.slice().forEach(function(w){
+    var remain = toNum(w.amount_btc);
+    var wPrice = toNum(w.price_usd_per_btc);
+    while(remain > 1e-12 && queue.length){
+      var lot = queue[0];
+      var take = Math.min(remain, lot.amount);
+      // record closed trade row
+      var buyCost = take * lot.price;
+      var sellVal = take * wPrice;
+      var pl = sellVal - buyCost;
+      var tr = document.createElement('tr');
+      tr.innerHTML = '<td data-label="#">'+lot.id+'</td>'+
+                     '<td data-label="خرید">'+lot.date+'</td>'+
+                     '<td data-label="خروج">'+w.created_at+'</td>'+
+                     '<td data-label="BTC">'+take.toFixed(8)+'</td>'+
+                     '<td data-label="میانگین خرید">'+lot.price.toFixed(2)+'</td>'+
+                     '<td data-label="میانگین خروج">'+wPrice.toFixed(2)+'</td>'+
+                     '<td data-label="سود/زیان">'+pl.toFixed(2)+' $</td>';
+      closedBody.appendChild(tr);
+      closedLots.push({ id: lot.id, buy: lot.date, sell: w.created_at, btc: take, buyP: lot.price, sellP: wPrice, pl: pl });
+      lot.amount -= take;
+      remain -= take;
+      if(lot.amount <= 1e-12) queue.shift();
+    }
+  });
+
+  function renderOpen(currentPrice){
+    openBody.innerHTML='';
+    var openCards = document.getElementById('open_cards');
+    if (openCards) openCards.innerHTML='';
+    queue.forEach(function(lot){
+      var cost = lot.amount * lot.price;
+      var curVal = lot.amount * currentPrice;
+      var pl = curVal - cost;
+      var tr = document.createElement('tr');
+      tr.innerHTML = '<td data-label="#">'+lot.id+'</td>'+
+                     '<td data-label="تاریخ">'+lot.date+'</td>'+
+                     '<td data-label="BTC باقیمانده">'+lot.amount.toFixed(8)+'</td>'+
+                     '<td data-label="میانگین قیمت (USD)">'+lot.price.toFixed(2)+'</td>'+
+                     '<td data-label="ارزش فعلی">'+curVal.toFixed(2)+' $</td>'+
+                     '<td data-label="سود/زیان">'+pl.toFixed(2)+' $</td>';
+      openBody.appendChild(tr);
+      if (openCards) {
+        var cost = lot.amount * lot.price;
+        var curVal = lot.amount * currentPrice;
+        var pl = curVal - cost;
+        var card = document.createElement('div');
+        card.className = 'card col';
+        card.innerHTML = '<div class="kpi">'+
+          '<div class="icon">📈</div>'+
+          '<div>'+
+          '<div class="label">#'+lot.id+' • '+lot.date+'</div>'+
+          '<div class="value">'+lot.amount.toFixed(8)+' <span class="sub">BTC</span></div>'+
+          '<div class="sub">میانگین: '+lot.price.toFixed(2)+' $</div>'+
+          '<div class="label" style="margin-top:8px;">ارزش فعلی: '+curVal.toFixed(2)+' $ • سود/زیان: '+pl.toFixed(2)+' $</div>'+
+          '</div></div>';
+        openCards.appendChild(card);
+      }
+    });
+  }
+
+  function renderClosedCards(){
+    var closedCards = document.getElementById('closed_cards');
+    if (!closedCards) return;
+    closedCards.innerHTML = '';
+    closedLots.forEach(function(r){
+      var card = document.createElement('div');
+      card.className = 'card col';
+      card.innerHTML = '<div class="kpi">'+
+        '<div class="icon">📉</div>'+
+        '<div>'+
+        '<div class="label">#'+r.id+' • '+r.buy+' → '+r.sell+'</div>'+
+        '<div class="value">'+r.btc.toFixed(8)+' <span class="sub">BTC</span></div>'+
+        '<div class="sub">میانگین خرید: '+r.buyP.toFixed(2)+' $ • میانگین خروج: '+r.sellP.toFixed(2)+' $</div>'+
+        '<div class="label" style="margin-top:8px;">سود/زیان: '+r.pl.toFixed(2)+' $</div>'+
+        '</div></div>';
+      closedCards.appendChild(card);
+    });
+  }
+  renderClosedCards();
+
+  function readPrice(){
+    var p = Number(priceEl && priceEl.textContent && priceEl.textContent.replace(/[^0-9.]/g,''));
+    if (!isFinite(p) || p<=0) return null;
+    return p;
+  }
+
+  var initial = readPrice();
+  if (initial) renderOpen(initial);
+  var obs = new MutationObserver(function(){
+    var p = readPrice();
+    if (p) renderOpen(p);
+  });
+  if (priceEl) obs.observe(priceEl, { childList:true });
+
+  function applyResponsive(){
+    var isMobile = window.matchMedia('(max-width: 640px)').matches;
+    var d = document.getElementById('trades_desktop');
+    var m = document.getElementById('trades_mobile');
+    if (d && m) {
+      d.style.display = isMobile ? 'none' : '';
+      m.style.display = isMobile ? '' : 'none';
+    }
+  }
+  applyResponsive();
+  window.addEventListener('resize', applyResponsive);
+})();
+
+(function () {
+  // Cost-basis comparison: every method arrives in one dashboard payload, switching is client-side only
+  var body = document.getElementById('cost_basis_body');
+  var select = document.getElementById('cost_basis_method');
+  var selectedEl = document.getElementById('cost_basis_selected');
+  if (!body || !select) return;
+
+  var LABELS = { fifo: 'FIFO', lifo: 'LIFO', hifo: 'HIFO', average: 'میانگین' };
+  var STORAGE_KEY = 'pplus:cost-basis-method';
+  var latest = null;
+
+  try {
+    var saved = localStorage.getItem(STORAGE_KEY);
+    if (saved && LABELS[saved]) select.value = saved;
+  } catch (e) { /* storage unavailable */ }
+
+  function usd(value) {
+    if (value == null || !isFinite(value)) return '—';
+    return (value < 0 ? '-$' : '$') + Math.abs(value).toLocaleString('en-US', { maximumFractionDigits: 2 });
+  }
+
+  function pnlCell(value) {
+    var cls = value == null ? '' : (value >= 0 ? 'positive' : 'negative');
+    return '<td class="' + cls + '">' + usd(value) + '</td>';
+  }
+
+  function render() {
+    if (!latest) return;
+    var method = select.value;
+    body.innerHTML = '';
+    Object.keys(LABELS).forEach(function (key) {
+      var m = latest.methods[key];
+      if (!m) return;
+      var tr = document.createElement('tr');
+      if (key === method) tr.className = 'selected';
+      tr.innerHTML = '<td data-label="روش">' + LABELS[key] + '</td>' +
+        pnlCell(m.realized_pnl_usd) +
+        '<td>' + usd(m.open_cost_usd) + '</td>' +
+        '<td>' + usd(m.average_cost_usd) + '</td>' +
+        pnlCell(m.unrealized_pnl_usd) +
+        pnlCell(m.total_pnl_usd);
+      body.appendChild(tr);
+    });
+    var chosen = latest.methods[method];
+    selectedEl.textContent = chosen ? 'سود تحقق‌یافته ' + LABELS[method] + ': ' + usd(chosen.realized_pnl_usd) : '';
+  }
+
+  select.addEventListener('change', function () {
+    try { localStorage.setItem(STORAGE_KEY, select.value); } catch (e) { /* storage unavailable */ }
+    render();
+  });
+
+  document.addEventListener('pplus:dashboard', function (e) {
+    if (e.detail && e.detail.cost_basis) {
+      latest = e.detail.cost_basis;
+      render();
+    }
+  });
+})();
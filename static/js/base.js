@@ -0,0 +1,89 @@
+(function () {
+  var pageBody = document.body;
+  var usdToToman = Number(pageBody.dataset.usdToToman);
+  var usdEl = document.getElementById('btc_usd');
+  var tomanEl = document.getElementById('btc_toman');
+  var rateEl = document.getElementById('usd_toman_rate');
+  var totalBtc = Number(pageBody.dataset.totalBtc || 0);
+  var holdUsdEl = document.getElementById('hold_usd');
+  var holdTmnEl = document.getElementById('hold_toman');
+
+  // Sections requested from /api/dashboard; pages extend this via the dashboard_fields block (data-dashboard-fields)
+  var dashboardFields = pageBody.dataset.dashboardFields || 'prices';
+
+  async function fetchPrice(live) {
+    try {
+      // یک درخواست برای قیمت‌ها و داده‌های صفحه؛ نتیجه با رویداد pplus:dashboard منتشر می‌شود
+      // بار اول از کش service worker (نمایش فوری)، poll‌های بعدی مستقیم از شبکه
+      var res = await fetch('/api/dashboard?fields=' + encodeURIComponent(dashboardFields), { cache: live ? 'no-store' : 'default' });
+      if (!res.ok) throw new Error('bad status');
+      var payload = await res.json();
+      document.dispatchEvent(new CustomEvent('pplus:dashboard', { detail: payload }));
+      var data = payload.prices || {};
+
+      var price = Number(data.btc_usdt);
+      if (!isFinite(price)) throw new Error('bad price');
+
+      // نمایش قیمت USD
+      usdEl.textContent = price.toFixed(2);
+      usdEl.classList.remove('skeleton');
+
+      // محاسبه و نمایش قیمت تومان (با نرخ ثابت از تنظیمات)
+      var toman = Math.round(price * usdToToman);
+      tomanEl.textContent = toman.toLocaleString('fa-IR') + ' تومان';
+      tomanEl.classList.remove('skeleton');
+
+      // نمایش نرخ تبدیل (از تنظیمات)
+      if (rateEl) {
+        rateEl.textContent = usdToToman.toLocaleString('fa-IR');
+        rateEl.classList.remove('skeleton');
+      }
+
+      // به‌روزرسانی موجودی اگر موجود باشد
+      if (holdUsdEl && holdTmnEl) {
+        var holdUsd = totalBtc * price;
+        var holdTmn = Math.round(holdUsd * usdToToman);
+        holdUsdEl.textContent = holdUsd.toFixed(2);
+        holdTmnEl.textContent = holdTmn.toLocaleString('fa-IR');
+      }
+    } catch (e) {
+      console.error('Price fetch error:', e);
+      document.dispatchEvent(new CustomEvent('pplus:dashboard-error', { detail: e }));
+      usdEl.textContent = '—';
+      tomanEl.textContent = 'خطا در دریافت';
+      usdEl.classList.remove('skeleton');
+      tomanEl.classList.remove('skeleton');
+      if (rateEl) {
+        rateEl.textContent = '—';
+        rateEl.classList.remove('skeleton');
+      }
+      if (holdUsdEl && holdTmnEl) {
+        holdUsdEl.textContent = '—';
+        holdTmnEl.textContent = '—';
+      }
+    }
+  }
+  if (usdEl) {
+    fetchPrice(false);
+    setInterval(function () { fetchPrice(true); }, 20000);
+  }
+
+  // Auto-hide flashes after 3 seconds
+  var fb = document.getElementById('flashBox');
+  if (fb) {
+    setTimeout(function () {
+      var items = fb.querySelectorAll('.flash');
+      items.forEach(function (el) { el.classList.add('hide'); });
+      setTimeout(function () { fb.remove(); }, 400);
+    }, 3000);
+  }
+
+  // Drawer logic moved to `_drawer.html`
+
+  // Register service worker
+  if ('serviceWorker' in navigator) {
+    window.addEventListener('load', function(){
+      navigator.serviceWorker.register(pageBody.dataset.swUrl).catch(function(){});
+    });
+  }
+})();
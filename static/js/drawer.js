@@ -0,0 +1,125 @@
+(function(){
+  var menuBtn = document.getElementById('menuBtn');
+  var drawer = document.getElementById('drawer');
+  var backdrop = document.getElementById('drawerBackdrop');
+  var closeBtn = document.getElementById('drawerCloseBtn');
+
+  function closeDrawer(){
+    if (drawer) {
+      drawer.classList.remove('open');
+      drawer.setAttribute('aria-hidden','true');
+    }
+    if (backdrop) backdrop.classList.remove('open');
+    if (menuBtn) menuBtn.setAttribute('aria-expanded','false');
+    document.body.classList.remove('no-scroll');
+  }
+
+  function openDrawer(){
+    if (drawer) {
+      drawer.classList.add('open');
+      drawer.setAttribute('aria-hidden','false');
+    }
+    if (backdrop) backdrop.classList.add('open');
+    if (menuBtn) menuBtn.setAttribute('aria-expanded','true');
+    document.body.classList.add('no-scroll');
+  }
+
+  if (menuBtn && drawer && backdrop){
+    // Menu button click handler
+    menuBtn.addEventListener('click', function(e){
+      e.stopPropagation();
+      if (drawer.classList.contains('open')) {
+        closeDrawer();
+      } else {
+        openDrawer();
+      }
+    });
+
+    // Backdrop click handler
+    backdrop.addEventListener('click', function(e){
+      e.preventDefault();
+      closeDrawer();
+    });
+
+    // Close button handler
+    if (closeBtn) {
+      closeBtn.addEventListener('click', function(e){
+        e.preventDefault();
+        closeDrawer();
+      });
+    }
+
+    // Navigation links click handler
+    drawer.querySelectorAll('a').forEach(function(link){ 
+      link.addEventListener('click', function(e){
+        // Close drawer after a short delay to allow navigation
+        setTimeout(closeDrawer, 150);
+      }); 
+    });
+
+    // Escape key handler
+    document.addEventListener('keydown', function(e){ 
+      if (e.key === 'Escape' && drawer.classList.contains('open')) {
+        closeDrawer();
+      }
+    });
+
+    // Prevent body scroll when drawer is open
+    drawer.addEventListener('touchmove', function(e){
+      if (drawer.classList.contains('open')) {
+        e.preventDefault();
+      }
+    }, { passive: false });
+
+    // Mobile-specific touch handling
+    var startX = 0;
+    var startY = 0;
+    var isSwipe = false;
+
+    drawer.addEventListener('touchstart', function(e){
+      startX = e.touches[0].clientX;
+      startY = e.touches[0].clientY;
+      isSwipe = false;
+    }, { passive: true });
+
+    drawer.addEventListener('touchmove', function(e){
+      if (!drawer.classList.contains('open')) return;
+
+      var currentX = e.touches[0].clientX;
+      var currentY = e.touches[0].clientY;
+      var diffX = startX - currentX;
+      var diffY = startY - currentY;
+
+      // Detect horizontal swipe
+      if (Math.abs(diffX) > Math.abs(diffY) && Math.abs(diffX) > 50) {
+        isSwipe = true;
+        // Swipe right to close (since drawer is on the right)
+        if (diffX < -50) {
+          closeDrawer();
+        }
+      }
+    }, { passive: true });
+
+    // Handle drawer opening with swipe gesture
+    document.addEventListener('touchstart', function(e){
+      if (drawer.classList.contains('open')) return;
+
+      startX = e.touches[0].clientX;
+      startY = e.touches[0].clientY;
+    }, { passive: true });
+
+    document.addEventListener('touchmove', function(e){
+      if (drawer.classList.contains('open')) return;
+
+      var currentX = e.touches[0].clientX;
+      var currentY = e.touches[0].clientY;
+      var diffX = currentX - startX;
+      var diffY = currentY - startY;
+
+      // Detect swipe left from right edge
+      if (Math.abs(diffX) > Math.abs(diffY) && Math.abs(diffX) > 50 && startX > window.innerWidth - 50) {
+        openDrawer();
+      }
+    }, { passive: true });
+  }
+})();
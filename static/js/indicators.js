@@ -0,0 +1,42 @@
+(function () {
+  // Fill the shared indicators table (templates/_indicators.html) from the dashboard payload
+  var card = document.getElementById('indicators');
+  if (!card) return;
+
+  function pick(obj, path) {
+    return path.split('.').reduce(function (o, k) { return o == null ? undefined : o[k]; }, obj);
+  }
+
+  function format(key, value) {
+    if (value == null || !isFinite(value)) return '—';
+    if (/_pct$/.test(key)) return Number(value).toFixed(2) + '%';
+    return '$' + Number(value).toLocaleString('en-US', { maximumFractionDigits: 0 });
+  }
+
+  function render(e) {
+    var data = e.detail && e.detail.indicators;
+    if (!data) return;
+    var series = data.series || {};
+    card.querySelectorAll('[data-ind]').forEach(function (cell) {
+      var values = series[cell.getAttribute('data-ind')];
+      var key = cell.getAttribute('data-key');
+      cell.textContent = values ? format(key, pick(values, key)) : '—';
+    });
+    var asOf = card.querySelector('[data-ind-asof]');
+    var btc = series.btc_usd;
+    if (asOf) {
+      asOf.textContent = btc && btc.bar_start
+        ? new Date(btc.bar_start * 1000).toLocaleTimeString('fa-IR', { hour: '2-digit', minute: '2-digit' })
+        : 'در حال جمع‌آوری داده';
+    }
+  }
+
+  function renderUnavailable() {
+    card.querySelectorAll('[data-ind]').forEach(function (cell) {
+      if (cell.textContent === '...') cell.textContent = '—';
+    });
+  }
+
+  document.addEventListener('pplus:dashboard', render);
+  document.addEventListener('pplus:dashboard-error', renderUnavailable);
+})();
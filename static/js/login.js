@@ -0,0 +1,11 @@
+(function(){
+  var btn = document.getElementById('togglePass');
+  var input = document.getElementById('password');
+  if(btn && input){
+    btn.addEventListener('click', function(){
+      var type = input.getAttribute('type') === 'password' ? 'text' : 'password';
+      input.setAttribute('type', type);
+      btn.textContent = type === 'password' ? '👁️' : '🙈';
+    });
+  }
+})();
@@ -0,0 +1,238 @@
+(function () {
+  let usdToToman = Number(document.body.dataset.usdToToman) || 60000; // Toman per USD (server value)
+  var pageData = JSON.parse(document.getElementById('page-data').textContent);
+  var currentBtcBalance = Number(pageData.current_btc_balance);
+  var netInvestedUsd = Number(pageData.net_invested_usd);
+  var inceptionDays = Number(pageData.inception_days);
+
+  // Dashboard elements
+  var currentUsdEl = document.getElementById('current_usd');
+  var currentTomanEl = document.getElementById('current_toman');
+  var profitLossEl = document.getElementById('profit_loss');
+
+  // Apply USD rate from the shared dashboard payload
+  function applyUsdRate(data) {
+    if (data.usdt_toman && data.usdt_toman > 0) {
+      // USDT price in Toman, taken at par with USD
+      usdToToman = Math.round(data.usdt_toman);
+      console.log('USD rate updated:', usdToToman);
+
+      // Update all calculations with new rate
+      updateAllCalculations();
+    }
+  }
+
+  // Update all calculations with current USD rate
+  function updateAllCalculations() {
+    // Update current balance display
+    if (currentUsdEl && currentTomanEl) {
+      var currentUsd = currentBtcBalance * (currentPriceEl ? parseFloat(currentPriceEl.textContent.replace(/,/g, '')) : 0);
+      var currentToman = Math.round(currentUsd * usdToToman);
+
+      currentUsdEl.textContent = '$' + currentUsd.toFixed(2);
+      currentTomanEl.textContent = currentToman.toLocaleString('fa-IR') + ' تومان';
+    }
+
+    // Update profit/loss display
+    if (profitLossEl && profitLossTomanEl) {
+      var plUsd = (currentBtcBalance * (currentPriceEl ? parseFloat(currentPriceEl.textContent.replace(/,/g, '')) : 0)) - netInvestedUsd;
+      var plToman = Math.round(plUsd * usdToToman);
+
+      profitLossEl.textContent = (plUsd >= 0 ? '+' : '') + '$' + plUsd.toFixed(2);
+      profitLossTomanEl.textContent = (plToman >= 0 ? '+' : '') + plToman.toLocaleString('fa-IR') + ' تومان';
+
+      // Update colors
+      var isPositive = plUsd >= 0;
+      profitLossEl.style.color = isPositive ? '#059669' : '#dc2626';
+      profitLossTomanEl.style.color = isPositive ? '#059669' : '#dc2626';
+    }
+  }
+  var profitLossTomanEl = document.getElementById('profit_loss_toman');
+  var roiPercentageEl = document.getElementById('roi_percentage');
+  var currentPriceEl = document.getElementById('current_price');
+
+  // Real wallet balance elements
+  var realBtcEl = document.getElementById('real_btc');
+  var realUsdtEl = document.getElementById('real_usdt');
+  var realBtcUsdEl = document.getElementById('real_btc_usd');
+  var realBtcTomanEl = document.getElementById('real_btc_toman');
+  var realTotalUsdEl = document.getElementById('real_total_usd');
+  var realTotalTomanEl = document.getElementById('real_total_toman');
+  var btcAddressEl = document.getElementById('btc_address_display');
+  var usdtAddressEl = document.getElementById('usdt_address_display');
+
+  function renderRealBalance(data, priceData) {
+    try {
+
+      var realBtc = Number(data.btc_balance) || 0;
+      var realUsdt = Number(data.usdt_balance) || 0;
+      var btcAddress = data.btc_address || '';
+      var usdtAddress = data.usdt_address || '';
+
+      // Update real BTC balance
+      if (realBtcEl) {
+        realBtcEl.textContent = realBtc.toFixed(8);
+        realBtcEl.classList.remove('loading');
+      }
+
+      // Update real USDT balance
+      if (realUsdtEl) {
+        realUsdtEl.textContent = realUsdt.toFixed(2);
+        realUsdtEl.classList.remove('loading');
+      }
+
+      // Update addresses
+      if (btcAddressEl) {
+        btcAddressEl.textContent = btcAddress ? btcAddress.substring(0, 10) + '...' : 'تنظیم نشده';
+      }
+
+      if (usdtAddressEl) {
+        usdtAddressEl.textContent = usdtAddress ? usdtAddress.substring(0, 10) + '...' : 'تنظیم نشده';
+      }
+
+      // Calculate real BTC value in USD
+      var currentPrice = Number(priceData.btc_usdt) || 0;
+
+      if (currentPrice > 0) {
+        var realBtcUsd = realBtc * currentPrice;
+        var realBtcToman = realBtcUsd * usdToToman;
+        var realTotalUsd = realBtcUsd + realUsdt;
+        var realTotalToman = realTotalUsd * usdToToman;
+
+        if (realBtcUsdEl) {
+          realBtcUsdEl.textContent = '$' + realBtcUsd.toFixed(2);
+          realBtcUsdEl.classList.remove('loading');
+        }
+
+        if (realBtcTomanEl) {
+          realBtcTomanEl.textContent = realBtcToman.toLocaleString('fa-IR') + ' تومان';
+          realBtcTomanEl.classList.remove('loading');
+        }
+
+        if (realTotalUsdEl) {
+          realTotalUsdEl.textContent = '$' + realTotalUsd.toFixed(2);
+          realTotalUsdEl.classList.remove('loading');
+        }
+
+        if (realTotalTomanEl) {
+          realTotalTomanEl.textContent = realTotalToman.toLocaleString('fa-IR') + ' تومان';
+          realTotalTomanEl.classList.remove('loading');
+        }
+      }
+
+    } catch (e) {
+      console.error('Error fetching real balance:', e);
+      if (realBtcEl) realBtcEl.textContent = '—';
+      if (realUsdtEl) realUsdtEl.textContent = '—';
+      if (realBtcUsdEl) realBtcUsdEl.textContent = '—';
+      if (realBtcTomanEl) realBtcTomanEl.textContent = '—';
+      if (realTotalUsdEl) realTotalUsdEl.textContent = '—';
+      if (realTotalTomanEl) realTotalTomanEl.textContent = '—';
+    }
+  }
+
+  function renderPrice(data) {
+    try {
+      var price = Number(data.btc_usdt);
+      if (!isFinite(price)) throw new Error('bad price');
+
+      // Calculate current values
+      var holdUsd = currentBtcBalance * price;
+      var holdTmn = Math.round(holdUsd * usdToToman);
+
+      // Calculate P/L
+      var plUsd = holdUsd - netInvestedUsd;
+      var plTmn = Math.round(plUsd * usdToToman);
+
+      // Calculate ROI
+      var roi = 0;
+      if (netInvestedUsd > 0) {
+        roi = (plUsd / netInvestedUsd) * 100;
+      }
+
+      // Update elements
+      if (currentUsdEl) {
+        currentUsdEl.textContent = '$' + holdUsd.toFixed(2);
+        currentUsdEl.classList.remove('loading');
+      }
+
+      if (currentTomanEl) {
+        currentTomanEl.textContent = holdTmn.toLocaleString('fa-IR') + ' تومان';
+        currentTomanEl.classList.remove('loading');
+      }
+
+      if (profitLossEl) {
+        profitLossEl.textContent = '$' + plUsd.toFixed(2);
+        profitLossEl.style.color = plUsd >= 0 ? '#10b981' : '#ef4444';
+        profitLossEl.classList.remove('loading');
+      }
+
+      if (profitLossTomanEl) {
+        profitLossTomanEl.textContent = plTmn.toLocaleString('fa-IR') + ' تومان';
+        profitLossTomanEl.style.color = plUsd >= 0 ? '#10b981' : '#ef4444';
+        profitLossTomanEl.classList.remove('loading');
+      }
+
+      if (roiPercentageEl) {
+        roiPercentageEl.textContent = roi.toFixed(1) + '%';
+        roiPercentageEl.style.color = roi >= 0 ? '#10b981' : '#ef4444';
+      }
+
+      if (currentPriceEl) {
+        currentPriceEl.textContent = '$' + price.toFixed(2);
+        currentPriceEl.classList.remove('loading');
+      }
+
+    } catch (e) {
+      console.error('Price fetch error:', e);
+      if (currentUsdEl) currentUsdEl.textContent = '—';
+      if (currentTomanEl) currentTomanEl.textContent = '—';
+      if (profitLossEl) profitLossEl.textContent = '—';
+      if (profitLossTomanEl) profitLossTomanEl.textContent = '—';
+      if (currentPriceEl) currentPriceEl.textContent = '—';
+    }
+  }
+
+  function renderUnavailable() {
+    [currentUsdEl, currentTomanEl, profitLossEl, profitLossTomanEl, currentPriceEl,
+     realBtcEl, realUsdtEl, realBtcUsdEl, realBtcTomanEl, realTotalUsdEl, realTotalTomanEl].forEach(function (el) {
+      if (el) el.textContent = '—';
+    });
+  }
+
+  // Prices and wallet balances arrive in one /api/dashboard call made by base.html
+  document.addEventListener('pplus:dashboard', function (e) {
+    var payload = e.detail || {};
+    var prices = payload.prices || {};
+    if (payload.prices) {
+      renderPrice(prices);
+      applyUsdRate(prices);
+    }
+    if (payload.balances) renderRealBalance(payload.balances, prices);
+  });
+  document.addEventListener('pplus:dashboard-error', renderUnavailable);
+
+  // Auto-hide flashes after 3 seconds
+  var fb = document.getElementById('flashBox');
+  if (fb) {
+    setTimeout(function () {
+      var items = fb.querySelectorAll('.flash');
+      items.forEach(function (el) { el.classList.add('hide'); });
+      setTimeout(function () { fb.remove(); }, 400);
+    }, 3000);
+  }
+
+  // Add loading animation to elements that will be updated
+  var loadingElements = [currentUsdEl, currentTomanEl, profitLossEl, profitLossTomanEl, currentPriceEl, realBtcEl, realUsdtEl, realBtcUsdEl, realBtcTomanEl, realTotalUsdEl, realTotalTomanEl];
+  loadingElements.forEach(function(el) {
+    if (el) el.classList.add('loading');
+  });
+
+  // Remove loading animation after first update
+  setTimeout(function() {
+    loadingElements.forEach(function(el) {
+      if (el) el.classList.remove('loading');
+    });
+  }, 2000);
+
+})();
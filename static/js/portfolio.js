@@ -0,0 +1,30 @@
+function toggleForm(formId) {
+  const form = document.getElementById(formId);
+  if (form.style.display === 'none') {
+    form.style.display = 'block';
+    form.scrollIntoView({ behavior: 'smooth' });
+  } else {
+    form.style.display = 'none';
+  }
+}
+
+document.querySelectorAll('[data-toggle-form]').forEach(function(btn) {
+  btn.addEventListener('click', function() {
+    toggleForm(btn.dataset.toggleForm);
+  });
+});
+
+// Auto-hide forms after submission
+document.addEventListener('DOMContentLoaded', function() {
+  const forms = document.querySelectorAll('form');
+  forms.forEach(form => {
+    form.addEventListener('submit', function() {
+      setTimeout(() => {
+        const formContainer = form.closest('.form-container');
+        if (formContainer) {
+          formContainer.style.display = 'none';
+        }
+      }, 1000);
+    });
+  });
+});
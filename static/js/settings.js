@@ -0,0 +1,90 @@
+(function() {
+  const resetConfirmation = document.getElementById('reset_confirmation');
+  const resetBtn = document.getElementById('resetBtn');
+  const resetForm = document.getElementById('resetForm');
+
+  // Auto rate display
+  const currentUsdRate = document.getElementById('currentUsdRate');
+
+  // Show current USDT price from the shared dashboard payload (fetched once by base.html)
+  function renderUsdtPrice(e) {
+    var data = (e.detail && e.detail.prices) || {};
+    var price = Number(data.usdt_toman);
+    if (data.source !== 'fallback' && price > 0) {
+      currentUsdRate.textContent = price.toLocaleString('fa-IR') + ' تومان';
+      currentUsdRate.style.color = '#059669';
+    } else {
+      renderUsdtError();
+    }
+  }
+
+  function renderUsdtError() {
+    currentUsdRate.textContent = 'خطا در دریافت';
+    currentUsdRate.style.color = '#ef4444';
+  }
+
+  if (currentUsdRate) {
+    document.addEventListener('pplus:dashboard', renderUsdtPrice);
+    document.addEventListener('pplus:dashboard-error', renderUsdtError);
+  }
+
+  // Enable/disable reset button based on confirmation text
+  if (resetConfirmation) {
+    resetConfirmation.addEventListener('input', function() {
+      if (this.value === 'RESET SYSTEM') {
+        resetBtn.disabled = false;
+        resetBtn.textContent = '🗑️ ریست کامل سیستم';
+      } else {
+        resetBtn.disabled = true;
+        resetBtn.textContent = '🗑️ ریست کامل سیستم';
+      }
+    });
+  }
+
+  // Double confirmation before reset
+  if (resetBtn) {
+    resetBtn.addEventListener('click', function(e) {
+      e.preventDefault();
+
+      if (resetConfirmation.value !== 'RESET SYSTEM') {
+        alert('لطفاً عبارت "RESET SYSTEM" را دقیقاً تایپ کنید!');
+        return;
+      }
+
+      // First confirmation
+      const firstConfirm = confirm(
+        '⚠️ هشدار: این عمل تمام داده‌های شما را حذف می‌کند!\n\n' +
+        'آیا مطمئن هستید که می‌خواهید سیستم را ریست کنید؟\n\n' +
+        'این عمل غیرقابل بازگشت است!'
+      );
+
+      if (!firstConfirm) return;
+
+      // Second confirmation
+      const secondConfirm = confirm(
+        '🚨 تایید نهایی:\n\n' +
+        'تمام معاملات، واریزها، برداشت‌ها، تنظیمات و پورتفولیو حذف خواهد شد!\n\n' +
+        'آیا واقعاً مطمئن هستید؟'
+      );
+
+      if (!secondConfirm) return;
+
+      // Third confirmation with typing
+      const finalConfirm = prompt(
+        'برای تایید نهایی، عبارت "DELETE ALL DATA" را تایپ کنید:'
+      );
+
+      if (finalConfirm !== 'DELETE ALL DATA') {
+        alert('عبارت اشتباه! ریست لغو شد.');
+        return;
+      }
+
+      // Show loading state
+      resetBtn.disabled = true;
+      resetBtn.textContent = '⏳ در حال ریست...';
+
+      // Submit form
+      resetForm.submit();
+    });
+  }
+})();
@@ -1,38 +1,168 @@
-const CACHE_NAME = 'pplus-cache-v1';
-const OFFLINE_URLS = [
-  '/',
-  '/panel',
-  '/static/manifest.webmanifest',
-];
+// P+ service worker
+// - cache names carry the deployment id (?v= on the registration URL); old caches are dropped on activate
+// - navigations: network-first with a short timeout, cached copy when offline/slow
+// - /assets/*: cache-first (file names are content hashes)
+// - /api/* GET: stale-while-revalidate using the time the response was stored and a per-endpoint max-age;
+//   requests made with cache: 'no-store' (live polling) go to the network first
+// - /api/purchases, /api/withdrawals are cached like the other endpoints: their rows carry Toman values at
+//   each trade's rate (fx.py), which only the server can compute
+
+const VERSION = new URL(self.location).searchParams.get('v') || 'dev';
+const CACHE_PREFIX = 'pplus-';
+const PAGES_CACHE = CACHE_PREFIX + 'pages-' + VERSION;
+const API_CACHE = CACHE_PREFIX + 'api-' + VERSION;
+const ASSETS_CACHE = CACHE_PREFIX + 'assets';
+const PRECACHE_URLS = ['/static/manifest.webmanifest'];
+
+const NETWORK_TIMEOUT_MS = 3000;
+const FETCHED_AT_HEADER = 'sw-fetched-at';
+
+// Seconds a stored API response counts as fresh (overridden by a Cache-Control max-age from the server)
+const API_MAX_AGE = {
+  '/api/dashboard': 15,
+  '/api/price': 15,
+  '/api/summary': 30,
+  '/api/wallet_balance': 60,
+};
+const API_DEFAULT_MAX_AGE = 30;
+
+// IndexedDB copy of the ledger kept by earlier versions; deleted on activate and logout
+const LEDGER_DB = 'pplus-ledger';
 
 self.addEventListener('install', (event) => {
   event.waitUntil(
-    caches.open(CACHE_NAME).then((cache) => cache.addAll(OFFLINE_URLS))
+    caches.open(PAGES_CACHE)
+      .then((cache) => cache.addAll(PRECACHE_URLS))
+      .then(() => self.skipWaiting())
   );
 });
 
 self.addEventListener('activate', (event) => {
+  const keep = [PAGES_CACHE, API_CACHE, ASSETS_CACHE];
   event.waitUntil(
-    caches.keys().then((keys) => Promise.all(keys.filter(k => k !== CACHE_NAME).map(k => caches.delete(k))))
+    caches.keys()
+      .then((keys) => Promise.all(keys.filter((k) => !keep.includes(k)).map((k) => caches.delete(k))))
+      .then(() => deleteLedger().catch(() => null))
+      .then(() => self.clients.claim())
   );
 });
 
 self.addEventListener('fetch', (event) => {
-  const url = new URL(event.request.url);
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
 
-  // Network-first for API
-  if (url.pathname.startsWith('/api/')) {
-    event.respondWith(
-      fetch(event.request).catch(() => caches.match(event.request))
-    );
+  if (request.method !== 'GET') {
+    event.respondWith(handleWrite(request));
     return;
   }
-
-  // Cache-first for navigations and static
-  if (event.request.mode === 'navigate' || url.pathname.startsWith('/static/')) {
-    event.respondWith(
-      caches.match(event.request).then((cached) => cached || fetch(event.request))
-    );
+  if (url.pathname.startsWith('/assets/')) {
+    event.respondWith(cacheFirst(request));
     return;
   }
+  if (url.pathname.startsWith('/api/')) {
+    if (url.search.includes('since')) return;  // delta requests always hit the network
+    if (request.cache === 'no-store' || request.cache === 'reload') {
+      event.respondWith(networkFirst(request, API_CACHE));
+    } else {
+      event.respondWith(staleWhileRevalidate(event, request, url));
+    }
+    return;
+  }
+  if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(request, PAGES_CACHE));
+  }
 });
+
+// ---------------------------------------------------------------------------
+// Strategies
+// ---------------------------------------------------------------------------
+function fetchWithTimeout(request, timeoutMs) {
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), timeoutMs);
+  return fetch(request, { signal: controller.signal }).finally(() => clearTimeout(timer));
+}
+
+async function store(cacheName, request, response) {
+  if (!response.ok || response.redirected || response.type !== 'basic') return;
+  const headers = new Headers(response.headers);
+  headers.set(FETCHED_AT_HEADER, String(Date.now()));
+  const body = await response.clone().blob();
+  const cache = await caches.open(cacheName);
+  await cache.put(request, new Response(body, { status: response.status, statusText: response.statusText, headers }));
+}
+
+async function cacheFirst(request) {
+  const cached = await caches.match(request, { cacheName: ASSETS_CACHE });
+  if (cached) return cached;
+  const response = await fetch(request);
+  if (response.ok) {
+    const cache = await caches.open(ASSETS_CACHE);
+    await cache.put(request, response.clone());
+  }
+  return response;
+}
+
+async function networkFirst(request, cacheName) {
+  try {
+    const response = await fetchWithTimeout(request, NETWORK_TIMEOUT_MS);
+    if (await handleLoggedOut(response)) return response;
+    await store(cacheName, request, response);
+    return response;
+  } catch (e) {
+    const cached = await caches.match(request, { cacheName });
+    if (cached) return cached;
+    throw e;
+  }
+}
+
+function maxAgeFor(url, response) {
+  const match = /max-age=(\d+)/.exec(response.headers.get('Cache-Control') || '');
+  if (match) return Number(match[1]);
+  return API_MAX_AGE[url.pathname] !== undefined ? API_MAX_AGE[url.pathname] : API_DEFAULT_MAX_AGE;
+}
+
+async function staleWhileRevalidate(event, request, url) {
+  const cached = await caches.match(request, { cacheName: API_CACHE });
+  const revalidate = () => fetch(request).then(async (response) => {
+    await store(API_CACHE, request, response);
+    return response;
+  });
+  if (!cached) return revalidate();
+  const ageSeconds = (Date.now() - Number(cached.headers.get(FETCHED_AT_HEADER) || 0)) / 1000;
+  if (ageSeconds >= maxAgeFor(url, cached)) {
+    event.waitUntil(revalidate().catch(() => null));
+  }
+  return cached;
+}
+
+async function handleWrite(request) {
+  const response = await fetch(request);
+  if (await handleLoggedOut(response)) return response;
+  if (response.ok || response.redirected) {
+    // Any successful write can change what the API returns
+    await caches.delete(API_CACHE);
+  }
+  return response;
+}
+
+async function handleLoggedOut(response) {
+  if (!response.redirected || new URL(response.url).pathname !== '/login') return false;
+  // Session ended: drop everything that was stored for the signed-in user
+  const keys = await caches.keys();
+  await Promise.all(keys.filter((k) => k.startsWith(CACHE_PREFIX) && k !== ASSETS_CACHE).map((k) => caches.delete(k)));
+  await deleteLedger().catch(() => null);
+  return true;
+}
+
+// ---------------------------------------------------------------------------
+// IndexedDB ledger (no longer used)
+// ---------------------------------------------------------------------------
+function deleteLedger() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.deleteDatabase(LEDGER_DB);
+    request.onsuccess = () => resolve();
+    request.onerror = () => reject(request.error);
+    request.onblocked = () => resolve();
+  });
+}
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+شبیه‌ساز «اگر بفروشم؟» روی وضعیت فعلی لات‌های باز
+
+وضعیت پایه (لات‌های باز هر روش به ترتیب مصرف، به شکل جمع‌های پیشوندی lots.LotCurve) از کش
+costbasis برای همان data_version خوانده می‌شود. هر سناریو فقط یک «لایه» کوچک روی آن است:
+مقدار ساتوشی مصرف‌شده از ابتدای منحنی پایه و لیست خریدهای فرضی همان سناریو؛ صف لات‌ها کپی
+نمی‌شود و دیتابیس لمس نمی‌شود. هزینه هر برداشت فرضی O(log n) است، پس یک شبکه قیمت × مقدار
+برای نقشه حرارتی در چند میلی‌ثانیه ساخته می‌شود.
+
+ورودی‌ها در لبه به ساتوشی/میکرودلار تبدیل می‌شوند و همه محاسبات با عدد صحیح است (money.py).
+"""
+
+from typing import Any, Dict, List, Optional
+
+from costbasis import open_state
+from lots import LotCurve
+from money import btc, cost_micro, to_micro, to_sat, usd
+
+MAX_SCENARIOS = 1000
+MAX_TRADES_PER_SCENARIO = 100
+MAX_GRID_AXIS = 200
+
+
+class Scenario:
+    """Hypothetical trades applied on top of a base lot curve (never modified); amounts in sat, USD in micro."""
+
+    def __init__(self, method: str, base: Dict[str, Any]):
+        self.method = method
+        self.curve: LotCurve = base["curve"]
+        self.used = 0  # sat consumed from the start of the base curve
+        self.extra: List[List[int]] = []  # hypothetical buys: [sat, price_micro, cost_micro]
+        self.realized = 0
+        self.open_sat = self.curve.total_sat
+        self.open_cost = self.curve.total_cost
+        self.bought = 0
+        self.sold = 0
+        self.unmatched = 0
+        self._consumed = 0  # sat matched by the withdrawal in progress
+
+    def buy(self, amount: int, price: int) -> None:
+        cost = cost_micro(amount, price)
+        self.open_sat += amount
+        self.open_cost += cost
+        self.bought += cost
+        if self.method != "average":
+            self.extra.append([amount, price, cost])
+
+    def _take_base(self, amount: int) -> int:
+        """Consume up to `amount` sat from the base curve; returns its cost."""
+        amount = min(amount, self.curve.total_sat - self.used)
+        if amount <= 0:
+            return 0
+        cost = self.curve.cost(self.used + amount) - self.curve.cost(self.used)
+        self.used += amount
+        self._consumed += amount
+        return cost
+
+    def _take_extra(self, index: int, amount: int) -> int:
+        lot = self.extra[index]
+        amount = min(amount, lot[0])
+        cost = lot[2] if amount == lot[0] else lot[2] * amount // lot[0]
+        lot[0] -= amount
+        lot[2] -= cost
+        if not lot[0]:
+            self.extra.pop(index)
+        self._consumed += amount
+        return cost
+
+    def sell(self, amount: int, price: int) -> None:
+        proceeds = cost_micro(amount, price)
+        self.sold += proceeds
+        self._consumed = 0
+        if self.method == "average":
+            matched = min(amount, self.open_sat)
+            cost = self.open_cost if matched == self.open_sat else self.open_cost * matched // self.open_sat
+            self._consumed = matched
+        elif self.method == "fifo":
+            # Hypothetical buys are newer than every open lot
+            cost = self._take_base(amount)
+            while amount > self._consumed and self.extra:
+                cost += self._take_extra(0, amount - self._consumed)
+        elif self.method == "lifo":
+            cost = 0
+            while amount > self._consumed and self.extra:
+                cost += self._take_extra(len(self.extra) - 1, amount - self._consumed)
+            cost += self._take_base(amount - self._consumed)
+        else:  # hifo: merge the (descending) base curve with the hypothetical buys by price
+            cost = 0
+            while amount > self._consumed:
+                best = max(range(len(self.extra)), key=lambda i: self.extra[i][1], default=None)
+                base_price = self.curve.price_at(self.used)
+                if best is not None and (base_price is None or self.extra[best][1] > base_price):
+                    cost += self._take_extra(best, amount - self._consumed)
+                elif base_price is not None:
+                    limit = self.curve.amount_before_price_below(self.extra[best][1], self.used) if best is not None else amount
+                    cost += self._take_base(min(amount - self._consumed, max(limit, 1)))
+                else:
+                    break
+        matched = self._consumed
+        self.realized += (proceeds if matched == amount else proceeds * matched // amount) - cost
+        self.open_sat -= matched
+        self.open_cost -= cost
+        self.unmatched += amount - matched
+
+    def result(self, base: Dict[str, Any], mark_price: Optional[float]) -> Dict[str, Any]:
+        open_btc, open_cost = btc(self.open_sat), usd(self.open_cost)
+        realized = usd(self.realized)
+        unrealized = open_btc * mark_price - open_cost if mark_price else None
+        total_pnl = base["realized_pnl_usd"] + realized + unrealized if unrealized is not None else None
+        net_invested = base["purchased_usd"] + usd(self.bought) - base["withdrawn_usd"] - usd(self.sold)
+        return {
+            "realized_pnl_usd": realized,
+            "remaining_btc": open_btc,
+            "remaining_cost_usd": open_cost,
+            "average_cost_usd": open_cost / open_btc if self.open_sat else None,
+            "mark_price_usd": mark_price,
+            "unrealized_pnl_usd": unrealized,
+            "total_pnl_usd": total_pnl,
+            "roi_percentage": total_pnl / net_invested * 100 if total_pnl is not None and net_invested > 0 else None,
+            "unmatched_btc": btc(self.unmatched),
+        }
+
+
+def _number(value: Any, name: str) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not number > 0 or number == float("inf"):
+        raise ValueError(f"{name} must be > 0")
+    return number
+
+
+def _sat(value: Any, name: str) -> int:
+    amount = to_sat(_number(value, name))
+    if amount <= 0:
+        raise ValueError(f"{name} must be at least 1 satoshi")
+    return amount
+
+
+def run_scenarios(method: str, wallet_id: Optional[int], scenarios: List[Dict[str, Any]], current_price: Optional[float]) -> List[Dict[str, Any]]:
+    """Each scenario: {"trades": [{"side": "sell"|"buy", "amount_btc", "price_usd"}], "mark_price_usd"?}."""
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"at most {MAX_SCENARIOS} scenarios per request")
+    base = open_state(method, wallet_id)
+    results = []
+    for i, spec in enumerate(scenarios):
+        trades = spec.get("trades") or []
+        if not trades or len(trades) > MAX_TRADES_PER_SCENARIO:
+            raise ValueError(f"scenario {i}: 1..{MAX_TRADES_PER_SCENARIO} trades required")
+        scenario = Scenario(method, base)
+        last_price = None
+        for trade in trades:
+            side = trade.get("side", "sell")
+            if side not in ("sell", "buy"):
+                raise ValueError(f"scenario {i}: side must be sell or buy")
+            amount = _sat(trade.get("amount_btc"), "amount_btc")
+            last_price = _number(trade.get("price_usd"), "price_usd")
+            if side == "sell":
+                scenario.sell(amount, to_micro(last_price))
+            else:
+                scenario.buy(amount, to_micro(last_price))
+        mark = spec.get("mark_price_usd")
+        mark_price = _number(mark, "mark_price_usd") if mark is not None else (last_price or current_price)
+        results.append(scenario.result(base, mark_price))
+    return results
+
+
+def withdrawal_grid(method: str, wallet_id: Optional[int], amounts: List[Any], prices: List[Any]) -> Dict[str, Any]:
+    """Single withdrawal of every amount at every price (sale price is also the mark price)."""
+    if not amounts or not prices or len(amounts) > MAX_GRID_AXIS or len(prices) > MAX_GRID_AXIS:
+        raise ValueError(f"grid amounts and prices need 1..{MAX_GRID_AXIS} values each")
+    amounts_sat = [_sat(a, "amount_btc") for a in amounts]
+    prices_micro = [to_micro(_number(p, "price_usd")) for p in prices]
+    base = open_state(method, wallet_id)
+    curve = base["curve"]
+    open_sat = curve.total_sat
+    realized, roi = [], []
+    remaining_cost = []
+    for amount in amounts_sat:
+        matched = min(amount, open_sat)
+        if method == "average":
+            cost = curve.total_cost if matched == open_sat else curve.total_cost * matched // open_sat
+        else:
+            cost = curve.cost(matched)  # O(log n), shared by every price of this row
+        left_sat, left_cost = open_sat - matched, curve.total_cost - cost
+        remaining_cost.append(usd(left_cost))
+        realized_row, roi_row = [], []
+        for price in prices_micro:
+            gain = usd(cost_micro(matched, price) - cost)
+            total_pnl = base["realized_pnl_usd"] + gain + usd(cost_micro(left_sat, price) - left_cost)
+            net_invested = base["purchased_usd"] - base["withdrawn_usd"] - usd(cost_micro(amount, price))
+            realized_row.append(gain)
+            roi_row.append(total_pnl / net_invested * 100 if net_invested > 0 else None)
+        realized.append(realized_row)
+        roi.append(roi_row)
+    return {
+        "amounts_btc": [btc(a) for a in amounts_sat],
+        "prices_usd": [usd(p) for p in prices_micro],
+        "open_btc": btc(open_sat),
+        "realized_pnl_usd": realized,
+        "remaining_cost_usd": remaining_cost,
+        "roi_percentage": roi,
+    }